@@ -1,17 +1,12 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.utils import secure_filename
-import os
 from controllers.conversion_controller import handle_conversion_request
-from utils.common import read_config
+from models.xtf_model import select_entities
+from models.ifc_model import check_ifc_entities
+from utils.common import read_config, check_tile_size
 
 # Blueprint API
 api = Blueprint('api', __name__)
 
-# Define upload folder and create it if it doesn't exist
-UPLOAD_FOLDER = '/tmp/uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-
 # Global variable for current configuration, initialized with default values
 current_config = read_config()
 
@@ -21,25 +16,22 @@ def convert():
     if 'xtfFiles' not in request.files:
         return jsonify({'error': 'Keine Dateien ausgewählt'}), 400
     
-    files = request.files.getlist('xtfFiles')
-    
     # Create a copy of the current configuration and update with values from the request
     config = current_config.copy()
     for key in config.keys():
         if key in request.form:
             config[key] = type(config[key])(request.form.get(key))
     
-    # Save uploaded files
-    saved_files = []
-    for file in files:
-        if file and file.filename.endswith('.xtf'):
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(file_path)
-            saved_files.append(file_path)
-    
-    # Perform conversion
-    result = handle_conversion_request(config, saved_files)
+    # Optional selection of object classes to convert
+    include, exclude = request.form.get('include'), request.form.get('exclude')
+    try:
+        check_ifc_entities(select_entities(include, exclude))
+        config['tile_size'] = check_tile_size(config['tile_size'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Perform conversion; the controller parses the uploads through the shared parse cache
+    result = handle_conversion_request(config, request.files, include=include, exclude=exclude)
     
     return jsonify(result)
 
@@ -5,15 +5,19 @@ import os
 import time
 import signal
 import sys
-from controllers.conversion_controller import handle_conversion_request, BASE_TEMP_DIR
+from controllers.conversion_controller import handle_conversion_request, allowed_file, preflight_error, upload_limit_error, upload_source, spool_upload, spool_path, BASE_TEMP_DIR
 from utils.cleanup import cleanup_old_files, remove_pycache
-from utils.common import read_config
+from utils.common import read_config, check_lod, check_tile_size
 import threading
-from models.xtf_model import XTFParser
+from utils.parse_cache import parse_cache
+from utils.json_provider import RecordJSONProvider
+from models.xtf_model import XTFParser, select_entities
+from models.ifc_model import check_ifc_entities
 
 app = Flask(__name__, 
             template_folder='views/templates',
             static_folder='views/static')
+app.json = RecordJSONProvider(app)
 
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
@@ -36,6 +40,9 @@ def index():
 
 @app.route('/convert', methods=['POST'])
 def convert():
+    if 'xtfFiles' not in request.files:
+        return jsonify({'error': 'Keine Dateien ausgewählt'}), 400
+
     config_values = read_config()
     config = {
         'default_sohlenkote': float(request.form.get('default_sohlenkote', config_values['default_sohlenkote'])),
@@ -44,11 +51,30 @@ def convert():
         'default_wanddicke': float(request.form.get('default_wanddicke', config_values['default_wanddicke'])),
         'default_bodendicke': float(request.form.get('default_bodendicke', config_values['default_bodendicke'])),
         'default_rohrdicke': float(request.form.get('default_rohrdicke', config_values['default_rohrdicke'])),
-        'einfaerben': request.form.get('einfaerben', config_values['einfaerben']) == 'true'
+        'einfaerben': request.form.get('einfaerben', config_values['einfaerben']) == 'true',
+        'max_objects': config_values['max_objects'],
+        'parse_workers': config_values['parse_workers'],
+        'incremental': request.form.get('incremental', str(config_values['incremental']).lower()) == 'true',
+        'tile_size': request.form.get('tile_size', config_values['tile_size']),
+        'tile_workers': config_values['tile_workers'],
+        'streaming_writer': config_values['streaming_writer'],
+        'stable_guids': config_values['stable_guids'],
+        'lod': request.form.get('lod', config_values['lod'])
     }
 
+    # Optional selection of object classes, e.g. include=Haltung,Normschacht or exclude=Kanal
+    include, exclude = request.form.get('include'), request.form.get('exclude')
+    try:
+        check_ifc_entities(select_entities(include, exclude))
+        # Level of detail of the geometry: lod0, lod1 or full
+        config['lod'] = check_lod(config['lod'])
+        # Tile edge length in metres, 0 for a single file
+        config['tile_size'] = check_tile_size(config['tile_size'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
-        result = handle_conversion_request(config, request.files)
+        result = handle_conversion_request(config, request.files, include=include, exclude=exclude)
         return jsonify(result)
     except Exception as e:
         logging.error(f"Fehler bei der Konvertierung: {e}", exc_info=True)
@@ -64,24 +90,36 @@ def extract_data():
         return jsonify({'error': 'Keine Datei ausgewählt'}), 400
     
     config_values = read_config()
-    parser = XTFParser()
     all_data = {'models': {}}
 
+    include, exclude = request.form.get('include'), request.form.get('exclude')
+    try:
+        select_entities(include, exclude)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         for file in files:
             logging.info(f"Processing file: {file.filename}")
-            if file and file.filename.endswith('.xtf'):
-                filename = os.path.join(BASE_TEMP_DIR, file.filename)
-                file.save(filename)
-                
-                data = parser.parse(filename, config_values)
+            if file and allowed_file(file.filename):
+                source = upload_source(file)
+                try:
+                    limit_error = upload_limit_error(source, config_values)
+                    if limit_error:
+                        return jsonify({'error': f'Datei {file.filename} abgelehnt: {limit_error}'}), 413
+
+                    # Das Ergebnis bleibt unter dem Dateinamen im Cache, damit es für DataTables verfügbar ist
+                    data, _ = parse_cache.parse(source, config_values, name=file.filename, include=include, exclude=exclude)
+                    # Kopie für DataTables, falls das Ergebnis nicht im Cache bleibt
+                    if not parse_cache.cached(file.filename, config_values):
+                        spool_upload(file)
+                finally:
+                    if source is not file.stream:
+                        source.close()
                 model_name = data.get('model', 'Unbekanntes Modell')
                 logging.info(f"Extracted model: {model_name}")
                 all_data['models'][model_name] = data
 
-                # Temporäre Datei nicht löschen, damit sie für DataTables verfügbar bleibt
-                # os.remove(filename)
-
         logging.info(f"All extracted models: {list(all_data['models'].keys())}")
         logging.info(f"Extracted data: {json.dumps(all_data, default=str, indent=2)}")
         return jsonify(all_data)
@@ -89,21 +127,41 @@ def extract_data():
         logger.error(f"Fehler beim Parsen der XTF-Datei(en): {str(e)}", exc_info=True)
         return jsonify({'error': f'Fehler beim Parsen der XTF-Datei(en): {str(e)}'}), 500
 
+@app.route('/preflight', methods=['POST'])
+def preflight():
+    # Pre-flight estimate (model, object counts, runtime, memory) without parsing or storing the files
+    if 'xtfFile' not in request.files:
+        return jsonify({'error': 'Keine Datei ausgewählt'}), 400
+
+    config_values = read_config()
+    count = request.form.get('count', 'true') == 'true'
+    estimates = {}
+
+    try:
+        for file in request.files.getlist('xtfFile'):
+            if file and allowed_file(file.filename):
+                estimate = XTFParser().preflight(file.stream, count=count)
+                estimate['error'] = preflight_error(estimate, config_values)
+                estimate['accepted'] = estimate['error'] is None
+                estimates[file.filename] = estimate
+        return jsonify({'files': estimates})
+    except Exception as e:
+        logger.error(f"Fehler bei der Vorabprüfung: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Fehler bei der Vorabprüfung: {str(e)}'}), 500
+
 @app.route('/get_datatable_data', methods=['GET'])
 def get_datatable_data():
     filename = request.args.get('filename')
     if not filename:
         return jsonify({'error': 'Kein Dateiname angegeben'}), 400
 
-    file_path = os.path.join(BASE_TEMP_DIR, filename)
-    if not os.path.exists(file_path):
-        return jsonify({'error': 'Datei nicht gefunden'}), 404
-
     config_values = read_config()
-    parser = XTFParser()
 
     try:
-        data = parser.parse(file_path, config_values)
+        result = parse_cache.lookup(filename, config_values, spool_path(filename))
+        if result is None:
+            return jsonify({'error': 'Datei nicht gefunden'}), 404
+        data, _ = result
         return jsonify(data)
     except Exception as e:
         logger.error(f"Fehler beim Parsen der Datei {filename}: {str(e)}", exc_info=True)
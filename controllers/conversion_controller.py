@@ -1,23 +1,70 @@
+import io
 import os
+import mmap
 import tempfile
 import logging
 from werkzeug.utils import secure_filename
+from utils.parse_cache import parse_cache
 from models.xtf_model import XTFParser
+from models.xtf_source import is_xtf_filename, xtf_stem
 from models.ifc_model import create_ifc
+from models.ifc_delta import update_ifc
+from models.ifc_tiles import create_ifc_tiles, tile_index_name
 import time
 
 logger = logging.getLogger(__name__)
 
 # Shared variables
 BASE_TEMP_DIR = os.path.join(tempfile.gettempdir(), 'ifc_converter_temp')
-ALLOWED_EXTENSIONS = {'xtf'}
 FILE_LIFETIME = 600  # 10 minutes
 
 if not os.path.exists(BASE_TEMP_DIR):
     os.makedirs(BASE_TEMP_DIR)
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    # Plain XTF files and XTF files compressed as .xtf.gz, .xtf.bz2 or .zip
+    return is_xtf_filename(filename)
+
+def preflight_error(estimate, config):
+    # Error message if the pre-flight estimate exceeds the configured object limit, else None
+    max_objects = config.get('max_objects', 0)
+    if max_objects and estimate['objects'] is not None and estimate['objects'] > max_objects:
+        return f"Datei enthält {estimate['objects']} Objekte, erlaubt sind höchstens {max_objects}."
+    return None
+
+def upload_limit_error(source, config):
+    # Object limit check of an upload before parsing; without max_objects the pre-flight scan,
+    # a full extra read of the file, is skipped
+    if not config.get('max_objects', 0):
+        return None
+    return preflight_error(XTFParser().preflight(source), config)
+
+def upload_source(file):
+    # Source to parse an upload from without storing it: an mmap of the upload's file when it
+    # is already on disk, otherwise the upload stream (e.g. an in-memory BytesIO)
+    stream = file.stream
+    if not getattr(stream, '_rolled', True):
+        # SpooledTemporaryFile still held in memory; fileno() would write it to disk
+        return stream
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return stream
+    try:
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Empty file or a handle that cannot be mapped
+        return stream
+
+def spool_path(filename):
+    # Location of the spooled copy of an upload in BASE_TEMP_DIR
+    return os.path.join(BASE_TEMP_DIR, secure_filename(filename))
+
+def spool_upload(file):
+    # Keep a copy of the upload so later requests (DataTables) can parse it again when the
+    # result is not, or no longer, in the parse cache; cleanup_old_files removes it
+    file.stream.seek(0)
+    file.save(spool_path(file.filename))
 
 def list_directory(path):
     try:
@@ -26,7 +73,8 @@ def list_directory(path):
     except FileNotFoundError:
         logger.error(f"Directory not found: {path}")
 
-def handle_conversion_request(config, files):
+def handle_conversion_request(config, files, include=None, exclude=None):
+    # Convert the uploaded XTF files; include/exclude select the object classes to convert
     if 'xtfFiles' not in files:
         return {'error': 'Keine Dateien ausgewählt'}, 400
     
@@ -39,20 +87,39 @@ def handle_conversion_request(config, files):
     for file in files:
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            xtf_path = os.path.join(BASE_TEMP_DIR, filename)
+            source = upload_source(file)
 
             try:
-                file.save(xtf_path)
-                # logger.info(f'File saved to {xtf_path}')
-                list_directory(BASE_TEMP_DIR)
+                limit_error = upload_limit_error(source, config)
+                if limit_error:
+                    logger.error(f'Datei {filename} abgelehnt: {limit_error}')
+                    errors.append(f'Datei {filename} abgelehnt: {limit_error}')
+                    continue
 
-                parser = XTFParser()
-                data = parser.parse(xtf_path, config)
-                
-                ifc_filename = os.path.splitext(filename)[0] + '.ifc'
+                data, index = parse_cache.parse(source, config, streaming=True, include=include, exclude=exclude)
+                if 'error' in data['min_coordinates']:
+                    # No coordinates of the selected objects to place the project origin at
+                    logger.error(f'Datei {filename}: {data["min_coordinates"]["error"]}')
+                    errors.append(f'Datei {filename} nicht konvertiert: keine Koordinaten für den Projektursprung gefunden')
+                    continue
+
+                if config.get('tile_size'):
+                    # One IFC file per tile plus the tile index, each offered for download
+                    stem = xtf_stem(filename)
+                    tile_index = create_ifc_tiles(BASE_TEMP_DIR, stem, data, index, config['tile_size'],
+                                                  config.get('tile_workers', 0), config.get('incremental', False))
+                    for name in [tile_index_name(stem)] + [tile['file'] for tile in tile_index['tiles']]:
+                        converted_files.append(name)
+                        download_links.append({'url': f'/download/{name}', 'filename': name})
+                    continue
+
+                ifc_filename = xtf_stem(filename) + '.ifc'
                 ifc_path = os.path.join(BASE_TEMP_DIR, ifc_filename)
                 
-                create_ifc(ifc_path, data)
+                if config.get('incremental'):
+                    update_ifc(ifc_path, data, index)
+                else:
+                    create_ifc(ifc_path, data, index)
                 time.sleep(1)  # Wait for a second to ensure file is created
 
                 if os.path.exists(ifc_path):
@@ -71,10 +138,8 @@ def handle_conversion_request(config, files):
                 logger.error(f'Fehler bei der Konvertierung von {filename}: {str(e)}')
                 errors.append(f'Fehler bei der Konvertierung von {filename}: {str(e)}')
             finally:
-                if os.path.exists(xtf_path):
-                    os.remove(xtf_path)
-                else:
-                    logger.error(f'Failed to remove XTF file: {xtf_path}')
+                if source is not file.stream:
+                    source.close()
 
     return prepare_response(converted_files, errors, download_links)
 
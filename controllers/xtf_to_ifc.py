@@ -1,28 +1,60 @@
 import logging
 import os
 import sys
+import argparse
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import shutil
-from models.xtf_model import XTFParser
-from models.ifc_model import create_ifc
-from utils.common import read_config
+from models.xtf_model import XTFParser, select_entities
+from models.xtf_source import is_xtf_filename, xtf_stem
+from models.ifc_model import create_ifc, check_ifc_entities
+from models.ifc_delta import update_ifc
+from models.ifc_tiles import create_ifc_tiles
+from utils.common import read_config, check_lod, check_tile_size, LOD_MODES
 
 def setup_logging():
     logging.basicConfig(level=logging.DEBUG, 
                         format='%(asctime)s - %(levelname)s - %(message)s', 
                         datefmt='%Y-%m-%d %H:%M:%S')
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Konvertiert XTF-Dateien in IFC-Dateien.")
+    parser.add_argument('--include', help="Nur diese Objektklassen konvertieren, z.B. Haltung,Normschacht")
+    parser.add_argument('--exclude', help="Diese Objektklassen nicht konvertieren, z.B. Kanal")
+    parser.add_argument('--lod', help=f"Detailstufe der Geometrie ({', '.join(LOD_MODES)}), überschreibt die Konfiguration")
+    parser.add_argument('--tile-size', help="Kantenlänge der Kacheln in Metern (0 = eine Datei), überschreibt die Konfiguration")
+    args = parser.parse_args(argv)
+    try:
+        check_ifc_entities(select_entities(args.include, args.exclude))
+        if args.lod is not None:
+            args.lod = check_lod(args.lod)
+        if args.tile_size is not None:
+            args.tile_size = check_tile_size(args.tile_size)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
 def get_xtf_files(xtf_path):
     if os.path.isdir(xtf_path):
-        return [os.path.join(xtf_path, file) for file in os.listdir(xtf_path) if file.endswith('.xtf')]
+        return [os.path.join(xtf_path, file) for file in os.listdir(xtf_path) if is_xtf_filename(file)]
     return [xtf_path]
 
-def convert_xtf_to_ifc(xtf_file, ifc_file, config):
+def convert_xtf_to_ifc(xtf_file, ifc_file, config, include=None, exclude=None):
     parser = XTFParser()
-    data = parser.parse(xtf_file, config)
+    data = parser.parse(xtf_file, config, streaming=True, include=include, exclude=exclude)
+
+    if config.get('tile_size'):
+        output_folder, ifc_file_name = os.path.split(ifc_file)
+        tile_index = create_ifc_tiles(output_folder, os.path.splitext(ifc_file_name)[0], data, parser.index,
+                                      config['tile_size'], config.get('tile_workers', 0), config.get('incremental', False))
+        logging.info(f"{len(tile_index['tiles'])} IFC tiles saved in: {output_folder}")
+        return
 
-    create_ifc(ifc_file, data)
-    logging.info(f"IFC file saved: {ifc_file}")
+    if config.get('incremental'):
+        summary = update_ifc(ifc_file, data, parser.index)
+        logging.info(f"IFC file updated ({summary['mode']}): {ifc_file}")
+    else:
+        create_ifc(ifc_file, data, parser.index)
+        logging.info(f"IFC file saved: {ifc_file}")
 
 def delete_pycache():
     pycache_path = os.path.join(os.path.dirname(__file__), '__pycache__')
@@ -31,10 +63,15 @@ def delete_pycache():
         logging.info(f"__pycache__ folder deleted: {pycache_path}")
 
 if __name__ == '__main__':
+    args = parse_args()
     setup_logging()
     logging.info("Program start")
     
     config = read_config()
+    if args.lod is not None:
+        config['lod'] = args.lod
+    if args.tile_size is not None:
+        config['tile_size'] = args.tile_size
 
     xtf_path = config.get('xtf_files', 'C:\\converter\\xtf\\')
     xtf_files = get_xtf_files(xtf_path)
@@ -45,14 +82,14 @@ if __name__ == '__main__':
 
     for xtf_file_path in xtf_files:
         xtf_file_name = os.path.basename(xtf_file_path)
-        ifc_file_name = os.path.splitext(xtf_file_name)[0] + '.ifc'
+        ifc_file_name = xtf_stem(xtf_file_name) + '.ifc'
         ifc_file_path = os.path.join(output_folder, ifc_file_name)
 
         logging.info(f"XTF file path: {xtf_file_path}")
         logging.info(f"IFC file path: {ifc_file_path}")
 
         try:
-            convert_xtf_to_ifc(xtf_file_path, ifc_file_path, config)
+            convert_xtf_to_ifc(xtf_file_path, ifc_file_path, config, include=args.include, exclude=args.exclude)
         except Exception as e:
             logging.error(f"Error during XTF to IFC conversion: {e}", exc_info=True)
 
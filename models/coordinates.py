@@ -0,0 +1,91 @@
+import math
+from array import array
+import numpy as np
+
+# Coordinate columns of the parsed entity classes.
+#
+# The parser appends x/y/z values while it builds the records, so the
+# coordinates end up in contiguous double buffers without an extra pass.
+# Extents, per-class statistics and the rounded origin used for the
+# IfcMapConversion are then computed as NumPy reductions over these buffers.
+# Missing values are stored as NaN and ignored by the reductions.
+
+NAN = float('nan')
+
+class CoordinateColumns:
+    def __init__(self):
+        self.x = array('d')
+        self.y = array('d')
+        self.z = array('d')
+
+    def append(self, x, y, z):
+        self.x.append(NAN if x is None else x)
+        self.y.append(NAN if y is None else y)
+        self.z.append(NAN if z is None else z)
+
+    def extend(self, other):
+        self.x.extend(other.x)
+        self.y.extend(other.y)
+        self.z.extend(other.z)
+
+    def __len__(self):
+        return len(self.x)
+
+    def to_array(self):
+        # (N, 3) array of x, y, z
+        if not self.x:
+            return np.empty((0, 3))
+        return np.column_stack((np.frombuffer(self.x), np.frombuffer(self.y), np.frombuffer(self.z)))
+
+class CoordinateSet:
+    def __init__(self):
+        self.columns = {}
+
+    def add(self, name, columns=None):
+        # Register the columns of an entity class and return them
+        if columns is None:
+            columns = CoordinateColumns()
+        self.columns[name] = columns
+        return columns
+
+    def arrays(self):
+        return {name: columns.to_array() for name, columns in self.columns.items()}
+
+    def bounds(self, points):
+        # Per-axis minimum and maximum of an (N, 3) array, ignoring NaN
+        minimum = np.fmin.reduce(points, axis=0, initial=np.inf)
+        maximum = np.fmax.reduce(points, axis=0, initial=-np.inf)
+        return minimum, maximum
+
+    def extent(self):
+        # Per-axis minimum and maximum over all entity classes
+        arrays = [points for points in self.arrays().values() if len(points)]
+        if not arrays:
+            return np.full(3, np.inf), np.full(3, -np.inf)
+        return self.bounds(np.concatenate(arrays))
+
+    def origin(self, step=10):
+        # Minimum coordinates rounded down to a multiple of step; axes without values stay inf
+        minimum, _ = self.extent()
+        return tuple(value if math.isinf(value) else math.floor(value / step) * step for value in minimum.tolist())
+
+    def statistics(self):
+        # Count, extent and mean per entity class as plain JSON-compatible values
+        statistics = {}
+        for name, points in self.arrays().items():
+            entry = {'count': len(points)}
+            if len(points):
+                minimum, maximum = self.bounds(points)
+                valid = ~np.isnan(points)
+                counts = valid.sum(axis=0)
+                sums = np.where(valid, points, 0.0).sum(axis=0)
+                mean = np.divide(sums, counts, out=np.full(3, np.nan), where=counts > 0)
+                entry['min'] = axis_dict(minimum)
+                entry['max'] = axis_dict(maximum)
+                entry['mean'] = axis_dict(mean)
+            statistics[name] = entry
+        return statistics
+
+def axis_dict(values):
+    # {'x', 'y', 'z'} with None for axes that have no finite value
+    return {axis: (value if math.isfinite(value) else None) for axis, value in zip('xyz', values.tolist())}
@@ -0,0 +1,219 @@
+import os
+import json
+import hashlib
+import logging
+import ifcopenshell
+import ifcopenshell.api.root
+import ifcopenshell.api.pset
+from models.ifc_model import create_ifc, create_ifc_haltungen, create_ifc_normschachte
+from models.tid_index import TIDIndex
+from utils.common import SurfaceStyles, Relationships, GeometryPool, ElementTypes, GuidProvider, file_timestamp
+
+# Incremental update of a previously written IFC file.
+#
+# Next to the IFC file a state file records the settings of the conversion and a
+# fingerprint per Haltung and Normschacht TID. The fingerprint covers everything
+# that ends up in the IFC element: the resolved record with its Haltungspunkte
+# or Abwasserknoten (including Letzte_Aenderung). The IFC elements carry their
+# TID as Tag, so on the next run only elements of added, changed or removed
+# objects are removed and rebuilt; all other entities are reused as they are.
+# A change of the settings (origin, defaults, colouring, model, selected object
+# classes, level of detail, GlobalId mode) or a missing or inconsistent state
+# leads to a full conversion.
+
+STATE_VERSION = 1
+
+# Above this share of changed objects a full conversion is cheaper than a delta
+DELTA_MAX_RATIO = 0.5
+
+# Data values that influence the IFC output besides the records
+SETTING_KEYS = ('model', 'min_coordinates', 'default_sohlenkote', 'default_durchmesser', 'default_hoehe',
+                'default_wanddicke', 'default_bodendicke', 'default_rohrdicke', 'einfaerben', 'entities', 'lod',
+                'stable_guids')
+
+def state_path(ifc_file_path):
+    return ifc_file_path + '.state.json'
+
+def fingerprint(*records):
+    # Hash of the record reprs; the records are dataclasses, so nested records and floats are included
+    # exactly. Polyline arrays are added as raw bytes, since their repr is rounded and abbreviated.
+    digest = hashlib.sha1(repr(records).encode('utf-8'))
+    for record in records:
+        verlauf = record.get('verlauf') if record is not None else None
+        if verlauf is not None:
+            digest.update(verlauf.tobytes())
+    return digest.hexdigest()
+
+def fingerprints(data, index):
+    # Fingerprints per IFC element kind and TID, or None if TIDs are not unique
+    haltungen = {haltung['id']: fingerprint(haltung) for haltung in data['haltungen']}
+    normschachte = {
+        ns['id']: fingerprint(ns, index.abwasserknoten(ns['abwasserknoten_id']))
+        for ns in data['normschachte']
+    }
+    if len(haltungen) != len(data['haltungen']) or len(normschachte) != len(data['normschachte']):
+        return None
+    return {'haltungen': haltungen, 'normschachte': normschachte}
+
+def settings(data):
+    return {key: data.get(key) for key in SETTING_KEYS}
+
+def read_state(ifc_file_path):
+    try:
+        with open(state_path(ifc_file_path), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('version') != STATE_VERSION:
+        return None
+    return state
+
+def write_state(ifc_file_path, data, prints):
+    if prints is None:
+        # Without unique TIDs the next run cannot be incremental
+        if os.path.exists(state_path(ifc_file_path)):
+            os.remove(state_path(ifc_file_path))
+        return
+    state = {'version': STATE_VERSION, 'settings': settings(data), 'fingerprints': prints}
+    with open(state_path(ifc_file_path), 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+def diff(old, new):
+    # TIDs to remove from and to build into the IFC file
+    removed = [tid for tid in old if tid not in new]
+    added = [tid for tid in new if tid not in old]
+    changed = [tid for tid in new if tid in old and old[tid] != new[tid]]
+    return removed, added, changed
+
+def styled_items_by_item(ifc_file):
+    # Styled items per id of the representation item they style
+    return {styled_item.Item.id(): styled_item for styled_item in ifc_file.by_type('IfcStyledItem') if styled_item.Item}
+
+def remove_element(ifc_file, element, styled_items):
+    # Remove a product with its relationships, then the entities only it referenced
+    # (placement, geometry, styles), which remove_product leaves behind. Shared entities
+    # such as representation maps and surface styles stay as long as they are referenced.
+    referenced = list(ifc_file.traverse(element))[1:]
+    for entity in list(referenced):
+        styled_item = styled_items.get(entity.id())
+        if styled_item is not None:
+            referenced.extend(ifc_file.traverse(styled_item))
+    candidates = [entity.id() for entity in referenced if not entity.is_a('IfcRoot') and not entity.is_a('IfcRepresentationContext')]
+
+    ifcopenshell.api.root.remove_product(ifc_file, product=element)
+
+    removed = True
+    while removed:
+        removed = False
+        remaining = []
+        for entity_id in candidates:
+            try:
+                entity = ifc_file.by_id(entity_id)
+            except RuntimeError:
+                continue
+            if entity.is_a('IfcStyledItem'):
+                # Nothing references a styled item; it goes once its item is only referenced by it
+                unused = ifc_file.get_total_inverses(entity.Item) == 1
+            else:
+                unused = ifc_file.get_total_inverses(entity) == 0
+            if unused:
+                if entity.is_a('IfcStyledItem'):
+                    styled_items.pop(entity.Item.id(), None)
+                ifc_file.remove(entity)
+                removed = True
+            else:
+                remaining.append(entity_id)
+        candidates = remaining
+
+def remove_unused_types(ifc_file):
+    # Remove element types whose last occurrence has been removed, with their property sets
+    for element_type in ifc_file.by_type('IfcPipeSegmentType') + ifc_file.by_type('IfcDistributionChamberElementType'):
+        relationship = next(iter(element_type.Types), None)
+        if relationship is not None and relationship.RelatedObjects:
+            continue
+        if relationship is not None:
+            ifc_file.remove(relationship)
+        for pset in element_type.HasPropertySets or ():
+            ifcopenshell.api.pset.remove_pset(ifc_file, product=element_type, pset=pset)
+        ifc_file.remove(element_type)
+
+def update_ifc(ifc_file_path, data, index=None):
+    # Update the IFC file at ifc_file_path to the parsed data, rebuilding only changed elements.
+    # Returns a summary with the mode ('full' or 'delta') and the number of rebuilt objects.
+    if index is None:
+        index = TIDIndex.from_data(data)
+    prints = fingerprints(data, index)
+    state = read_state(ifc_file_path) if os.path.exists(ifc_file_path) else None
+
+    reason = None
+    if prints is None:
+        reason = "TIDs sind nicht eindeutig"
+    elif state is None:
+        reason = "kein gültiger Stand der letzten Konvertierung"
+    elif state['settings'] != json.loads(json.dumps(settings(data))):
+        reason = "Einstellungen oder Ursprung haben sich geändert"
+
+    changes = {}
+    if reason is None:
+        total = 0
+        for kind, new in prints.items():
+            removed, added, changed = diff(state['fingerprints'].get(kind, {}), new)
+            changes[kind] = (removed, added, changed)
+            total += len(removed) + len(added) + len(changed)
+        if total > DELTA_MAX_RATIO * max(1, sum(len(new) for new in prints.values())):
+            reason = f"zu viele Änderungen ({total})"
+
+    if reason is not None:
+        logging.info(f"Vollständige Konvertierung: {reason}")
+        create_ifc(ifc_file_path, data, index)
+        write_state(ifc_file_path, data, prints)
+        return {'mode': 'full', 'reason': reason}
+
+    ifc_file = ifcopenshell.open(ifc_file_path)
+    elements = {
+        'haltungen': {element.Tag: element for element in ifc_file.by_type('IfcPipeSegment')},
+        'normschachte': {element.Tag: element for element in ifc_file.by_type('IfcDistributionChamberElement')}
+    }
+    if any(set(elements[kind]) != set(state['fingerprints'][kind]) for kind in elements):
+        logging.info("Vollständige Konvertierung: IFC-Datei passt nicht zum gespeicherten Stand")
+        create_ifc(ifc_file_path, data, index)
+        write_state(ifc_file_path, data, prints)
+        return {'mode': 'full', 'reason': "IFC-Datei passt nicht zum gespeicherten Stand"}
+
+    summary = {'mode': 'delta'}
+    styled_items = styled_items_by_item(ifc_file)
+    for kind, (removed, added, changed) in changes.items():
+        for tid in removed + changed:
+            remove_element(ifc_file, elements[kind][tid], styled_items)
+        summary[kind] = {'removed': len(removed), 'added': len(added), 'changed': len(changed)}
+    remove_unused_types(ifc_file)
+
+    site = ifc_file.by_type('IfcSite')[0]
+    context = next(context for context in ifc_file.by_type('IfcGeometricRepresentationContext')
+                   if context.is_a() == 'IfcGeometricRepresentationContext')
+    groups = {group.Name: group for group in ifc_file.by_type('IfcGroup')}
+    guids = GuidProvider(ifc_file, data.get('model'), data.get('stable_guids', True), data.get('tile'))
+    styles = SurfaceStyles(ifc_file)
+    relationships = Relationships(ifc_file, guids)
+    pool = GeometryPool(ifc_file)
+    types = ElementTypes(ifc_file, guids)
+
+    haltungen = set(changes['haltungen'][1] + changes['haltungen'][2])
+    if haltungen:
+        subset = dict(data, haltungen=[haltung for haltung in data['haltungen'] if haltung['id'] in haltungen])
+        create_ifc_haltungen(ifc_file, subset, site, context, groups['Haltungen'], styles, relationships, pool, types, guids)
+
+    normschachte = set(changes['normschachte'][1] + changes['normschachte'][2])
+    if normschachte:
+        subset = dict(data, normschachte=[ns for ns in data['normschachte'] if ns['id'] in normschachte])
+        create_ifc_normschachte(ifc_file, subset, site, context, groups['Abwasserknoten'], styles, relationships, pool, types, guids, index)
+    styles.flush()
+    relationships.flush()
+    types.flush()
+
+    if data.get('stable_guids', True):
+        ifc_file.header.file_name.time_stamp = file_timestamp()
+    logging.info(f"Inkrementelle Aktualisierung der IFC-Datei {ifc_file_path}: {summary}")
+    ifc_file.write(ifc_file_path)
+    write_state(ifc_file_path, data, prints)
+    return summary
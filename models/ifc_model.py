@@ -1,24 +1,34 @@
 import ifcopenshell
 import logging
-from utils.common import add_color, generate_guid, add_property_set, create_local_placement, create_cartesian_point, create_swept_disk_solid, create_property_single_value
-from utils.graphics_ns import create_ifc_normschacht
+from utils.common import SurfaceStyles, Relationships, GeometryPool, ElementTypes, GuidProvider, LOD_AXIS, LOD_FULL, check_lod, file_timestamp, create_local_placement, create_swept_disk_solid
+from utils.graphics_ns import ShaftShapes, create_ifc_normschacht
+from models.tid_index import TIDIndex
+from models.ifc_stream import StepWriter
 import math
+import numpy as np
 
-def create_ifc_project_structure(ifc_file, min_coordinates):
-    logging.info("Erstelle IFC-Projektstruktur.")
-    project = ifc_file.create_entity("IfcProject", GlobalId=generate_guid(), Name="Entwässerungsprojekt")
+# Object classes the IFC model creates elements for; the other classes only resolve them
+IFC_ENTITIES = ('Normschacht', 'Haltung')
+
+def check_ifc_entities(entities):
+    # Selected object classes, or ValueError if none of them becomes an IFC element
+    if not any(entity in IFC_ENTITIES for entity in entities):
+        raise ValueError(f"Auswahl ohne IFC-Geometrie: {', '.join(entities) or 'keine Objektklasse'} "
+                         f"(mindestens eine von {', '.join(IFC_ENTITIES)} erforderlich)")
+    return entities
 
-    if any(coord is None or math.isinf(coord) for coord in min_coordinates.values()):
+def create_ifc_project_structure(ifc_file, min_coordinates, guids, pool=None):
+    logging.info("Erstelle IFC-Projektstruktur.")
+    if 'error' in min_coordinates or any(coord is None or math.isinf(coord) for coord in min_coordinates.values()):
         logging.error(f"Ungültige Mindestkoordinaten: {min_coordinates}")
         raise ValueError("Ungültige Mindestkoordinaten")
 
-    project = ifc_file.create_entity("IfcProject", GlobalId=generate_guid(), Name="Entwässerungsprojekt")
-
     context = ifc_file.create_entity("IfcGeometricRepresentationContext",
         ContextType="Model",
         CoordinateSpaceDimension=3,
         Precision=1e-5,
-        WorldCoordinateSystem=ifc_file.create_entity("IfcAxis2Placement3D", Location=ifc_file.create_entity("IfcCartesianPoint", Coordinates=(0., 0., 0.))),
+        WorldCoordinateSystem=pool.placement((0., 0., 0.)) if pool is not None else
+            ifc_file.create_entity("IfcAxis2Placement3D", Location=ifc_file.create_entity("IfcCartesianPoint", Coordinates=(0., 0., 0.))),
         ContextIdentifier="Building Model"
     )
     
@@ -42,75 +52,95 @@ def create_ifc_project_structure(ifc_file, min_coordinates):
         Scale=1.0
     )
     
-    project.RepresentationContexts = [context]
-    project.UnitsInContext = ifc_file.create_entity("IfcUnitAssignment", Units=[
-        ifc_file.create_entity("IfcSIUnit", UnitType="LENGTHUNIT", Name="METRE"),
-        ifc_file.create_entity("IfcSIUnit", UnitType="AREAUNIT", Name="SQUARE_METRE"),
-        ifc_file.create_entity("IfcSIUnit", UnitType="VOLUMEUNIT", Name="CUBIC_METRE"),
-    ])
+    # The project is created complete, so the streaming writer can write it at once
+    project = ifc_file.create_entity("IfcProject", GlobalId=guids.file_guid('project'), Name="Entwässerungsprojekt",
+        RepresentationContexts=[context],
+        UnitsInContext=ifc_file.create_entity("IfcUnitAssignment", Units=[
+            ifc_file.create_entity("IfcSIUnit", UnitType="LENGTHUNIT", Name="METRE"),
+            ifc_file.create_entity("IfcSIUnit", UnitType="AREAUNIT", Name="SQUARE_METRE"),
+            ifc_file.create_entity("IfcSIUnit", UnitType="VOLUMEUNIT", Name="CUBIC_METRE"),
+        ])
+    )
 
     site = ifc_file.create_entity("IfcSite", 
-        GlobalId=generate_guid(), 
+        GlobalId=guids.file_guid('site'), 
         Name="Perimeter",
         RefLatitude=None,
         RefLongitude=None,
         RefElevation=min_coordinates['z']
     )
    
-    ifc_file.create_entity("IfcRelAggregates", GlobalId=generate_guid(), RelatingObject=project, RelatedObjects=[site])
+    ifc_file.create_entity("IfcRelAggregates", GlobalId=guids.guid(project.GlobalId, 'aggregates'), RelatingObject=project, RelatedObjects=[site])
     
     return context, site
 
-def interpolate_z(start_z, end_z, start_x, start_y, end_x, end_y, point_x, point_y):
-    # Interpolate the Z-coordinate based on the position along the line
-    total_distance = math.sqrt((end_x - start_x)**2 + (end_y - start_y)**2)
-    point_distance = math.sqrt((point_x - start_x)**2 + (point_y - start_y)**2)
-    if total_distance != 0:
-        interpolated_z = start_z + (end_z - start_z) * (point_distance / total_distance)
-        return max(min(interpolated_z, max(start_z, end_z)), min(start_z, end_z))
-    else:
-        return start_z
-
-def create_ifc_haltungen(ifc_file, data, site, context, haltungen_group):
+def local_polylines(verlaeufe, starts, end_z):
+    # Polylines of all haltungen relative to their start point, computed in one batch.
+    # Z is interpolated linearly by chainage (cumulative length along the polyline) from the
+    # start to the end height; a non-zero kote in a third column is used as measured height.
+    counts = np.array([len(verlauf) for verlauf in verlaeufe], dtype=int)
+    if not counts.sum():
+        return [np.empty((0, 3)) for _ in verlaeufe]
+    owner = np.repeat(np.arange(len(verlaeufe)), counts)
+    first = np.cumsum(counts) - counts
+
+    # All vertices as one (M, 3) array; the third column is NaN for polylines without kote
+    vertices = np.full((counts.sum(), 3), np.nan)
+    for verlauf, offset in zip(verlaeufe, first.tolist()):
+        vertices[offset:offset + len(verlauf), :verlauf.shape[1]] = verlauf
+
+    # Chainage per vertex, restarting at the first vertex of every polyline
+    steps = np.zeros(len(vertices))
+    steps[1:] = np.hypot(np.diff(vertices[:, 0]), np.diff(vertices[:, 1]))
+    steps[first[counts > 0]] = 0.0
+    chainage = np.cumsum(steps)
+    chainage -= chainage[first[owner]]
+    totals = chainage[(first + counts - 1)[owner]]
+    ratio = np.divide(chainage, totals, out=np.zeros_like(chainage), where=totals > 0)
+
+    start_z = starts[owner, 2]
+    z = start_z + (end_z[owner] - start_z) * ratio
+    kote = vertices[:, 2]
+    measured = ~np.isnan(kote) & (kote != 0)
+    z[measured] = kote[measured]
+
+    local = np.column_stack((vertices[:, 0] - starts[owner, 0], vertices[:, 1] - starts[owner, 1], z - start_z))
+    return np.split(local, np.cumsum(counts)[:-1])
+
+def create_ifc_haltungen(ifc_file, data, site, context, haltungen_group, styles, relationships, pool, types, guids):
     # Create IFC representations of 'haltungen' (pipelines)
     haltungen = data['haltungen']
     default_durchmesser = data['default_durchmesser']
     default_rohrdicke = data['default_rohrdicke']
     default_sohlenkote = data['default_sohlenkote']
     einfaerben = data['einfaerben']
+    lod = check_lod(data.get('lod', LOD_FULL))
 
-    for haltung in haltungen:
+    # Radii and start/end points of all haltungen; the polylines are then processed in one batch
+    radii = []
+    starts = np.empty((len(haltungen), 3))
+    ends = np.empty((len(haltungen), 3))
+    for i, haltung in enumerate(haltungen):
         innendurchmesser = haltung.get('durchmesser')
         outer_radius = (innendurchmesser / 2) + default_rohrdicke if innendurchmesser is not None else default_durchmesser / 2
         inner_radius = innendurchmesser / 2 if innendurchmesser is not None else default_durchmesser / 2
+        radii.append((outer_radius, inner_radius))
 
         start_point = haltung['von_haltungspunkt']['lage']
         end_point = haltung['nach_haltungspunkt']['lage']
+        starts[i] = (float(start_point['c1']), float(start_point['c2']), float(haltung.get('von_z', default_sohlenkote)) + inner_radius)
+        ends[i] = (float(end_point['c1']), float(end_point['c2']), float(haltung.get('nach_z', default_sohlenkote)) + inner_radius)
+
+    polylines = local_polylines([haltung['verlauf'] for haltung in haltungen], starts, ends[:, 2])
+    guids.prefetch_elements([haltung['id'] for haltung in haltungen], "TBAKTZH STRE Haltung")
+
+    for haltung, (outer_radius, inner_radius), (start_x, start_y, start_z), (end_x, end_y, end_z), polyline in zip(
+            haltungen, radii, starts.tolist(), ends.tolist(), polylines):
+        ifc_local_placement = create_local_placement(ifc_file, [start_x, start_y, start_z], relative_to=site.ObjectPlacement, pool=pool)
 
-        start_x = float(start_point['c1'])
-        start_y = float(start_point['c2'])
-        start_z = float(haltung.get('von_z', default_sohlenkote))
-
-        end_x = float(end_point['c1'])
-        end_y = float(end_point['c2'])
-        end_z = float(haltung.get('nach_z', default_sohlenkote))
-
-        start_z += inner_radius
-        end_z += inner_radius
-
-        ifc_local_placement = create_local_placement(ifc_file, [start_x, start_y, start_z], relative_to=site.ObjectPlacement)
-
-        if 'verlauf' in haltung and haltung['verlauf']:
-            # Generate a 3D polyline for the pipeline's path
-            polyline_3d = []
-            for point in haltung['verlauf']:
-                x = float(point['c1']) - start_x
-                y = float(point['c2']) - start_y
-                if point.get('kote') and float(point['kote']) != 0:
-                    z = float(point['kote']) - start_z
-                else:
-                    z = interpolate_z(start_z, end_z, start_x, start_y, end_x, end_y, float(point['c1']), float(point['c2'])) - start_z
-                polyline_3d.append([x, y, z])
+        if len(polyline):
+            # 3D polyline of the pipeline's path
+            polyline_3d = polyline.tolist()
         else:
             # Default to a straight line between start and end points
             polyline_3d = [
@@ -118,23 +148,31 @@ def create_ifc_haltungen(ifc_file, data, site, context, haltungen_group):
                 [end_x - start_x, end_y - start_y, end_z - start_z]
             ]
 
-        ifc_polyline = ifc_file.create_entity('IfcPolyline', Points=[create_cartesian_point(ifc_file, p) for p in polyline_3d])
+        ifc_polyline = ifc_file.create_entity('IfcPolyline', Points=[pool.point(p) for p in polyline_3d])
 
-        ifc_pipe_segment = ifc_file.create_entity("IfcPipeSegment", GlobalId=generate_guid(), OwnerHistory=None, Name=haltung['bezeichnung'],
-                                                  ObjectPlacement=ifc_local_placement, Representation=None)
-
-        swept_disk_solid = create_swept_disk_solid(ifc_file, ifc_polyline, outer_radius, inner_radius)
+        if lod == LOD_AXIS:
+            # Axis only: the polyline itself, without solid and colour
+            swept_disk_solid = None
+            shape_representation = ifc_file.create_entity("IfcShapeRepresentation",
+                                                          ContextOfItems=context,
+                                                          RepresentationIdentifier="Axis",
+                                                          RepresentationType="Curve3D",
+                                                          Items=[ifc_polyline])
+        else:
+            # LOD_SOLID sweeps a solid disk; the full geometry a hollow one with the inner radius
+            swept_disk_solid = create_swept_disk_solid(ifc_file, ifc_polyline, outer_radius, inner_radius if lod == LOD_FULL else None)
 
-        shape_representation = ifc_file.create_entity("IfcShapeRepresentation",
-                                                      ContextOfItems=context,
-                                                      RepresentationIdentifier="Body",
-                                                      RepresentationType="SweptSolid",
-                                                      Items=[swept_disk_solid])
+            shape_representation = ifc_file.create_entity("IfcShapeRepresentation",
+                                                          ContextOfItems=context,
+                                                          RepresentationIdentifier="Body",
+                                                          RepresentationType="SweptSolid",
+                                                          Items=[swept_disk_solid])
 
         product_shape = ifc_file.create_entity("IfcProductDefinitionShape",
                                                Representations=[shape_representation])
 
-        ifc_pipe_segment.Representation = product_shape
+        ifc_pipe_segment = ifc_file.create_entity("IfcPipeSegment", GlobalId=guids.guid(haltung['id'], 'element'), OwnerHistory=None, Name=haltung['bezeichnung'],
+                                                  ObjectPlacement=ifc_local_placement, Representation=product_shape, Tag=haltung['id'])
 
         farbe = "Blau"
         if einfaerben:
@@ -143,58 +181,81 @@ def create_ifc_haltungen(ifc_file, data, site, context, haltungen_group):
             else:
                 farbe = "Rot"
                 
-        add_color(ifc_file, ifc_pipe_segment, farbe, context)
+        if swept_disk_solid is not None:
+            styles.add(swept_disk_solid, farbe)
 
-        ifc_file.create_entity("IfcRelContainedInSpatialStructure",
-            GlobalId=generate_guid(),
-            RelatedElements=[ifc_pipe_segment],
-            RelatingStructure=site
-        )
+        relationships.contain(ifc_pipe_segment, site)
 
-        properties = {
-            "Bezeichnung": haltung['bezeichnung'],
+        # Material and clear height recur across many haltungen and are held by the pipe type
+        pipe_type = types.element_type("IfcPipeSegmentType", "TBAKTZH STRE Haltung", {
             "Material": haltung.get('material', ''),
-            "Länge Effektiv": str(haltung.get('length', '')),
             "Lichte Höhe": str(haltung['durchmesser'])
-        }
-
-        add_property_set(ifc_file, ifc_pipe_segment, "TBAKTZH STRE Haltung", properties)
+        })
+        types.assign(ifc_pipe_segment, pipe_type)
+        types.add_property_set(ifc_pipe_segment, "TBAKTZH STRE Haltung", {
+            "Bezeichnung": haltung['bezeichnung'],
+            "Länge Effektiv": str(haltung.get('length', ''))
+        })
 
-        ifc_file.create_entity("IfcRelAssignsToGroup",
-            GlobalId=generate_guid(),
-            RelatedObjects=[ifc_pipe_segment],
-            RelatingGroup=haltungen_group
-        )
+        relationships.assign(ifc_pipe_segment, haltungen_group)
 
-def create_ifc_normschachte(ifc_file, data, site, context, abwasserknoten_group):
+def create_ifc_normschachte(ifc_file, data, site, context, abwasserknoten_group, styles, relationships, pool, types, guids, index=None):
     logging.info(f"Füge Normschächte hinzu: {len(data['normschachte'])}")
+    if index is None:
+        index = TIDIndex.from_data(data)
+    shapes = ShaftShapes(ifc_file, context, styles, pool, check_lod(data.get('lod', LOD_FULL)))
+    guids.prefetch_elements([ns.get('id') for ns in data['normschachte']], "TBAKTZH STRE Schacht")
     for ns in data['normschachte']:
-        abwasserknoten = next((ak for ak in data['abwasserknoten'] if ak['id'] == ns['abwasserknoten_id']), None)
-        create_ifc_normschacht(ifc_file, ns, abwasserknoten, site, context, abwasserknoten_group, data)
+        abwasserknoten = index.abwasserknoten(ns['abwasserknoten_id'])
+        create_ifc_normschacht(ifc_file, ns, abwasserknoten, site, context, abwasserknoten_group, data, shapes, relationships, types, guids)
 
-def create_ifc(ifc_file_path, data):
+def create_ifc(ifc_file_path, data, index=None):
     logging.info("Erstelle IFC-Datei...")
 
+    ifc_file = None
     try:
-        ifc_file = ifcopenshell.file(schema="IFC4X3")
+        check_lod(data.get('lod', LOD_FULL))
+
+        # Stable GlobalIds and a fixed time stamp make repeated conversions byte-identical
+        stable = data.get('stable_guids', True)
+        timestamp = file_timestamp() if stable else None
+        if data.get('streaming_writer'):
+            # Entities are written to the file as they are created instead of being kept in memory
+            ifc_file = StepWriter(ifc_file_path, schema="IFC4X3", timestamp=timestamp)
+        else:
+            ifc_file = ifcopenshell.file(schema="IFC4X3")
+            if timestamp:
+                ifc_file.header.file_name.time_stamp = timestamp
+
+        guids = GuidProvider(ifc_file, data.get('model'), stable, data.get('tile'))
+        styles = SurfaceStyles(ifc_file)
+        relationships = Relationships(ifc_file, guids)
+        pool = GeometryPool(ifc_file)
+        types = ElementTypes(ifc_file, guids)
 
         logging.info("Erstelle IFC-Projektstruktur.")
-        context, site = create_ifc_project_structure(ifc_file, data['min_coordinates'])
+        context, site = create_ifc_project_structure(ifc_file, data['min_coordinates'], guids, pool)
 
-        abwasserknoten_group = ifc_file.create_entity("IfcGroup", GlobalId=generate_guid(), Name="Abwasserknoten")
-        haltungen_group = ifc_file.create_entity("IfcGroup", GlobalId=generate_guid(), Name="Haltungen")
+        abwasserknoten_group = ifc_file.create_entity("IfcGroup", GlobalId=guids.file_guid('group', "Abwasserknoten"), Name="Abwasserknoten")
+        haltungen_group = ifc_file.create_entity("IfcGroup", GlobalId=guids.file_guid('group', "Haltungen"), Name="Haltungen")
 
         logging.info("Erstelle IFC-Haltungen.")
-        create_ifc_haltungen(ifc_file, data, site, context, haltungen_group)
+        create_ifc_haltungen(ifc_file, data, site, context, haltungen_group, styles, relationships, pool, types, guids)
         
         logging.info("Erstelle IFC-Normschächte.")
-        create_ifc_normschachte(ifc_file, data, site, context, abwasserknoten_group)
+        create_ifc_normschachte(ifc_file, data, site, context, abwasserknoten_group, styles, relationships, pool, types, guids, index)
+        styles.flush()
+        relationships.flush()
+        types.flush()
 
-        ifc_file.create_entity("IfcRelAggregates", GlobalId=generate_guid(), RelatingObject=site, RelatedObjects=[abwasserknoten_group])
-        ifc_file.create_entity("IfcRelAggregates", GlobalId=generate_guid(), RelatingObject=site, RelatedObjects=[haltungen_group])
+        for group in (abwasserknoten_group, haltungen_group):
+            ifc_file.create_entity("IfcRelAggregates", GlobalId=guids.guid(site.GlobalId, 'aggregates', group.GlobalId),
+                RelatingObject=site, RelatedObjects=[group])
 
         logging.info(f"Speichern der IFC-Datei unter {ifc_file_path}...")
         ifc_file.write(ifc_file_path)
     except Exception as e:
         logging.error(f"Fehler beim Erstellen der IFC-Datei: {e}", exc_info=True)
+        if isinstance(ifc_file, StepWriter):
+            ifc_file.abort()
         raise
\ No newline at end of file
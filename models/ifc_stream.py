@@ -0,0 +1,238 @@
+import time
+import ifcopenshell
+import ifcopenshell.ifcopenshell_wrapper as wrapper
+
+# Append-only STEP (ISO 10303-21) writer for IFC files.
+#
+# StepWriter offers the part of the ifcopenshell.file API the IFC builders use
+# (create_entity, by_type, write), but serializes every entity as soon as it is
+# created instead of keeping the model graph in memory. The returned handles
+# only remember their id, class and scalar attribute values, so an entity must
+# be complete when it is created and cannot be changed afterwards. Inverse
+# attributes of handles are empty and by_type finds nothing, as in a new file.
+# Attribute order and types come from the ifcopenshell schema. The registries
+# of the builders (geometry pool, relationships, GlobalIds) still hold a handle
+# per interned entity and element, so memory still grows with the network,
+# only without the IFC graph.
+
+# Attribute kinds of the schema mapped to the serialization of plain Python values
+REAL_TYPES = ('real', 'number')
+INTEGER_TYPES = ('integer',)
+BOOLEAN_TYPES = ('boolean', 'logical')
+
+def format_real(value):
+    # STEP real: always with a decimal point, exponent as E+XX/E-XX
+    text = repr(float(value))
+    if text in ('inf', '-inf', 'nan'):
+        raise ValueError(f"Ungültiger Zahlenwert für STEP: {value}")
+    if 'e' in text:
+        mantissa, exponent = text.split('e')
+        if '.' not in mantissa:
+            mantissa += '.'
+        return f"{mantissa}E{int(exponent):+03d}"
+    if text.endswith('.0'):
+        return text[:-1]
+    return text
+
+def format_string(value):
+    # STEP string with '' and \\ escapes; characters outside printable ASCII as \X2\ or \X4\ runs
+    parts = []
+    run = []
+
+    def close_run():
+        if run:
+            if any(ord(char) > 0xFFFF for char in run):
+                parts.append('\\X4\\' + ''.join(f"{ord(char):08X}" for char in run) + '\\X0\\')
+            else:
+                parts.append('\\X2\\' + ''.join(f"{ord(char):04X}" for char in run) + '\\X0\\')
+            run.clear()
+
+    for char in value:
+        if ' ' <= char <= '~':
+            close_run()
+            parts.append("''" if char == "'" else '\\\\' if char == '\\' else char)
+        else:
+            run.append(char)
+    close_run()
+    return "'" + ''.join(parts) + "'"
+
+def attribute_kind(attribute_type):
+    # Kind of a schema attribute type: 'enum', 'entity', 'select', a simple type name
+    # ('real', 'string', ...) or ('aggregate', kind of the elements)
+    if isinstance(attribute_type, wrapper.aggregation_type):
+        return ('aggregate', attribute_kind(attribute_type.type_of_element()))
+    if isinstance(attribute_type, wrapper.simple_type):
+        return attribute_type.declared_type()
+    declaration = attribute_type.declared_type()
+    if isinstance(declaration, wrapper.enumeration_type):
+        return 'enum'
+    if isinstance(declaration, wrapper.type_declaration):
+        return attribute_kind(declaration.declared_type())
+    if isinstance(declaration, wrapper.select_type):
+        return 'select'
+    return 'entity'
+
+class StepValue:
+    # Typed value such as IfcText('...'), written inline where it is used
+    __slots__ = ('type', 'value', 'kind')
+
+    def __init__(self, type, value, kind):
+        self.type = type
+        self.value = value
+        self.kind = kind
+
+    @property
+    def wrappedValue(self):
+        return self.value
+
+    def is_a(self, type=None):
+        return self.type if type is None else self.type.lower() == type.lower()
+
+class StepEntity:
+    # Handle of a written entity: id, class and scalar attribute values
+    __slots__ = ('_id', '_type', '_values', '_inverses')
+
+    def __init__(self, id, type, values, inverses):
+        object.__setattr__(self, '_id', id)
+        object.__setattr__(self, '_type', type)
+        object.__setattr__(self, '_values', values)
+        object.__setattr__(self, '_inverses', inverses)
+
+    def id(self):
+        return self._id
+
+    def is_a(self, type=None):
+        return self._type if type is None else self._type.lower() == type.lower()
+
+    def __getattr__(self, name):
+        values = object.__getattribute__(self, '_values')
+        if name in values:
+            return values[name]
+        if name in object.__getattribute__(self, '_inverses'):
+            return ()
+        raise AttributeError(f"{self._type}.{name} ist nach dem Schreiben nicht mehr verfügbar")
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self._type} #{self._id} ist bereits geschrieben und kann nicht geändert werden")
+
+    def __eq__(self, other):
+        return isinstance(other, StepEntity) and other._id == self._id
+
+    def __hash__(self):
+        return self._id
+
+    def __repr__(self):
+        return f"#{self._id}={self._type}(...)"
+
+class StepWriter:
+    def __init__(self, target, schema="IFC4X3", name='', timestamp=None):
+        # target is a path or a text file object, e.g. a pipe or the body of an HTTP response
+        # Entities follow the schema version named in the header (e.g. IFC4X3 -> IFC4X3_ADD2)
+        self.schema_identifier = ifcopenshell.file(schema=schema).schema_identifier
+        self.schema = wrapper.schema_by_name(self.schema_identifier)
+        self.owns_stream = not hasattr(target, 'write')
+        self.stream = open(target, 'w', encoding='ascii', newline='\n') if self.owns_stream else target
+        self.next_id = 1
+        # Class name -> (STEP name, attribute names, kinds, derived flags, inverse names)
+        self.declarations = {}
+        self.closed = False
+        self.write_header(name, timestamp or time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+    def write_header(self, name, timestamp):
+        self.stream.write(
+            "ISO-10303-21;\nHEADER;\n"
+            "FILE_DESCRIPTION(('ViewDefinition [CoordinationView]'),'2;1');\n"
+            f"FILE_NAME({format_string(name)},'{timestamp}',(''),(''),'xtf2ifc','xtf2ifc','');\n"
+            f"FILE_SCHEMA(('{self.schema_identifier}'));\nENDSEC;\nDATA;\n"
+        )
+
+    def declaration(self, type):
+        entry = self.declarations.get(type)
+        if entry is None:
+            declaration = self.schema.declaration_by_name(type)
+            if isinstance(declaration, wrapper.entity):
+                attributes = declaration.all_attributes()
+                entry = (
+                    declaration.name().upper(),
+                    [attribute.name() for attribute in attributes],
+                    [attribute_kind(attribute.type_of_attribute()) for attribute in attributes],
+                    declaration.derived(),
+                    frozenset(inverse.name() for inverse in declaration.all_inverse_attributes())
+                )
+            else:
+                entry = (declaration.name().upper(), None, attribute_kind(declaration.declared_type()), None, None)
+            self.declarations[type] = entry
+        return entry
+
+    def format(self, value, kind):
+        if value is None:
+            return '$'
+        if isinstance(value, StepEntity):
+            return f"#{value.id()}"
+        if isinstance(value, StepValue):
+            return f"{value.type.upper()}({self.format(value.value, value.kind)})"
+        if isinstance(value, (list, tuple)):
+            element_kind = kind[1] if isinstance(kind, tuple) else None
+            return '(' + ','.join(self.format(element, element_kind) for element in value) + ')'
+        if kind == 'enum':
+            return f".{value.upper()}."
+        if isinstance(value, bool) or kind in BOOLEAN_TYPES:
+            if value == 'UNKNOWN':
+                return '.U.'
+            return '.T.' if value else '.F.'
+        if kind in REAL_TYPES or isinstance(value, float):
+            return format_real(value)
+        if kind in INTEGER_TYPES or isinstance(value, int):
+            return str(int(value))
+        return format_string(str(value))
+
+    def create_entity(self, type, *args, **kwargs):
+        step_name, names, kinds, derived, inverses = self.declaration(type)
+        if names is None:
+            # Typed value, e.g. IfcText('...')
+            return StepValue(self.schema.declaration_by_name(type).name(), args[0] if args else kwargs.get('wrappedValue'), kinds)
+
+        values = dict(zip(names, args))
+        for name, value in kwargs.items():
+            if name not in names:
+                raise AttributeError(f"{type} hat kein Attribut {name}")
+            values[name] = value
+
+        entity_id = self.next_id
+        self.next_id += 1
+        fields = ['*' if is_derived else self.format(values.get(name), kind)
+                  for name, kind, is_derived in zip(names, kinds, derived)]
+        self.stream.write(f"#{entity_id}={step_name}({','.join(fields)});\n")
+
+        scalars = {name: values.get(name) for name in names
+                   if not isinstance(values.get(name), (StepEntity, StepValue, list, tuple))}
+        return StepEntity(entity_id, self.schema.declaration_by_name(type).name(), scalars, inverses)
+
+    def createIfcEntity(self, type, *args, **kwargs):
+        return self.create_entity(type, *args, **kwargs)
+
+    def by_type(self, type, include_subtypes=True):
+        # Written entities are not kept
+        return []
+
+    def write(self, path=None):
+        # Finish the file; path is accepted for compatibility with ifcopenshell.file.write
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.stream.write("ENDSEC;\nEND-ISO-10303-21;\n")
+        if self.owns_stream:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+    def abort(self):
+        # Stop writing after an error; the incomplete file has no end section
+        if self.closed:
+            return
+        self.closed = True
+        if self.owns_stream:
+            self.stream.close()
@@ -0,0 +1,145 @@
+import os
+import json
+import math
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from models.ifc_model import create_ifc
+from models.ifc_delta import update_ifc, SETTING_KEYS
+from models.tid_index import TIDIndex
+from utils.common import check_tile_size
+
+# Tiled IFC output.
+#
+# The network is partitioned into a square grid of tile_size metres: a Haltung
+# belongs to the tile of its start point, a Normschacht to the tile of its
+# position (Abwasserknoten, else its own Lage). Every tile is written as an IFC
+# file of its own, all with the origin of the whole network so they line up in
+# a viewer, and a JSON tile index lists the files with their grid cell, the
+# extent of their data and element counts. A Haltung may leave its cell, so the
+# extent can be larger than the cell. The tiles are written in worker processes.
+
+TILE_INDEX_VERSION = 2
+
+# Data values the IFC builders read besides the records; a tile job carries only these and the
+# records of its tile, not the Haltungspunkte, Abwasserknoten and Kanäle of the whole network
+TILE_DATA_KEYS = SETTING_KEYS + ('streaming_writer',)
+
+def tile_of(x, y, tile_size):
+    # Grid column and row of a position
+    return math.floor(x / tile_size), math.floor(y / tile_size)
+
+def tile_file_name(stem, column, row):
+    return f"{stem}_{column}_{row}.ifc"
+
+def tile_index_name(stem):
+    return f"{stem}_tiles.json"
+
+def partition(data, index, tile_size):
+    # Haltungen, Normschächte and the Abwasserknoten of the Normschächte per tile
+    tiles = {}
+
+    def tile(lage):
+        if not lage or lage.get('c1') is None or lage.get('c2') is None:
+            return None
+        key = tile_of(float(lage['c1']), float(lage['c2']), tile_size)
+        return tiles.setdefault(key, {'haltungen': [], 'normschachte': [], 'abwasserknoten': []})
+
+    for haltung in data['haltungen']:
+        entry = tile(haltung['von_haltungspunkt']['lage'])
+        if entry is None:
+            logging.warning(f"Haltung {haltung['id']} hat keinen Startpunkt und wird keiner Kachel zugeordnet")
+            continue
+        entry['haltungen'].append(haltung)
+
+    for ns in data['normschachte']:
+        abwasserknoten = index.abwasserknoten(ns['abwasserknoten_id'])
+        entry = tile(abwasserknoten['lage'] if abwasserknoten else ns.get('lage'))
+        if entry is None:
+            logging.warning(f"Normschacht {ns['id']} hat keine Koordinaten und wird keiner Kachel zugeordnet")
+            continue
+        entry['normschachte'].append(ns)
+        if abwasserknoten:
+            entry['abwasserknoten'].append(abwasserknoten)
+    return tiles
+
+def data_extent(entry):
+    # x/y bounding box of the Haltungen (course and end points), Normschächte and Abwasserknoten of a tile
+    xs, ys = [], []
+
+    def add(lage):
+        if lage and lage.get('c1') is not None and lage.get('c2') is not None:
+            xs.append(float(lage['c1']))
+            ys.append(float(lage['c2']))
+
+    for haltung in entry['haltungen']:
+        verlauf = np.asarray(haltung['verlauf'], dtype=float)
+        if len(verlauf):
+            xs.extend((verlauf[:, 0].min(), verlauf[:, 0].max()))
+            ys.extend((verlauf[:, 1].min(), verlauf[:, 1].max()))
+        for punkt in (haltung['von_haltungspunkt'], haltung['nach_haltungspunkt']):
+            if punkt:
+                add(punkt['lage'])
+    for ns in entry['normschachte']:
+        add(ns.get('lage'))
+    for abwasserknoten in entry['abwasserknoten']:
+        add(abwasserknoten['lage'])
+    return {'min': {'x': float(min(xs)), 'y': float(min(ys))}, 'max': {'x': float(max(xs)), 'y': float(max(ys))}}
+
+def write_tile(job):
+    # Worker process: write (or incrementally update) the IFC file of one tile
+    ifc_file_path, data, abwasserknoten, incremental = job
+    index = TIDIndex(abwasserknoten=abwasserknoten)
+    if incremental:
+        update_ifc(ifc_file_path, data, index)
+    else:
+        create_ifc(ifc_file_path, data, index)
+    return ifc_file_path
+
+def create_ifc_tiles(output_folder, stem, data, index, tile_size, workers=0, incremental=False):
+    # Write one IFC file per tile of tile_size metres and the tile index into output_folder.
+    # Returns the tile index; its 'file' entries are file names relative to output_folder.
+    if not check_tile_size(tile_size):
+        raise ValueError("Kachelgrösse 0: ohne Kacheln create_ifc verwenden")
+    if index is None:
+        index = TIDIndex.from_data(data)
+    tiles = partition(data, index, tile_size)
+    logging.info(f"Schreibe {len(tiles)} Kacheln von {tile_size} m")
+
+    tile_index = {
+        'version': TILE_INDEX_VERSION,
+        'tile_size': tile_size,
+        'model': data.get('model'),
+        'origin': data['min_coordinates'],
+        'tiles': []
+    }
+    settings = {key: data[key] for key in TILE_DATA_KEYS if key in data}
+    jobs = []
+    for (column, row), entry in sorted(tiles.items()):
+        file_name = tile_file_name(stem, column, row)
+        # The tile key scopes the GlobalIds of the entities every tile has (project, site, groups, types)
+        subset = dict(settings, haltungen=entry['haltungen'], normschachte=entry['normschachte'], tile=f"{column}_{row}")
+        jobs.append((os.path.join(output_folder, file_name), subset, entry['abwasserknoten'], incremental))
+        tile_index['tiles'].append({
+            'file': file_name,
+            'column': column,
+            'row': row,
+            'cell': {
+                'min': {'x': column * tile_size, 'y': row * tile_size},
+                'max': {'x': (column + 1) * tile_size, 'y': (row + 1) * tile_size}
+            },
+            'extent': data_extent(entry),
+            'haltungen': len(entry['haltungen']),
+            'normschachte': len(entry['normschachte'])
+        })
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            list(executor.map(write_tile, jobs))
+    else:
+        for job in jobs:
+            write_tile(job)
+
+    with open(os.path.join(output_folder, tile_index_name(stem)), 'w', encoding='utf-8') as f:
+        json.dump(tile_index, f, indent=2)
+    return tile_index
@@ -0,0 +1,148 @@
+from dataclasses import dataclass, asdict
+import numpy as np
+
+# Compact record types returned by XTFParser.
+#
+# The records use __slots__ instead of a per-instance dict, which keeps the
+# memory of large networks down. Record adds a read-mostly dict view
+# (record['lage'], record.get('kote'), 'z' in record, keys()/items()) so
+# code written against the former dicts keeps working, and to_dict() returns
+# plain nested dicts. The Flask app serialises records through to_dict(), so
+# records can be passed to jsonify directly.
+
+# Rough resident size of a slotted record with its coordinate object or polyline array,
+# and of a polyline vertex (two float64 values)
+RECORD_SIZE = 400
+VERTEX_SIZE = 16
+
+class Record:
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def values(self):
+        return [getattr(self, key) for key in self.__slots__]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.__slots__]
+
+    def to_dict(self):
+        return asdict(self)
+
+@dataclass
+class Coord(Record):
+    __slots__ = ('c1', 'c2')
+    c1: float
+    c2: float
+
+@dataclass
+class Coord3D(Record):
+    __slots__ = ('c1', 'c2', 'z')
+    c1: float
+    c2: float
+    z: float
+
+@dataclass
+class Abwasserknoten(Record):
+    __slots__ = ('id', 'lage', 'kote', 'ref', 'model', 'bezeichnung', 'letzte_aenderung')
+    id: str
+    lage: Coord
+    kote: float
+    ref: str
+    model: str
+    bezeichnung: str
+    letzte_aenderung: str
+
+@dataclass
+class Haltungspunkt(Record):
+    __slots__ = ('id', 'lage', 'model')
+    id: str
+    lage: Coord3D
+    model: str
+
+@dataclass
+class Normschacht(Record):
+    __slots__ = ('id', 'abwasserknoten_id', 'lage', 'kote', 'dimension1', 'dimension2', 'dimorg1', 'dimorg2',
+                 'bezeichnung', 'standortname', 'funktion', 'material', 'model')
+    id: str
+    abwasserknoten_id: str
+    lage: Coord
+    kote: float
+    dimension1: float
+    dimension2: float
+    dimorg1: str
+    dimorg2: str
+    bezeichnung: str
+    standortname: str
+    funktion: str
+    material: str
+    model: str
+
+def polyline_dicts(verlauf):
+    # Polyline array as the list of {'c1', 'c2'} (and 'kote' for (N, 3) arrays) used in JSON output
+    keys = ('c1', 'c2', 'kote')[:verlauf.shape[1]]
+    return [dict(zip(keys, vertex)) for vertex in verlauf.tolist()]
+
+# The course (verlauf) of a Haltung is a float64 array of shape (N, 2) with the
+# C1/C2 values of its vertices, so the IFC builder can process it vectorized.
+@dataclass(eq=False)
+class Haltung(Record):
+    __slots__ = ('id', 'bezeichnung', 'durchmesser', 'material', 'length', 'verlauf',
+                 'von_haltungspunkt', 'nach_haltungspunkt', 'von_z', 'nach_z', 'model')
+    id: str
+    bezeichnung: str
+    durchmesser: float
+    material: str
+    length: float
+    verlauf: np.ndarray
+    von_haltungspunkt: Haltungspunkt
+    nach_haltungspunkt: Haltungspunkt
+    von_z: float
+    nach_z: float
+    model: str
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(
+            np.array_equal(getattr(self, key), getattr(other, key)) if key == 'verlauf'
+            else getattr(self, key) == getattr(other, key)
+            for key in self.__slots__
+        )
+
+    __hash__ = None
+
+    def to_dict(self):
+        values = asdict(self)
+        values['verlauf'] = polyline_dicts(self.verlauf)
+        return values
+
+@dataclass
+class Kanal(Record):
+    __slots__ = ('id', 'letzte_aenderung', 'standortname', 'zugaenglichkeit', 'bezeichnung', 'nutzungsart_ist', 'model')
+    id: str
+    letzte_aenderung: str
+    standortname: str
+    zugaenglichkeit: str
+    bezeichnung: str
+    nutzungsart_ist: str
+    model: str
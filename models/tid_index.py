@@ -0,0 +1,79 @@
+class TIDIndex:
+    """Hash indexes over parsed sewer nodes and haltungspunkte.
+
+    Built once per parse and shared by the parser and the IFC builder, so
+    references are resolved with dict lookups instead of list scans. Every
+    lookup returns the first matching record in parse order, like the scans
+    it replaces.
+    """
+
+    def __init__(self, abwasserknoten=(), haltungspunkte=()):
+        self.abwasserknoten_by_id = {}
+        self.abwasserknoten_by_stripped_id = {}
+        self.abwasserknoten_by_ref = {}
+        self.haltungspunkte_by_id = {}
+        self.haltungspunkte = []
+        # Substring tables over the haltungspunkt TIDs, built on demand per substring length
+        self.haltungspunkte_by_substring = {}
+        self.abwasserknoten_count = 0
+        self.add_abwasserknoten(abwasserknoten)
+        self.add_haltungspunkte(haltungspunkte)
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(data.get('abwasserknoten', ()), data.get('haltungspunkte', ()))
+
+    def add_abwasserknoten(self, records):
+        for record in records:
+            entry = (self.abwasserknoten_count, record)
+            self.abwasserknoten_by_id.setdefault(record['id'], entry)
+            self.abwasserknoten_by_stripped_id.setdefault(record['id'].strip(), entry)
+            self.abwasserknoten_by_ref.setdefault(record.get('ref'), entry)
+            self.abwasserknoten_count += 1
+
+    def add_haltungspunkte(self, records):
+        for record in records:
+            self.haltungspunkte_by_id.setdefault(record['id'], record)
+            self.haltungspunkte.append(record)
+        self.haltungspunkte_by_substring.clear()
+
+    def abwasserknoten(self, tid):
+        # Sewer node with exactly this TID
+        entry = self.abwasserknoten_by_id.get(tid)
+        return entry[1] if entry else None
+
+    def abwasserknoten_for(self, bauwerk_id):
+        # First sewer node whose TID or AbwasserbauwerkRef equals bauwerk_id
+        by_id = self.abwasserknoten_by_stripped_id.get(bauwerk_id)
+        by_ref = self.abwasserknoten_by_ref.get(bauwerk_id)
+        if by_id and by_ref:
+            return min(by_id, by_ref, key=lambda entry: entry[0])[1]
+        entry = by_id or by_ref
+        return entry[1] if entry else None
+
+    def haltungspunkt(self, tid):
+        return self.haltungspunkte_by_id.get(tid)
+
+    def haltungspunkte_containing(self, text):
+        # Haltungspunkte whose TID contains text, in parse order, like a scan with `text in hp['id']`.
+        # The first query of a length indexes every substring of that length of all TIDs, so
+        # further queries are a single dict lookup.
+        if text is None:
+            return []
+        if not text:
+            return [record for record in self.haltungspunkte if record['id'] is not None]
+        table = self.haltungspunkte_by_substring.get(len(text))
+        if table is None:
+            table = self.haltungspunkte_by_substring[len(text)] = self.substring_table(len(text))
+        return table.get(text, [])
+
+    def substring_table(self, length):
+        # substring -> haltungspunkte whose TID contains it, each record listed once
+        table = {}
+        for record in self.haltungspunkte:
+            tid = record['id']
+            if tid is None:
+                continue
+            for substring in {tid[start:start + length] for start in range(len(tid) - length + 1)}:
+                table.setdefault(substring, []).append(record)
+        return table
@@ -0,0 +1,67 @@
+import xml.etree.ElementTree as ET
+import logging
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+class ElementTreeBackend:
+    # XML backend on the standard library ElementTree
+    name = 'etree'
+    ParseError = ET.ParseError
+
+    def parse(self, source):
+        return ET.parse(source).getroot()
+
+    def iterparse(self, source, events):
+        return ET.iterparse(source, events=events)
+
+    def baskets(self, root, namespace):
+        # Baskets are the children of TRANSFER/DATASECTION
+        datasection_tag = '{' + namespace['ili'] + '}DATASECTION'
+        return [basket for section in root if section.tag == datasection_tag for basket in section]
+
+class LxmlBackend:
+    # XML backend on lxml: C parser, compiled XPath, comments dropped while parsing
+    name = 'lxml'
+
+    def __init__(self):
+        self.ParseError = lxml_etree.XMLSyntaxError
+        self.parser = lxml_etree.XMLParser(remove_comments=True, remove_pis=True, resolve_entities=False, huge_tree=True)
+        # Compiled XPath expressions for the baskets, per namespace URI
+        self.basket_paths = {}
+
+    def parse(self, source):
+        return lxml_etree.parse(source, self.parser).getroot()
+
+    def iterparse(self, source, events):
+        return lxml_etree.iterparse(source, events=events, remove_comments=True, remove_pis=True,
+                                    resolve_entities=False, huge_tree=True)
+
+    def baskets(self, root, namespace):
+        basket_path = self.basket_paths.get(namespace['ili'])
+        if basket_path is None:
+            basket_path = self.basket_paths[namespace['ili']] = lxml_etree.XPath('ili:DATASECTION/*', namespaces=namespace)
+        return basket_path(root)
+
+BACKENDS = {
+    'etree': ElementTreeBackend,
+    'lxml': LxmlBackend
+}
+
+def available_backends():
+    # Names of the backends that can be used in this environment
+    return [name for name in BACKENDS if name != 'lxml' or lxml_etree is not None]
+
+def get_backend(name='auto'):
+    # Return the requested XML backend; 'auto' prefers lxml and falls back to ElementTree
+    name = (name or 'auto').lower()
+    if name == 'auto':
+        name = 'lxml' if lxml_etree is not None else 'etree'
+    elif name == 'lxml' and lxml_etree is None:
+        logging.warning("lxml ist nicht installiert, verwende ElementTree.")
+        name = 'etree'
+    elif name not in BACKENDS:
+        raise ValueError(f"Unbekanntes XML-Backend: {name}")
+    return BACKENDS[name]()
@@ -1,8 +1,101 @@
-import xml.etree.ElementTree as ET
+import io
 import math
+import mmap
 import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from models.tid_index import TIDIndex
+from models.xtf_schema import compile_extractors, schema_model
+from models.xml_backend import get_backend
+from models.records import Coord, Coord3D, Abwasserknoten, Haltungspunkt, Normschacht, Haltung, Kanal, RECORD_SIZE, VERTEX_SIZE
+from models.xtf_source import compression, open_xtf
+from models.xtf_preflight import read_head, sniff_header, count_tags, split_baskets
+from models.coordinates import CoordinateColumns, CoordinateSet, axis_dict
+
+INTERLIS_NAMESPACE = 'http://www.interlis.ch/INTERLIS2.3'
+
+# Version of the parse output; bump when the extracted data changes so cached results are not reused
+PARSER_VERSION = 1
+
+# Model containers (baskets) in the order identify_model checks them
+MODEL_CONTAINERS = [
+    ('DSS_2020_LV95.Siedlungsentwaesserung', 'DSS_2020_LV95'),
+    ('SIA405_ABWASSER_2015_LV95.SIA405_Abwasser', 'SIA405_ABWASSER_2015_LV95'),
+    ('DSS_2015_LV95.Siedlungsentwaesserung', 'DSS_2015_LV95')
+]
+
+# Object classes extracted from an XTF file
+ENTITY_CLASSES = ('Abwasserknoten', 'Haltungspunkt', 'Normschacht', 'Haltung', 'Kanal')
+
+# Keys of the extracted records in the parse output per object class
+ENTITY_KEYS = {
+    'Abwasserknoten': 'abwasserknoten',
+    'Haltungspunkt': 'haltungspunkte',
+    'Normschacht': 'normschachte',
+    'Haltung': 'haltungen',
+    'Kanal': 'kanale'
+}
+
+# Object classes whose records are needed to resolve the records of a class
+ENTITY_DEPENDENCIES = {
+    'Normschacht': ('Abwasserknoten', 'Haltungspunkt'),
+    'Haltung': ('Haltungspunkt',)
+}
+
+# Rough parse time per XTF object, used for the pre-flight estimate
+PARSE_SECONDS_PER_OBJECT = 0.0001
+# Rough parse time and retained memory per input byte when the tags are not counted
+PARSE_SECONDS_PER_BYTE = 0.00000015
+MEMORY_PER_BYTE = 0.5
+
+# Minimum size of a segment parsed by a worker process
+PARALLEL_SEGMENT_BYTES = 4 * 1024 * 1024
+
+def select_entities(include=None, exclude=None):
+    # Object classes selected by include/exclude. Both accept class names or output keys
+    # ('Haltung' or 'haltungen', case-insensitive) as a list or a comma-separated string;
+    # without include all classes are selected.
+    names = {}
+    for entity, key in ENTITY_KEYS.items():
+        names[entity.lower()] = entity
+        names[key] = entity
+
+    def resolve(values):
+        if isinstance(values, str):
+            values = values.split(',')
+        entities = set()
+        for value in values:
+            value = value.strip()
+            if not value:
+                continue
+            if value.lower() not in names:
+                raise ValueError(f"Unbekannte Objektklasse: {value}")
+            entities.add(names[value.lower()])
+        return entities
+
+    selected = resolve(include) if include else set(ENTITY_CLASSES)
+    if exclude:
+        selected -= resolve(exclude)
+    return tuple(entity for entity in ENTITY_CLASSES if entity in selected)
+
+def required_entities(entities):
+    # Selected object classes plus the classes they are resolved against
+    required = set(entities)
+    for entity in entities:
+        required.update(ENTITY_DEPENDENCIES.get(entity, ()))
+    return tuple(entity for entity in ENTITY_CLASSES if entity in required)
 
 class XTFParser:
+    def __init__(self, backend=None):
+        # XML backend ('etree', 'lxml' or 'auto'); defaults to the 'xml_backend' config value
+        self.backend = backend
+        # TID index of the last parse, shared with the IFC builder
+        self.index = None
+        # Coordinate columns of the last parse (abwasserknoten, haltungspunkte, normschachte)
+        self.coordinates = None
+        # Object classes selected for the last parse
+        self.entities = ENTITY_CLASSES
+
     @staticmethod
     def round_down_to_nearest_10(value):
         # Round down the value to the nearest multiple of 10
@@ -34,29 +127,23 @@ class XTFParser:
             logging.warning(f"Konvertierung zu Integer fehlgeschlagen für Wert: {value}")
             return None
 
-    def parse(self, xtf_file_path, config):
-        # Parse the XTF file and extract data based on the provided configuration
-        try:
-            tree = ET.parse(xtf_file_path)
-        except ET.ParseError as e:
-            logging.error(f"Fehler beim Parsen der XTF-Datei: {e}")
-            raise
-
-        root = tree.getroot()
-        namespace = {'ili': 'http://www.interlis.ch/INTERLIS2.3'}
-
-        # Extract default values from the configuration
-        default_sohlenkote = config['default_sohlenkote']
-        default_durchmesser = config['default_durchmesser']
-        default_hoehe = config['default_hoehe']
-        default_wanddicke = config['default_wanddicke']
-        default_bodendicke = config['default_bodendicke']
-        default_rohrdicke = config['default_rohrdicke']
-        einfaerben = config['einfaerben']
-
-        # Identify the model used in the XTF file
-        model = self.identify_model(root, namespace)
-        logging.info(f"Identified model: {model}")
+    def parse(self, xtf_file_path, config, streaming=False, workers=None, include=None, exclude=None):
+        # Parse the XTF file and extract data based on the provided configuration.
+        # xtf_file_path is a path or a binary file object such as an upload stream or an mmap.
+        # With streaming=True the file is read with iterparse and every object is
+        # dropped as soon as it has been extracted, so the DOM is never held in memory.
+        # With more than one worker (default: the 'parse_workers' config value) the
+        # file is split into segments that are parsed in separate processes.
+        # Files compressed with gzip, bzip2 or ZIP are decompressed on the fly.
+        # include/exclude select the object classes (see select_entities); objects of other
+        # classes are skipped without extraction, except for the classes a selected class is
+        # resolved against. Only the selected classes are returned.
+        self.entities = select_entities(include, exclude)
+        if self.entities != ENTITY_CLASSES:
+            logging.info(f"Ausgewählte Objektklassen: {', '.join(self.entities)}")
+        namespace = {'ili': INTERLIS_NAMESPACE}
+        backend = get_backend(self.backend or config.get('xml_backend', 'auto'))
+        logging.info(f"Using XML backend: {backend.name}")
 
         # Initialize data structures to hold parsed information
         data = {
@@ -70,43 +157,42 @@ class XTFParser:
             'nicht_verarbeitete_haltungen': []
         }
 
+        if workers is None:
+            workers = config.get('parse_workers', 0)
+
+        source = xtf_file_path
+        if compression(xtf_file_path) is not None:
+            logging.info(f"Entpacke {xtf_file_path} beim Lesen")
+            source = open_xtf(xtf_file_path)
+        if workers > 1 and (source is not xtf_file_path or hasattr(source, 'read')):
+            # The workers read their segments from a file path
+            logging.info("Komprimierte Dateien und Datenströme werden seriell geparst.")
+            workers = 0
+
         try:
-            logging.info("Parsing abwasserknoten...")
-            data['abwasserknoten'], haltungspunkt_sohlenkoten = self.parse_abwasserknoten(
-                root, namespace, default_sohlenkote, default_durchmesser, default_hoehe, model
-            )
-            
-            logging.info("Parsing haltungspunkte...")
-            data['haltungspunkte'] = self.parse_haltungspunkte(
-                root, namespace, default_sohlenkote, model
-            )
-            
-            logging.info("Parsing normschachte...")
-            data['normschachte'], data['nicht_verarbeitete_normschachte'] = self.parse_normschachte(
-                root, namespace, data['abwasserknoten'], data['haltungspunkte'],
-                default_durchmesser, default_hoehe, default_sohlenkote, model
-            )
-            
-            logging.info("Parsing kanale...")
-            data['kanale'], data['nicht_verarbeitete_kanale'] = self.parse_kanale(
-                root, namespace, model
-            )
-            
-            logging.info("Parsing haltungen...")
-            data['haltungen'], data['nicht_verarbeitete_haltungen'] = self.parse_haltungen(
-                root, namespace, data['haltungspunkte'], default_sohlenkote, model
-            )
+            if workers > 1:
+                model = self.parse_parallel(backend, source, namespace, config, data, workers)
+            elif streaming:
+                model = self.parse_streaming(backend, source, namespace, config, data)
+            else:
+                model = self.parse_tree(backend, source, namespace, config, data)
+        except backend.ParseError as e:
+            logging.error(f"Fehler beim Parsen der XTF-Datei: {e}")
+            raise
         except Exception as e:
             logging.error(f"Error parsing data: {e}")
             raise
+        finally:
+            if source is not xtf_file_path:
+                source.close()
 
         try:
             # Calculate minimum coordinates from the parsed data
-            min_x, min_y, min_z = self.find_min_coordinates(data)
+            min_x, min_y, min_z = self.find_min_coordinates(self.coordinates)
             if any(math.isinf(coord) for coord in (min_x, min_y, min_z)):
                 logging.error(f"Ungültige Mindestkoordinaten gefunden: x={min_x}, y={min_y}, z={min_z}")
-                raise ValueError("Ungültige Mindestkoordinaten")        
-            
+                raise ValueError("Ungültige Mindestkoordinaten")
+
             data['min_coordinates'] = {
                 'x': min_x,
                 'y': min_y,
@@ -118,378 +204,546 @@ class XTFParser:
                 'error': f"Failed to calculate minimum coordinates: {str(e)}"
             }
 
+        # Extent and per-class coordinate statistics
+        minimum, maximum = self.coordinates.extent()
+        data['extent'] = {'min': axis_dict(minimum), 'max': axis_dict(maximum)}
+        data['statistics'] = self.coordinates.statistics()
+
         # Update data with configuration and model information
         data.update(config)
         data['model'] = model
+        data['entities'] = list(self.entities)
 
         return data
 
-    def identify_model(self, root, namespace):
-        # Identify the model used in the XTF file based on known paths
-        model_paths = [
-            ('.//ili:DSS_2020_LV95.Siedlungsentwaesserung', 'DSS_2020_LV95'),
-            ('.//ili:SIA405_ABWASSER_2015_LV95.SIA405_Abwasser', 'SIA405_ABWASSER_2015_LV95'),
-            ('.//ili:DSS_2015_LV95.Siedlungsentwaesserung', 'DSS_2015_LV95')
-        ]
-        
-        for path, model_name in model_paths:
-            if root.find(path, namespace) is not None:
+    def preflight(self, source, count=True):
+        # Cheap estimate before a full parse: the model is sniffed from the header and the
+        # first baskets, and with count=True the object tags are counted on the raw bytes.
+        # source is a path or a binary file-like object, which is rewound afterwards.
+        start = source.tell() if hasattr(source, 'read') else None
+        f = open_xtf(source)
+        try:
+            head = read_head(f)
+            models, baskets = sniff_header(head)
+            if count:
+                counts, vertices, size = count_tags(f, head)
+            else:
+                counts, vertices = None, None
+                size = self.source_size(f, len(head))
+        finally:
+            if f is not source:
+                f.close()
+            if start is not None:
+                source.seek(start)
+
+        estimate = {
+            'model': self.identify_model_from_header(models, baskets),
+            'models': models,
+            'size': size,
+            'objects': None,
+            'counts': None,
+            'vertices': vertices
+        }
+        if counts is None:
+            estimate['estimated_seconds'] = round(size * PARSE_SECONDS_PER_BYTE, 2)
+            estimate['estimated_memory'] = int(size * MEMORY_PER_BYTE)
+        else:
+            records = sum(counts.get(entity, 0) for entity in ENTITY_CLASSES)
+            estimate['objects'] = sum(counts.values())
+            estimate['counts'] = {entity: counts.get(entity, 0) for entity in ENTITY_CLASSES}
+            estimate['estimated_seconds'] = round(estimate['objects'] * PARSE_SECONDS_PER_OBJECT, 2)
+            estimate['estimated_memory'] = records * RECORD_SIZE + vertices * VERTEX_SIZE
+        return estimate
+
+    @staticmethod
+    def source_size(f, fallback):
+        # Size of a file object without reading it
+        try:
+            position = f.tell()
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(position)
+            return size
+        except (AttributeError, OSError):
+            return fallback
+
+    def identify_model_from_header(self, models, baskets):
+        # Identify the model from the sniffed basket names, falling back to HEADERSECTION/MODELS
+        for name, model_name in MODEL_CONTAINERS:
+            if name in baskets:
+                return model_name
+        for _, model_name in MODEL_CONTAINERS:
+            if model_name in models:
+                return model_name
+        return "GENERIC"
+
+    def parse_tree(self, backend, xtf_file_path, namespace, config, data):
+        # Parse the whole XTF file into a DOM and hand every basket object to the dispatcher
+        root = backend.parse(xtf_file_path)
+        dispatcher = ObjectDispatcher(self, namespace, config, required_entities(self.entities))
+
+        for basket in backend.baskets(root, namespace):
+            dispatcher.add_basket(basket)
+            for element in basket:
+                dispatcher.add_object(element)
+
+        return self.assemble(dispatcher, config, data)
+
+    def parse_streaming(self, backend, xtf_file_path, namespace, config, data):
+        # Parse the XTF file with iterparse. Each object is extracted into a record when
+        # its end tag is read and then removed from its basket, so peak memory grows with
+        # the number of extracted records instead of the size of the XML document.
+        dispatcher = ObjectDispatcher(self, namespace, config, required_entities(self.entities))
+        self.read_streaming(backend, xtf_file_path, namespace, dispatcher)
+        return self.assemble(dispatcher, config, data)
+
+    def parse_parallel(self, backend, xtf_file_path, namespace, config, data, workers):
+        # Cut the DATASECTION at basket (and for large baskets at object) boundaries and
+        # extract the segments in worker processes. The extracted records are merged in
+        # file order, and references across segments are resolved afterwards in assemble.
+        with open(xtf_file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            segment_bytes = max(PARALLEL_SEGMENT_BYTES, -(-len(buffer) // workers))
+            transfer_tag, segments = split_baskets(buffer, segment_bytes)
+
+        if len(segments) < 2:
+            logging.info("Datei wird nicht aufgeteilt, parse seriell.")
+            return self.parse_streaming(backend, xtf_file_path, namespace, config, data)
+
+        logging.info(f"Parse {len(segments)} Segmente mit {workers} Prozessen")
+        entities = required_entities(self.entities)
+        dispatcher = ObjectDispatcher(self, namespace, config, entities)
+        jobs = [(backend.name, xtf_file_path, transfer_tag, segment, config, entities) for segment in segments]
+        with ProcessPoolExecutor(max_workers=min(workers, len(segments))) as executor:
+            for groups, baskets, coordinates in executor.map(parse_segment, jobs):
+                dispatcher.merge(groups, baskets, coordinates)
+
+        return self.assemble(dispatcher, config, data)
+
+    def read_streaming(self, backend, source, namespace, dispatcher):
+        # Hand every basket and basket object of an XTF document to the dispatcher while iterparsing
+        datasection_tag = '{' + namespace['ili'] + '}DATASECTION'
+        parents = []
+
+        for event, element in backend.iterparse(source, ('start', 'end')):
+            if event == 'start':
+                parents.append(element)
+                continue
+            parents.pop()
+
+            if len(parents) < 2 or parents[1].tag != datasection_tag:
+                continue
+            if len(parents) == 2:
+                dispatcher.add_basket(element)
+            elif len(parents) == 3:
+                # Objects are the children of a basket: TRANSFER/DATASECTION/basket/object
+                dispatcher.add_object(element)
+                element.clear()
+                parents[-1].remove(element)
+
+    def assemble(self, dispatcher, config, data):
+        # Select the extracted records for the identified model and resolve references between them
+        default_sohlenkote = config['default_sohlenkote']
+
+        model = self.identify_model(dispatcher.baskets)
+        logging.info(f"Identified model: {model}")
+        required = required_entities(self.entities)
+
+        def select(entity, description):
+            # Pick the records of the first candidate element name that occurred in the file
+            if entity not in required:
+                return None, [], []
+            for name in self.entity_names(entity, model):
+                if name in dispatcher.groups:
+                    records, unprocessed = dispatcher.groups[name]
+                    logging.info(f"Found {len(records) + len(unprocessed)} {description} using element: {name}")
+                    return name, records, unprocessed
+            logging.warning(f"No {description} found in the file.")
+            return None, [], []
+
+        self.coordinates = CoordinateSet()
+
+        name, abwasserknoten, _ = select('Abwasserknoten', 'sewer nodes')
+        for record in abwasserknoten:
+            record.model = model
+        self.coordinates.add('abwasserknoten', dispatcher.coordinates.get(name))
+
+        name, haltungspunkte, _ = select('Haltungspunkt', 'haltungspunkte')
+        for record in haltungspunkte:
+            record.model = model
+        self.coordinates.add('haltungspunkte', dispatcher.coordinates.get(name))
+
+        # Classes only extracted to resolve a selected class are kept in the index, not in the output
+        if 'Abwasserknoten' in self.entities:
+            data['abwasserknoten'] = abwasserknoten
+        if 'Haltungspunkt' in self.entities:
+            data['haltungspunkte'] = haltungspunkte
+        self.index = TIDIndex(abwasserknoten, haltungspunkte)
+
+        _, normschachte, _ = select('Normschacht', 'norm shafts')
+        data['normschachte'], data['nicht_verarbeitete_normschachte'] = self.resolve_normschachte(
+            normschachte, self.index, default_sohlenkote, model,
+            self.coordinates.add('normschachte')
+        )
+
+        _, kanale, nicht_verarbeitete_kanale = select('Kanal', 'channels')
+        for record in kanale:
+            record.model = model
+        data['kanale'], data['nicht_verarbeitete_kanale'] = kanale, list(nicht_verarbeitete_kanale)
+
+        _, haltungen, nicht_verarbeitete_haltungen = select('Haltung', 'haltungen')
+        data['haltungen'], data['nicht_verarbeitete_haltungen'] = self.resolve_haltungen(
+            haltungen, self.index, default_sohlenkote, model
+        )
+        data['nicht_verarbeitete_haltungen'][:0] = nicht_verarbeitete_haltungen
+
+        logging.info(f"Parsed {len(data['abwasserknoten'])} sewer nodes, {len(data['haltungspunkte'])} haltungspunkte, "
+                     f"{len(data['normschachte'])} norm shafts, {len(data['kanale'])} channels and "
+                     f"{len(data['haltungen'])} haltungen for model: {model}")
+        return model
+
+    def identify_model(self, baskets):
+        # Identify the model used in the XTF file from the names of its baskets
+        for name, model_name in MODEL_CONTAINERS:
+            if name in baskets:
                 return model_name
-        
+
         logging.warning("Could not identify specific model. Using generic parsing.")
         return "GENERIC"
 
-    def get_element_text(self, element, tag, namespace):
-        # Retrieve text from a specific XML element
-        found_element = element.find(tag, namespace)
-        if found_element is not None and found_element.text is not None:
-            return found_element.text
-        return ''
+    def entity_names(self, entity, model):
+        # Element names under which an entity class is looked up, in order of preference
+        if entity == 'Abwasserknoten':
+            return [
+                'DSS_2020_LV95.Siedlungsentwaesserung.Abwasserknoten',
+                'SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Abwasserknoten',
+                'DSS_2015_LV95.Siedlungsentwaesserung.Abwasserknoten',
+                'Abwasserknoten'  # Generic path
+            ]
+        return [
+            f'{model}.Siedlungsentwaesserung.{entity}',
+            f'{model}.SIA405_Abwasser.{entity}',
+            entity  # Generic path
+        ]
 
     def parse_coordinates(self, element, namespace):
-        # Parse coordinate values from an element
-        c1 = element.find('ili:C1', namespace)
-        c2 = element.find('ili:C2', namespace)
+        # Parse coordinate values from a COORD element
+        prefix = '{' + namespace['ili'] + '}'
+        c1 = element.find(prefix + 'C1')
+        c2 = element.find(prefix + 'C2')
         if c1 is not None and c2 is not None:
-            return {
-                'c1': self.safe_float(c1.text),
-                'c2': self.safe_float(c2.text)
-            }
+            return Coord(self.safe_float(c1.text), self.safe_float(c2.text))
         return None
 
-    def parse_abwasserknoten(self, root, namespace, default_sohlenkote, default_durchmesser, default_hoehe, model):
-        # Parse sewer nodes (abwasserknoten) from the XTF file
-        logging.info(f"Starting to parse sewer nodes for model: {model}")
-        abwasserknoten_data = []
-        haltungspunkt_sohlenkoten = {}
-
-        knoten_paths = [
-            './/ili:DSS_2020_LV95.Siedlungsentwaesserung.Abwasserknoten',
-            './/ili:SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Abwasserknoten',
-            './/ili:DSS_2015_LV95.Siedlungsentwaesserung.Abwasserknoten',
-            './/ili:Abwasserknoten'  # Generic path
-        ]
-
-        for path in knoten_paths:
-            abwasserknoten_elements = root.findall(path, namespace)
-            if abwasserknoten_elements:
-                logging.info(f"Found {len(abwasserknoten_elements)} sewer nodes using path: {path}")
-                break
-        else:
-            logging.warning("No sewer nodes found in the file.")
-            return [], {}
-
-        for abwasserknoten in abwasserknoten_elements:
-            try:
-                lage = abwasserknoten.find('.//ili:Lage/ili:COORD', namespace)
-                if lage is None:
-                    logging.error(f"Fehler: Abwasserknoten {abwasserknoten.get('TID')} hat keine Koordinaten.")
-                    continue
-
-                coords = self.parse_coordinates(lage, namespace)
-                if coords is None:
+    def parse_polyline(self, element, namespace):
+        # Parse the COORD vertices of a POLYLINE element into an (N, 2) array of C1/C2;
+        # vertices without valid values are skipped
+        values = []
+        if element is not None:
+            prefix = '{' + namespace['ili'] + '}'
+            coord_tag, c1_tag, c2_tag = prefix + 'COORD', prefix + 'C1', prefix + 'C2'
+            for coord in element:
+                if coord.tag != coord_tag:
                     continue
+                c1 = coord.find(c1_tag)
+                c2 = coord.find(c2_tag)
+                if c1 is not None and c2 is not None:
+                    values.append((self.safe_float(c1.text), self.safe_float(c2.text)))
+        verlauf = np.array(values, dtype=float).reshape(-1, 2)
+        if len(verlauf) and np.isnan(verlauf).any():
+            verlauf = verlauf[~np.isnan(verlauf).any(axis=1)]
+        return verlauf
+
+    def extract_abwasserknoten(self, abwasserknoten, fields, namespace, default_sohlenkote, model):
+        # Extract a single sewer node from its schema fields; returns None if it has no usable coordinates
+        lage = fields.get('lage')
+        if lage is None:
+            logging.error(f"Fehler: Abwasserknoten {abwasserknoten.get('TID')} hat keine Koordinaten.")
+            return None
 
-                sohlenkote_element = abwasserknoten.find('.//ili:Sohlenkote', namespace)
-                sohlenkote = self.safe_float(sohlenkote_element.text) if sohlenkote_element is not None else default_sohlenkote
-
-                haltungspunkt_id = abwasserknoten.get('TID')
-
-                abwasserknoten_data.append({
-                    'id': haltungspunkt_id,
-                    'lage': coords,
-                    'kote': sohlenkote,
-                    'ref': abwasserknoten.find('.//ili:AbwasserbauwerkRef', namespace).get('REF') if abwasserknoten.find('.//ili:AbwasserbauwerkRef', namespace) is not None else None,
-                    'model': model,
-                    'bezeichnung': self.get_element_text(abwasserknoten, './/ili:Bezeichnung', namespace) or '',
-                    'letzte_aenderung': self.get_element_text(abwasserknoten, './/ili:Letzte_Aenderung', namespace) or ''
-                })
-
-                haltungspunkt_sohlenkoten[haltungspunkt_id] = sohlenkote
-
-            except AttributeError as e:
-                logging.error(f"Fehler beim Parsen des Abwasserknotens {abwasserknoten.get('TID')} für Modell {model}: {e}")
+        coords = self.parse_coordinates(lage, namespace)
+        if coords is None:
+            return None
 
-        logging.info(f"Parsed {len(abwasserknoten_data)} sewer nodes for model: {model}")
-        return abwasserknoten_data, haltungspunkt_sohlenkoten
+        sohlenkote = self.safe_float(fields['sohlenkote']) if 'sohlenkote' in fields else default_sohlenkote
+
+        return Abwasserknoten(
+            id=abwasserknoten.get('TID'),
+            lage=coords,
+            kote=sohlenkote,
+            ref=fields.get('abwasserbauwerk_ref'),
+            model=model,
+            bezeichnung=fields.get('bezeichnung') or '',
+            letzte_aenderung=fields.get('letzte_aenderung') or ''
+        )
+
+    def extract_normschacht(self, ns, fields, namespace, default_durchmesser, default_hoehe):
+        # Extract the attributes of a single norm shaft; its position is resolved later
+        normschacht_id = ns.get('TID')
+
+        # The shaft is matched against the sewer nodes by its AbwasserbauwerkRef or its own TID
+        lookup_id = fields['abwasserbauwerk_ref'] if 'abwasserbauwerk_ref' in fields else normschacht_id
+
+        lage = fields.get('lage')
+
+        dimorg1 = fields.get('dimension1') or ''
+        dimorg2 = fields.get('dimension2') or ''
+
+        return {
+            'id': normschacht_id,
+            'lookup_id': lookup_id,
+            'has_lage': lage is not None,
+            'lage': self.parse_coordinates(lage, namespace) if lage is not None else None,
+            'attributes': {
+                'dimension1': self.safe_float(dimorg1) or default_durchmesser * 1000,
+                'dimension2': self.safe_float(dimorg2) or default_hoehe * 1000,
+                'dimorg1': dimorg1,
+                'dimorg2': dimorg2,
+                'bezeichnung': fields.get('bezeichnung') or '',
+                'standortname': fields.get('standortname') or '',
+                'funktion': fields.get('funktion') or '',
+                'material': fields.get('material') or ''
+            }
+        }
 
-    def parse_normschachte(self, root, namespace, abwasserknoten_data, haltungspunkte, default_durchmesser, default_hoehe, default_sohlenkote, model):
-        # Parse norm shafts (normschachte) from the XTF file
-        logging.info(f"Starting to parse norm shafts for model: {model}")
+    def resolve_normschachte(self, extracted, index, default_sohlenkote, model, coordinates=None):
+        # Position extracted norm shafts by their sewer node, their own Lage or their haltungspunkte.
+        # The positions are appended to the given coordinate columns.
+        if coordinates is None:
+            coordinates = CoordinateColumns()
         normschachte = []
         nicht_verarbeitete_normschachte = []
 
-        schacht_paths = [
-            f'.//ili:{model}.Siedlungsentwaesserung.Normschacht',
-            f'.//ili:{model}.SIA405_Abwasser.Normschacht',
-            './/ili:Normschacht'  # Generic path
-        ]
-
-        for path in schacht_paths:
-            normschacht_elements = root.findall(path, namespace)
-            if normschacht_elements:
-                logging.info(f"Found {len(normschacht_elements)} norm shafts using path: {path}")
-                break
-        else:
-            logging.warning("No norm shafts found in the file.")
-            return [], []
-
-        for ns in normschacht_elements:
-            normschacht_id = ns.get('TID')
-
-            abwasserbauwerk_ref = ns.find('.//ili:AbwasserbauwerkRef', namespace)
-            if abwasserbauwerk_ref is not None:
-                abwasserbauwerk_id = abwasserbauwerk_ref.get('REF')
-                abwasserknoten = next((ak for ak in abwasserknoten_data if ak['id'].strip() == abwasserbauwerk_id or ak.get('ref') == abwasserbauwerk_id), None)
-            else:
-                abwasserknoten = next((ak for ak in abwasserknoten_data if ak['id'].strip() == normschacht_id or ak.get('ref') == normschacht_id), None)
+        for ns in extracted:
+            normschacht_id = ns['id']
+            abwasserknoten = index.abwasserknoten_for(ns['lookup_id'])
 
             if abwasserknoten:
-                normschachte.append({
-                    'id': normschacht_id,
-                    'abwasserknoten_id': abwasserknoten['id'],
-                    'lage': abwasserknoten['lage'],
-                    'kote': abwasserknoten['kote'],
-                    'dimension1': self.safe_float(self.get_element_text(ns, './/ili:Dimension1', namespace)) or default_durchmesser * 1000,
-                    'dimension2': self.safe_float(self.get_element_text(ns, './/ili:Dimension2', namespace)) or default_hoehe * 1000,
-                    'dimorg1': self.get_element_text(ns, './/ili:Dimension1', namespace),
-                    'dimorg2': self.get_element_text(ns, './/ili:Dimension2', namespace),
-                    'bezeichnung': self.get_element_text(ns, './/ili:Bezeichnung', namespace),
-                    'standortname': self.get_element_text(ns, './/ili:Standortname', namespace),
-                    'funktion': self.get_element_text(ns, './/ili:Funktion', namespace),
-                    'material': self.get_element_text(ns, './/ili:Material', namespace),
-                    'model': model
-                })
+                normschachte.append(Normschacht(
+                    id=normschacht_id,
+                    abwasserknoten_id=abwasserknoten['id'],
+                    lage=abwasserknoten['lage'],
+                    kote=abwasserknoten['kote'],
+                    **ns['attributes'],
+                    model=model
+                ))
+            elif ns['has_lage']:
+                normschachte.append(Normschacht(
+                    id=normschacht_id,
+                    abwasserknoten_id=None,
+                    lage=ns['lage'],
+                    kote=default_sohlenkote,
+                    **ns['attributes'],
+                    model=model
+                ))
             else:
-                lage = ns.find('.//ili:Lage/ili:COORD', namespace)
-                if lage is not None:
-                    coords = self.parse_coordinates(lage, namespace)
-                    normschachte.append({
-                        'id': normschacht_id,
-                        'abwasserknoten_id': None,
-                        'lage': coords,
-                        'kote': default_sohlenkote,
-                        'dimension1': self.safe_float(self.get_element_text(ns, './/ili:Dimension1', namespace)) or default_durchmesser * 1000,
-                        'dimension2': self.safe_float(self.get_element_text(ns, './/ili:Dimension2', namespace)) or default_hoehe * 1000,
-                        'dimorg1': self.get_element_text(ns, './/ili:Dimension1', namespace),
-                        'dimorg2': self.get_element_text(ns, './/ili:Dimension2', namespace),
-                        'bezeichnung': self.get_element_text(ns, './/ili:Bezeichnung', namespace),
-                        'standortname': self.get_element_text(ns, './/ili:Standortname', namespace),
-                        'funktion': self.get_element_text(ns, './/ili:Funktion', namespace),
-                        'material': self.get_element_text(ns, './/ili:Material', namespace),
-                        'model': model
-                    })
+                zugehoerige_haltungspunkte = [hp for hp in index.haltungspunkte_containing(normschacht_id) if hp['lage']['c1'] and hp['lage']['c2']]
+                if len(zugehoerige_haltungspunkte) >= 2:
+                    # Calculate the midpoint if there are associated haltungspunkte
+                    mittelpunkt_c1 = sum(self.safe_float(hp['lage']['c1']) for hp in zugehoerige_haltungspunkte) / len(zugehoerige_haltungspunkte)
+                    mittelpunkt_c2 = sum(self.safe_float(hp['lage']['c2']) for hp in zugehoerige_haltungspunkte) / len(zugehoerige_haltungspunkte)
+                    normschachte.append(Normschacht(
+                        id=normschacht_id,
+                        abwasserknoten_id=None,
+                        lage=Coord(mittelpunkt_c1, mittelpunkt_c2),
+                        kote=default_sohlenkote,
+                        **ns['attributes'],
+                        model=model
+                    ))
                 else:
-                    zugehoerige_haltungspunkte = [hp for hp in haltungspunkte if hp['lage']['c1'] and hp['lage']['c2'] and normschacht_id in hp['id']]
-                    if len(zugehoerige_haltungspunkte) >= 2:
-                        # Calculate the midpoint if there are associated haltungspunkte
-                        mittelpunkt_c1 = sum(self.safe_float(hp['lage']['c1']) for hp in zugehoerige_haltungspunkte) / len(zugehoerige_haltungspunkte)
-                        mittelpunkt_c2 = sum(self.safe_float(hp['lage']['c2']) for hp in zugehoerige_haltungspunkte) / len(zugehoerige_haltungspunkte)
-                        normschachte.append({
-                            'id': normschacht_id,
-                            'abwasserknoten_id': None,
-                            'lage': {'c1': mittelpunkt_c1, 'c2': mittelpunkt_c2},
-                            'kote': default_sohlenkote,
-                            'dimension1': self.safe_float(self.get_element_text(ns, './/ili:Dimension1', namespace)) or default_durchmesser * 1000,
-                            'dimension2': self.safe_float(self.get_element_text(ns, './/ili:Dimension2', namespace)) or default_hoehe * 1000,
-                            'dimorg1': self.get_element_text(ns, './/ili:Dimension1', namespace),
-                            'dimorg2': self.get_element_text(ns, './/ili:Dimension2', namespace),
-                            'bezeichnung': self.get_element_text(ns, './/ili:Bezeichnung', namespace),
-                            'standortname': self.get_element_text(ns, './/ili:Standortname', namespace),
-                            'funktion': self.get_element_text(ns, './/ili:Funktion', namespace),
-                            'material': self.get_element_text(ns, './/ili:Material', namespace),
-                            'model': model
-                        })
-                    else:
-                        logging.warning(f"Normschacht {normschacht_id} hat keine Koordinaten")
-                        nicht_verarbeitete_normschachte.append(normschacht_id)
+                    logging.warning(f"Normschacht {normschacht_id} hat keine Koordinaten")
+                    nicht_verarbeitete_normschachte.append(normschacht_id)
+                    continue
+
+            normschacht = normschachte[-1]
+            if normschacht.lage is not None:
+                coordinates.append(normschacht.lage.c1, normschacht.lage.c2, normschacht.kote)
 
         logging.info(f"Parsed {len(normschachte)} norm shafts for model: {model}")
         return normschachte, nicht_verarbeitete_normschachte
 
-    def parse_haltungspunkte(self, root, namespace, default_sohlenkote, model):
-        # Parse haltungspunkte from the XTF file
-        logging.info(f"Starting to parse haltungspunkte for model: {model}")
-        haltungspunkte = []
+    def extract_haltungspunkt(self, element, fields, namespace, default_sohlenkote, model):
+        # Extract a single haltungspunkt from its schema fields; returns None if it has no usable coordinates
+        lage = fields.get('lage')
 
-        haltungspunkt_paths = [
-            f'.//ili:{model}.Siedlungsentwaesserung.Haltungspunkt',
-            f'.//ili:{model}.SIA405_Abwasser.Haltungspunkt',
-            './/ili:Haltungspunkt'  # Generic path
-        ]
+        if lage is None:
+            return None
 
-        for path in haltungspunkt_paths:
-            haltungspunkt_elements = root.findall(path, namespace)
-            if haltungspunkt_elements:
-                logging.info(f"Found {len(haltungspunkt_elements)} haltungspunkte using path: {path}")
-                break
-        else:
-            logging.warning("No haltungspunkte found in the file.")
-            return []
-
-        for element in haltungspunkt_elements:
-            try:
-                lage = element.find('.//ili:Lage/ili:COORD', namespace)
-                kote = element.find('.//ili:Kote', namespace)
-
-                if lage is not None:
-                    coords = self.parse_coordinates(lage, namespace)
-                    if coords:
-                        z_value = self.safe_float(kote.text) if kote is not None else None
-                        if z_value is None:
-                            z_value = default_sohlenkote
-                            logging.warning(f"Fehlende Kote für Haltungspunkt {element.get('TID')}, verwende Standardwert: {default_sohlenkote}")
-
-                        haltungspunkte.append({
-                            'id': element.get('TID'),
-                            'lage': {
-                                'c1': coords['c1'],
-                                'c2': coords['c2'],
-                                'z': z_value
-                            },
-                            'model': model
-                        })
-            except AttributeError as e:
-                logging.error(f"Fehler beim Parsen des Haltungspunkts {element.get('TID')}: {e}")
-
-        logging.info(f"Parsed {len(haltungspunkte)} haltungspunkte for model: {model}")
-        return haltungspunkte
-
-    def find_min_coordinates(self, data):
-        # Find minimum x, y, z coordinates from the data
-        min_x = float('inf')
-        min_y = float('inf')
-        min_z = float('inf')
-        
-        for element in data['haltungspunkte'] + data['abwasserknoten'] + data['normschachte']:
-            if 'lage' in element:
-                c1 = self.safe_float(element['lage'].get('c1'))
-                c2 = self.safe_float(element['lage'].get('c2'))
-                if c1 is not None and not math.isinf(c1):
-                    min_x = min(min_x, c1)
-                if c2 is not None and not math.isinf(c2):
-                    min_y = min(min_y, c2)
-                if 'z' in element['lage']:
-                    z = self.safe_float(element['lage']['z'])
-                    if z is not None and not math.isinf(z):
-                        min_z = min(min_z, z)
-                elif 'kote' in element:
-                    kote = self.safe_float(element['kote'])
-                    if kote is not None and not math.isinf(kote):
-                        min_z = min(min_z, kote)
-        
-        min_x = self.round_down_to_nearest_10(min_x)
-        min_y = self.round_down_to_nearest_10(min_y)
-        min_z = self.round_down_to_nearest_10(min_z)
-        
-        return min_x, min_y, min_z
-
-    def parse_haltungen(self, root, namespace, haltungspunkte, default_sohlenkote, model):
-        # Parse haltungen from the XTF file
-        logging.info(f"Starting to parse haltungen for model: {model}")
+        coords = self.parse_coordinates(lage, namespace)
+        if not coords:
+            return None
+
+        z_value = self.safe_float(fields.get('kote'))
+        if z_value is None:
+            z_value = default_sohlenkote
+            logging.warning(f"Fehlende Kote für Haltungspunkt {element.get('TID')}, verwende Standardwert: {default_sohlenkote}")
+
+        return Haltungspunkt(
+            id=element.get('TID'),
+            lage=Coord3D(coords.c1, coords.c2, z_value),
+            model=model
+        )
+
+    def find_min_coordinates(self, coordinates):
+        # Find minimum x, y, z coordinates, rounded down to the nearest 10
+        return coordinates.origin(10)
+
+    def extract_haltung(self, haltung, fields, namespace):
+        # Extract the attributes and course of a single haltung; its end points are resolved later
+        bezeichnung = fields.get('bezeichnung') or ''
+        lichte_hoehe = self.safe_float(fields.get('lichte_hoehe'))
+        laenge_effektiv = self.safe_float(fields.get('laenge_effektiv'))
+        material = fields.get('material') or ''
+
+        lichte_hoehe = lichte_hoehe / 1000.0 if lichte_hoehe is not None else 0.5
+        laenge_effektiv = laenge_effektiv if laenge_effektiv is not None else 0.0
+
+        verlauf = self.parse_polyline(fields.get('verlauf'), namespace)
+
+        return {
+            'id': haltung.get('TID'),
+            'bezeichnung': bezeichnung,
+            'durchmesser': lichte_hoehe,
+            'material': material,
+            'length': laenge_effektiv,
+            'verlauf': verlauf,
+            'von_ref': fields.get('von_ref'),
+            'nach_ref': fields.get('nach_ref')
+        }
+
+    def resolve_haltungen(self, extracted, index, default_sohlenkote, model):
+        # Connect extracted haltungen to their start and end haltungspunkte
         haltungen = []
         nicht_verarbeitete_haltungen = []
 
-        haltung_paths = [
-            f'.//ili:{model}.Siedlungsentwaesserung.Haltung',
-            f'.//ili:{model}.SIA405_Abwasser.Haltung',
-            './/ili:Haltung'  # Generic path
-        ]
-
-        for path in haltung_paths:
-            haltung_elements = root.findall(path, namespace)
-            if haltung_elements:
-                logging.info(f"Found {len(haltung_elements)} haltungen using path: {path}")
-                break
-        else:
-            logging.warning("No haltungen found in the file.")
-            return [], []
-
-        for haltung in haltung_elements:
-            try:
-                bezeichnung = self.get_element_text(haltung, './/ili:Bezeichnung', namespace)
-                lichte_hoehe = self.safe_float(self.get_element_text(haltung, './/ili:Lichte_Hoehe', namespace))
-                laenge_effektiv = self.safe_float(self.get_element_text(haltung, './/ili:LaengeEffektiv', namespace))
-                material = self.get_element_text(haltung, './/ili:Material', namespace)
-
-                lichte_hoehe = lichte_hoehe / 1000.0 if lichte_hoehe is not None else 0.5
-                laenge_effektiv = laenge_effektiv if laenge_effektiv is not None else 0.0
-
-                verlauf = []
-                polyline_element = haltung.find('.//ili:Verlauf/ili:POLYLINE', namespace)
-                if polyline_element is not None:
-                    for coord in polyline_element.findall('.//ili:COORD', namespace):
-                        coords = self.parse_coordinates(coord, namespace)
-                        if coords:
-                            verlauf.append(coords)
-
-                von_haltungspunkt_ref = haltung.find('.//ili:vonHaltungspunktRef', namespace)
-                nach_haltungspunkt_ref = haltung.find('.//ili:nachHaltungspunktRef', namespace)
-
-                von_haltungspunkt = next((p for p in haltungspunkte if p['id'] == von_haltungspunkt_ref.get('REF')), None) if von_haltungspunkt_ref is not None else None
-                nach_haltungspunkt = next((p for p in haltungspunkte if p['id'] == nach_haltungspunkt_ref.get('REF')), None) if nach_haltungspunkt_ref is not None else None
-
-                if von_haltungspunkt and nach_haltungspunkt:
-                    von_z = self.safe_float(von_haltungspunkt['lage'].get('z', default_sohlenkote))
-                    nach_z = self.safe_float(nach_haltungspunkt['lage'].get('z', default_sohlenkote))
-
-                    haltungen.append({
-                        'id': haltung.get('TID'),
-                        'bezeichnung': bezeichnung,
-                        'durchmesser': lichte_hoehe,
-                        'material': material,
-                        'length': laenge_effektiv,
-                        'verlauf': verlauf,
-                        'von_haltungspunkt': von_haltungspunkt,
-                        'nach_haltungspunkt': nach_haltungspunkt,
-                        'von_z': von_z,
-                        'nach_z': nach_z,
-                        'model': model
-                    })
-                else:
-                    nicht_verarbeitete_haltungen.append(haltung.get('TID'))
-            except AttributeError as e:
-                nicht_verarbeitete_haltungen.append(haltung.get('TID'))
-                logging.error(f"Fehler bei der Verarbeitung der Haltung {haltung.get('TID')}: {e}")
+        for haltung in extracted:
+            von_haltungspunkt = index.haltungspunkt(haltung['von_ref']) if haltung['von_ref'] is not None else None
+            nach_haltungspunkt = index.haltungspunkt(haltung['nach_ref']) if haltung['nach_ref'] is not None else None
+
+            if von_haltungspunkt and nach_haltungspunkt:
+                von_z = self.safe_float(von_haltungspunkt['lage'].get('z', default_sohlenkote))
+                nach_z = self.safe_float(nach_haltungspunkt['lage'].get('z', default_sohlenkote))
+
+                haltungen.append(Haltung(
+                    id=haltung['id'],
+                    bezeichnung=haltung['bezeichnung'],
+                    durchmesser=haltung['durchmesser'],
+                    material=haltung['material'],
+                    length=haltung['length'],
+                    verlauf=haltung['verlauf'],
+                    von_haltungspunkt=von_haltungspunkt,
+                    nach_haltungspunkt=nach_haltungspunkt,
+                    von_z=von_z,
+                    nach_z=nach_z,
+                    model=model
+                ))
+            else:
+                nicht_verarbeitete_haltungen.append(haltung['id'])
 
         logging.info(f"Parsed {len(haltungen)} haltungen for model: {model}")
         return haltungen, nicht_verarbeitete_haltungen
 
-    def parse_kanale(self, root, namespace, model):
-        # Parse channels (kanale) from the XTF file
-        logging.info(f"Starting to parse channels for model: {model}")
-        kanale = []
-        nicht_verarbeitete_kanale = []
-
-        kanal_paths = [
-            f'.//ili:{model}.Siedlungsentwaesserung.Kanal',
-            f'.//ili:{model}.SIA405_Abwasser.Kanal',
-            './/ili:Kanal'  # Generic path
-        ]
+    def extract_kanal(self, kanal, fields, model):
+        # Extract a single channel from its schema fields
+        return Kanal(
+            id=kanal.get('TID'),
+            letzte_aenderung=fields.get('letzte_aenderung') or "Unbekannt",
+            standortname=fields.get('standortname') or "Unbekannt",
+            zugaenglichkeit=fields.get('zugaenglichkeit') or "Unbekannt",
+            bezeichnung=fields.get('bezeichnung') or "Unbekannt",
+            nutzungsart_ist=fields.get('nutzungsart_ist') or "Unbekannt",
+            model=model
+        )
+
+class ObjectDispatcher:
+    # Routes the objects of an XTF basket to the extractor of their class by element tag.
+    # Records are grouped by element name so the parser can pick the names that belong
+    # to the identified model once all baskets have been read.
+    def __init__(self, parser, namespace, config, entities=ENTITY_CLASSES):
+        default_sohlenkote = config['default_sohlenkote']
+        default_durchmesser = config['default_durchmesser']
+        default_hoehe = config['default_hoehe']
 
-        for path in kanal_paths:
-            kanal_elements = root.findall(path, namespace)
-            if kanal_elements:
-                logging.info(f"Found {len(kanal_elements)} channels using path: {path}")
-                break
-        else:
-            logging.warning("No channels found in the file.")
-            return [], []
-
-        for kanal in kanal_elements:
-            try:
-                kanale.append({
-                    'id': kanal.get('TID'),
-                    'letzte_aenderung': self.get_element_text(kanal, './/ili:Letzte_Aenderung', namespace) or "Unbekannt",
-                    'standortname': self.get_element_text(kanal, './/ili:Standortname', namespace) or "Unbekannt",
-                    'zugaenglichkeit': self.get_element_text(kanal, './/ili:Zugaenglichkeit', namespace) or "Unbekannt",
-                    'bezeichnung': self.get_element_text(kanal, './/ili:Bezeichnung', namespace) or "Unbekannt",
-                    'nutzungsart_ist': self.get_element_text(kanal, './/ili:Nutzungsart_Ist', namespace) or "Unbekannt",
-                    'model': model
-                })
-            except AttributeError as e:
-                nicht_verarbeitete_kanale.append(kanal.get('TID'))
-                logging.error(f"Fehler bei der Verarbeitung des Kanals {kanal.get('TID')}: {e}")
-
-        logging.info(f"Parsed {len(kanale)} channels for model: {model}")
-        return kanale, nicht_verarbeitete_kanale
\ No newline at end of file
+        self.prefix = '{' + namespace['ili'] + '}'
+        self.field_extractors = compile_extractors(namespace)
+        self.extractors = {
+            'Abwasserknoten': lambda element, fields: parser.extract_abwasserknoten(element, fields, namespace, default_sohlenkote, None),
+            'Haltungspunkt': lambda element, fields: parser.extract_haltungspunkt(element, fields, namespace, default_sohlenkote, None),
+            'Normschacht': lambda element, fields: parser.extract_normschacht(element, fields, namespace, default_durchmesser, default_hoehe),
+            'Haltung': lambda element, fields: parser.extract_haltung(element, fields, namespace),
+            'Kanal': lambda element, fields: parser.extract_kanal(element, fields, None)
+        }
+        # Extracted records per element name: name -> (records, unprocessed TIDs)
+        self.groups = {}
+        self.baskets = set()
+        # Coordinate columns of the sewer nodes and haltungspunkte per element name
+        self.coordinates = {}
+        # Object classes to extract; objects of other classes are skipped
+        self.entities = entities
+        # Dispatch table filled on first sight of each tag: tag -> (name, entity, field extractor, columns) or None
+        self.routes = {}
+
+    def add_basket(self, basket):
+        if isinstance(basket.tag, str) and basket.tag.startswith(self.prefix):
+            self.baskets.add(basket.tag[len(self.prefix):])
+
+    def route(self, tag):
+        if not isinstance(tag, str) or not tag.startswith(self.prefix):
+            return None
+        name = tag[len(self.prefix):]
+        entity = name.rsplit('.', 1)[-1]
+        if entity not in self.entities:
+            return None
+        columns = None
+        if entity in ('Abwasserknoten', 'Haltungspunkt'):
+            columns = self.coordinates.setdefault(name, CoordinateColumns())
+        return name, entity, self.field_extractors[(schema_model(name), entity)], columns
+
+    def merge(self, groups, baskets, coordinates):
+        # Append the records extracted from a later segment of the file
+        for name, (records, unprocessed) in groups.items():
+            own_records, own_unprocessed = self.groups.setdefault(name, ([], []))
+            own_records.extend(records)
+            own_unprocessed.extend(unprocessed)
+        self.baskets.update(baskets)
+        for name, columns in coordinates.items():
+            self.coordinates.setdefault(name, CoordinateColumns()).extend(columns)
+
+    def add_object(self, element):
+        tag = element.tag
+        try:
+            route = self.routes[tag]
+        except KeyError:
+            route = self.routes[tag] = self.route(tag)
+        if route is None:
+            return
+
+        name, entity, field_extractor, columns = route
+        records, unprocessed = self.groups.setdefault(name, ([], []))
+        try:
+            record = self.extractors[entity](element, field_extractor(element))
+            if record is not None:
+                records.append(record)
+                if columns is not None:
+                    lage = record.lage
+                    columns.append(lage.c1, lage.c2, lage.z if entity == 'Haltungspunkt' else record.kote)
+        except AttributeError as e:
+            unprocessed.append(element.get('TID'))
+            logging.error(f"Fehler bei der Verarbeitung von {entity} {element.get('TID')}: {e}")
+
+def parse_segment(job):
+    # Worker process: extract the objects of one DATASECTION segment and return the
+    # dispatcher state (groups, baskets, coordinate columns) for merging
+    backend_name, xtf_file_path, transfer_tag, (basket_tag, basket_name, start, end), config, entities = job
+    with open(xtf_file_path, 'rb') as f:
+        f.seek(start)
+        body = f.read(end - start)
+    document = b''.join((
+        b'<?xml version="1.0" encoding="UTF-8"?>', transfer_tag, b'<DATASECTION>', basket_tag,
+        body, b'</', basket_name, b'></DATASECTION></TRANSFER>'
+    ))
+
+    namespace = {'ili': INTERLIS_NAMESPACE}
+    parser = XTFParser(backend=backend_name)
+    dispatcher = ObjectDispatcher(parser, namespace, config, entities)
+    parser.read_streaming(get_backend(backend_name), io.BytesIO(document), namespace, dispatcher)
+    return dispatcher.groups, dispatcher.baskets, dispatcher.coordinates
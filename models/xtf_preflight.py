@@ -0,0 +1,100 @@
+import re
+from collections import Counter
+
+# Byte-level pre-flight scan of XTF files.
+#
+# The header sniffing reads only the start of the file: the HEADERSECTION with
+# its MODELS and the first baskets of the DATASECTION. The optional tag count
+# scans the raw bytes in chunks with regular expressions and never builds XML
+# elements, so it costs a fraction of a full parse and can be used to estimate
+# element counts, runtime and memory before a file is parsed. split_baskets
+# uses the same scan to cut the DATASECTION into segments for parallel parsing.
+
+# Bytes read for the header sniffing (header plus the first KB of the DATASECTION)
+HEADER_BYTES = 16 * 1024
+
+# Chunk size of the tag count
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+TRANSFER_PATTERN = re.compile(rb'<TRANSFER[\s>][^>]*>|<TRANSFER>')
+MODEL_PATTERN = re.compile(rb'<MODEL\s[^>]*?NAME="([^"]+)"')
+DATASECTION_PATTERN = re.compile(rb'<DATASECTION[\s>]')
+BASKET_PATTERN = re.compile(rb'<([A-Za-z_][\w.]*)\s[^>]*?BID=')
+# Opening tags of objects: Model.Topic.Class with a TID; structure elements of the same
+# naming scheme have no TID and are not counted
+OBJECT_PATTERN = re.compile(rb'<[A-Za-z_]\w*\.\w+\.(\w+)\s[^>]*?\bTID=')
+# Opening tags carrying a TID, i.e. the objects of a basket
+OBJECT_START_PATTERN = re.compile(rb'<[A-Za-z_][\w.]*\s[^>]*?\bTID=')
+COORD_TAG = b'<COORD'
+
+def read_head(f, size=HEADER_BYTES):
+    return f.read(size)
+
+def sniff_header(head):
+    # Model names from HEADERSECTION/MODELS and basket names found in the head of the DATASECTION
+    models = [name.decode('utf-8', 'replace') for name in MODEL_PATTERN.findall(head)]
+    baskets = []
+    datasection = DATASECTION_PATTERN.search(head)
+    if datasection is not None:
+        baskets = [name.decode('utf-8', 'replace') for name in BASKET_PATTERN.findall(head, datasection.end())]
+    return models, baskets
+
+def count_tags(f, head=b''):
+    # Count object opening tags per class name and COORD elements from the current position to the end.
+    # Every chunk is cut before its last '<' so no tag is split between two chunks.
+    counts = Counter()
+    coords = 0
+    size = len(head)
+    rest = head
+    while True:
+        chunk = f.read(SCAN_CHUNK_SIZE)
+        size += len(chunk)
+        buffer = rest + chunk
+        if chunk:
+            cut = buffer.rfind(b'<')
+            if cut <= 0:
+                rest = buffer
+                continue
+            buffer, rest = buffer[:cut], buffer[cut:]
+        counts.update(OBJECT_PATTERN.findall(buffer))
+        coords += buffer.count(COORD_TAG)
+        if not chunk:
+            break
+    return {name.decode('utf-8', 'replace'): count for name, count in counts.items()}, coords, size
+
+def split_baskets(buffer, segment_bytes):
+    # Cut the DATASECTION of an XTF document (bytes or mmap) into segments of whole objects.
+    # Returns the TRANSFER start tag and a list of (basket start tag, basket name, start, end)
+    # byte ranges in file order. Baskets larger than segment_bytes are split before an object.
+    transfer = TRANSFER_PATTERN.search(buffer)
+    datasection = DATASECTION_PATTERN.search(buffer, transfer.end()) if transfer is not None else None
+    if datasection is None:
+        return None, []
+
+    segments = []
+    position = datasection.end()
+    while True:
+        basket = BASKET_PATTERN.search(buffer, position)
+        if basket is None:
+            break
+        name = basket.group(1)
+        open_end = buffer.find(b'>', basket.end()) + 1
+        if buffer[open_end - 2:open_end] == b'/>':
+            # Empty basket
+            position = open_end
+            continue
+        close = buffer.find(b'</' + name + b'>', open_end)
+        if close < 0:
+            raise ValueError(f"Korb {name.decode('utf-8', 'replace')} ist nicht abgeschlossen")
+
+        start_tag = buffer[basket.start():open_end]
+        start = open_end
+        while close - start > segment_bytes:
+            obj = OBJECT_START_PATTERN.search(buffer, start + segment_bytes, close)
+            if obj is None:
+                break
+            segments.append((start_tag, name, start, obj.start()))
+            start = obj.start()
+        segments.append((start_tag, name, start, close))
+        position = close
+    return buffer[transfer.start():transfer.end()], segments
@@ -0,0 +1,114 @@
+# Declarative field schemas for the XTF object classes read by XTFParser.
+#
+# Every schema maps the name of a direct child element to (field, kind):
+#   'text'      text of the element
+#   'ref'       REF attribute of a reference element
+#   'coord'     COORD element of a point attribute (e.g. Lage)
+#   'polyline'  POLYLINE element of a line attribute (e.g. Verlauf)
+# The schemas are compiled once per namespace into FieldExtractors that
+# read all fields of an object in a single pass over its children.
+
+ABWASSERKNOTEN_FIELDS = {
+    'Lage': ('lage', 'coord'),
+    'Sohlenkote': ('sohlenkote', 'text'),
+    'AbwasserbauwerkRef': ('abwasserbauwerk_ref', 'ref'),
+    'Bezeichnung': ('bezeichnung', 'text'),
+    'Letzte_Aenderung': ('letzte_aenderung', 'text')
+}
+
+HALTUNGSPUNKT_FIELDS = {
+    'Lage': ('lage', 'coord'),
+    'Kote': ('kote', 'text')
+}
+
+NORMSCHACHT_FIELDS = {
+    'AbwasserbauwerkRef': ('abwasserbauwerk_ref', 'ref'),
+    'Lage': ('lage', 'coord'),
+    'Dimension1': ('dimension1', 'text'),
+    'Dimension2': ('dimension2', 'text'),
+    'Bezeichnung': ('bezeichnung', 'text'),
+    'Standortname': ('standortname', 'text'),
+    'Funktion': ('funktion', 'text'),
+    'Material': ('material', 'text')
+}
+
+HALTUNG_FIELDS = {
+    'Bezeichnung': ('bezeichnung', 'text'),
+    'Lichte_Hoehe': ('lichte_hoehe', 'text'),
+    'LaengeEffektiv': ('laenge_effektiv', 'text'),
+    'Material': ('material', 'text'),
+    'Verlauf': ('verlauf', 'polyline'),
+    'vonHaltungspunktRef': ('von_ref', 'ref'),
+    'nachHaltungspunktRef': ('nach_ref', 'ref')
+}
+
+KANAL_FIELDS = {
+    'Letzte_Aenderung': ('letzte_aenderung', 'text'),
+    'Standortname': ('standortname', 'text'),
+    'Zugaenglichkeit': ('zugaenglichkeit', 'text'),
+    'Bezeichnung': ('bezeichnung', 'text'),
+    'Nutzungsart_Ist': ('nutzungsart_ist', 'text')
+}
+
+# Fields per object class; the supported models share the VSA-DSS / SIA 405 classes
+ENTITY_FIELDS = {
+    'Abwasserknoten': ABWASSERKNOTEN_FIELDS,
+    'Haltungspunkt': HALTUNGSPUNKT_FIELDS,
+    'Normschacht': NORMSCHACHT_FIELDS,
+    'Haltung': HALTUNG_FIELDS,
+    'Kanal': KANAL_FIELDS
+}
+
+# Model name -> schema; models without an entry of their own use GENERIC
+FIELD_SCHEMAS = {
+    'DSS_2020_LV95': ENTITY_FIELDS,
+    'SIA405_ABWASSER_2015_LV95': ENTITY_FIELDS,
+    'DSS_2015_LV95': ENTITY_FIELDS,
+    'GENERIC': ENTITY_FIELDS
+}
+
+class FieldExtractor:
+    # Reads the fields of one object class from the direct children of an object.
+    # Like find(), the first child carrying a field wins.
+    def __init__(self, fields, namespace):
+        prefix = '{' + namespace['ili'] + '}'
+        self.table = {prefix + tag: spec for tag, spec in fields.items()}
+        self.coord_tag = prefix + 'COORD'
+        self.polyline_tag = prefix + 'POLYLINE'
+
+    def __call__(self, element):
+        values = {}
+        table = self.table
+        for child in element:
+            spec = table.get(child.tag)
+            if spec is None:
+                continue
+            field, kind = spec
+            if field in values:
+                continue
+            if kind == 'text':
+                values[field] = child.text
+            elif kind == 'ref':
+                values[field] = child.get('REF')
+            else:
+                target = child.find(self.coord_tag if kind == 'coord' else self.polyline_tag)
+                if target is not None:
+                    values[field] = target
+        return values
+
+def schema_model(name):
+    # Model whose schema applies to an element name such as 'DSS_2020_LV95.Siedlungsentwaesserung.Haltung'
+    model = name.split('.', 1)[0]
+    return model if model in FIELD_SCHEMAS else 'GENERIC'
+
+def compile_extractors(namespace):
+    # Compile all schemas into extractors: (model, entity) -> FieldExtractor.
+    # Models sharing a schema share its extractors.
+    compiled = {}
+    extractors = {}
+    for model, entities in FIELD_SCHEMAS.items():
+        if id(entities) not in compiled:
+            compiled[id(entities)] = {entity: FieldExtractor(fields, namespace) for entity, fields in entities.items()}
+        for entity, extractor in compiled[id(entities)].items():
+            extractors[(model, entity)] = extractor
+    return extractors
@@ -0,0 +1,77 @@
+import os
+import bz2
+import gzip
+import zipfile
+
+# Opening of plain and compressed XTF files.
+#
+# XTF deliveries often come as .xtf.gz, .xtf.bz2 or .zip. open_xtf returns a
+# binary stream that decompresses on the fly, so the parser reads the XML
+# without an inflated copy on disk. The container is recognised by its magic
+# bytes, independent of the file name. Sources are paths or seekable binary
+# file objects (upload streams, memory-mapped files); file objects are not
+# closed when the decompressing stream is closed.
+
+# File name suffixes accepted for XTF files
+XTF_SUFFIXES = ('.xtf', '.xtf.gz', '.xtf.bz2', '.zip')
+
+GZIP_MAGIC = b'\x1f\x8b'
+BZIP2_MAGIC = b'BZh'
+ZIP_MAGIC = b'PK\x03\x04'
+
+def is_xtf_filename(filename):
+    return filename.lower().endswith(XTF_SUFFIXES)
+
+def xtf_stem(filename):
+    # File name without the XTF and compression suffixes, e.g. 'netz' for 'netz.xtf.gz'
+    lower = filename.lower()
+    for suffix in sorted(XTF_SUFFIXES, key=len, reverse=True):
+        if lower.endswith(suffix):
+            return filename[:-len(suffix)]
+    return os.path.splitext(filename)[0]
+
+def read_magic(source):
+    # First bytes of a path or file object; a file object is rewound to its position
+    if hasattr(source, 'read'):
+        position = source.tell()
+        magic = source.read(4)
+        source.seek(position)
+        return magic
+    with open(source, 'rb') as f:
+        return f.read(4)
+
+def compression(source):
+    # 'gzip', 'bz2', 'zip' or None for a plain file
+    magic = read_magic(source)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(BZIP2_MAGIC):
+        return 'bz2'
+    if magic.startswith(ZIP_MAGIC):
+        return 'zip'
+    return None
+
+def zip_member(archive):
+    # The XTF file of a ZIP archive: the first *.xtf member, or the only member
+    names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    for name in names:
+        if name.lower().endswith('.xtf'):
+            return name
+    if len(names) == 1:
+        return names[0]
+    raise ValueError("Keine XTF-Datei im ZIP-Archiv gefunden")
+
+def open_xtf(source):
+    # Binary stream of the XML content of a plain or compressed XTF file (path or file object)
+    kind = compression(source)
+    if kind == 'gzip':
+        return gzip.GzipFile(fileobj=source, mode='rb') if hasattr(source, 'read') else gzip.open(source, 'rb')
+    if kind == 'bz2':
+        return bz2.BZ2File(source, 'rb')
+    if kind == 'zip':
+        # The member stream keeps the archive file open until it is closed itself
+        with zipfile.ZipFile(source) as archive:
+            return archive.open(zip_member(archive))
+    if hasattr(source, 'read'):
+        return source
+    return open(source, 'rb')
@@ -1,9 +1,18 @@
 # -*- coding: utf-8 -*-
 import pytest
 import json
+import gzip
+import io
 import os
 import logging
+import tempfile
+from werkzeug.datastructures import FileStorage
+import app as app_module
 from app import app
+from utils.parse_cache import ParseCache
+from utils.common import read_config
+from models.xtf_model import XTFParser
+from controllers.conversion_controller import upload_source, spool_path
 
 # Set up logging
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -58,3 +67,117 @@ def test_convert_success(client):
         file_path = os.path.join('/tmp/ifc_converter_temp', filename)
         assert os.path.exists(file_path)
         logger.info(f'File {file_path} exists')
+
+def test_preflight(client):
+    with open('tests/testfile_light.xtf', 'rb') as test_file:
+        response = client.post('/preflight', data={'xtfFile': (test_file, 'testfile_light.xtf')})
+
+    assert response.status_code == 200
+    estimate = json.loads(response.data)['files']['testfile_light.xtf']
+    assert estimate['model'] == 'DSS_2020_LV95'
+    assert estimate['counts']['Haltung'] == 3
+    assert estimate['accepted']
+
+def test_convert_gzip_file(client):
+    with open('tests/testfile_light.xtf', 'rb') as test_file:
+        content = gzip.compress(test_file.read())
+    response = client.post('/convert', data={'xtfFiles': (io.BytesIO(content), 'testfile_light.xtf.gz')})
+
+    assert response.status_code == 200
+    response_data = json.loads(response.data)
+    assert [link['filename'] for link in response_data['downloadLinks']] == ['testfile_light.ifc']
+
+def test_extract_and_datatable_from_upload_stream(client):
+    # Large enough to be spooled to a temporary file and parsed through an mmap
+    with open('tests/testfile_complete.xtf', 'rb') as test_file:
+        content = test_file.read() + b'<!--' + b' ' * 600000 + b'-->'
+    response = client.post('/extract', data={'xtfFile': (io.BytesIO(content), 'gross.xtf')})
+
+    assert response.status_code == 200
+    models = json.loads(response.data)['models']
+    assert len(models['DSS_2020_LV95']['haltungen']) > 0
+
+    response = client.get('/get_datatable_data', query_string={'filename': 'gross.xtf'})
+    assert response.status_code == 200
+    assert json.loads(response.data)['haltungen'] == models['DSS_2020_LV95']['haltungen']
+
+def test_extract_keeps_small_upload_in_memory(client):
+    # A small upload stays in the SpooledTemporaryFile's memory and, once cached, is not spooled
+    stream = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    with open('tests/testfile_light.xtf', 'rb') as test_file:
+        stream.write(test_file.read())
+    stream.seek(0)
+    upload = FileStorage(stream=stream, filename='klein.xtf')
+    assert upload_source(upload) is stream
+    assert not stream._rolled
+
+    if os.path.exists(spool_path('klein.xtf')):
+        os.remove(spool_path('klein.xtf'))
+    with open('tests/testfile_light.xtf', 'rb') as test_file:
+        response = client.post('/extract', data={'xtfFile': (test_file, 'klein.xtf')})
+    assert response.status_code == 200
+    assert not os.path.exists(spool_path('klein.xtf'))
+
+def test_datatable_of_result_too_large_for_cache(client, monkeypatch):
+    # The parse result is not kept in the cache; the spooled copy of the upload is parsed again
+    monkeypatch.setattr(app_module, 'parse_cache', ParseCache(max_bytes=1000))
+    with open('tests/testfile_complete.xtf', 'rb') as test_file:
+        response = client.post('/extract', data={'xtfFile': (test_file, 'uebergross.xtf')})
+    assert response.status_code == 200
+    models = json.loads(response.data)['models']
+    assert not app_module.parse_cache.entries
+
+    response = client.get('/get_datatable_data', query_string={'filename': 'uebergross.xtf'})
+    assert response.status_code == 200
+    assert json.loads(response.data)['haltungen'] == models['DSS_2020_LV95']['haltungen']
+
+    response = client.get('/get_datatable_data', query_string={'filename': 'unbekannt.xtf'})
+    assert response.status_code == 404
+
+def test_extract_selected_entities(client):
+    with open('tests/testfile_light.xtf', 'rb') as test_file:
+        response = client.post('/extract', data={'xtfFile': (test_file, 'auswahl.xtf'), 'include': 'Kanal'})
+
+    assert response.status_code == 200
+    data = json.loads(response.data)['models']['DSS_2020_LV95']
+    assert data['entities'] == ['Kanal']
+    assert data['haltungen'] == []
+
+    response = client.get('/get_datatable_data', query_string={'filename': 'auswahl.xtf'})
+    assert json.loads(response.data)['entities'] == ['Kanal']
+
+    with open('tests/testfile_light.xtf', 'rb') as test_file:
+        response = client.post('/convert', data={'xtfFiles': (test_file, 'auswahl.xtf'), 'exclude': 'Schacht'})
+    assert response.status_code == 400
+
+    # Kanal and Abwasserknoten alone produce no IFC elements and no project origin
+    for include in ('Kanal', 'Abwasserknoten'):
+        with open('tests/testfile_light.xtf', 'rb') as test_file:
+            response = client.post('/convert', data={'xtfFiles': (test_file, 'auswahl.xtf'), 'include': include})
+        assert response.status_code == 400
+        assert 'IFC-Geometrie' in json.loads(response.data)['error']
+
+def test_convert_rejects_invalid_tile_size(client):
+    for tile_size in ('-50', 'nan', 'inf', 'gross'):
+        with open('tests/testfile_light.xtf', 'rb') as test_file:
+            response = client.post('/convert', data={'xtfFiles': (test_file, 'kacheln.xtf'), 'tile_size': tile_size})
+        assert response.status_code == 400
+        assert 'Kachelgrösse' in json.loads(response.data)['error']
+
+def test_preflight_scan_only_with_object_limit(client, monkeypatch):
+    def scan(self, source, count=True):
+        raise AssertionError("Vorabprüfung ohne Objektlimit")
+    monkeypatch.setattr(XTFParser, 'preflight', scan)
+    config = read_config()
+    config['max_objects'] = 0
+    monkeypatch.setattr(app_module, 'read_config', lambda: dict(config))
+    with open('tests/testfile_light.xtf', 'rb') as test_file:
+        response = client.post('/extract', data={'xtfFile': (test_file, 'ohne_limit.xtf')})
+    assert response.status_code == 200
+
+    monkeypatch.undo()
+    config['max_objects'] = 1
+    monkeypatch.setattr(app_module, 'read_config', lambda: dict(config))
+    with open('tests/testfile_light.xtf', 'rb') as test_file:
+        response = client.post('/extract', data={'xtfFile': (test_file, 'mit_limit.xtf')})
+    assert response.status_code == 413
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import pytest
+import logging
+from collections import Counter
+import ifcopenshell
+from models.xtf_model import XTFParser
+from models.ifc_model import create_ifc
+from models.ifc_delta import update_ifc
+from utils.common import read_config
+
+# Set up logging
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+XTF_FILE = 'tests/testfile_complete.xtf'
+
+@pytest.fixture
+def config():
+    return read_config()
+
+def parse(config):
+    parser = XTFParser()
+    return parser.parse(XTF_FILE, config), parser.index
+
+def entity_counts(path):
+    return Counter(entity.is_a() for entity in ifcopenshell.open(path))
+
+def test_update_rebuilds_only_changed_objects(config, tmp_path):
+    ifc_path = str(tmp_path / 'netz.ifc')
+    data, index = parse(config)
+    assert update_ifc(ifc_path, data, index)['mode'] == 'full'
+
+    data, index = parse(config)
+    data['haltungen'][0].durchmesser = 0.5
+    removed = data['haltungen'].pop(3)
+    data['normschachte'][2].dimension1 = 1300.0
+    summary = update_ifc(ifc_path, data, index)
+    assert summary['mode'] == 'delta'
+    assert summary['haltungen'] == {'removed': 1, 'added': 0, 'changed': 1}
+    assert summary['normschachte'] == {'removed': 0, 'added': 0, 'changed': 1}
+
+    # The updated file holds the same entities as a full conversion of the new data
+    full_path = str(tmp_path / 'voll.ifc')
+    create_ifc(full_path, data, index)
+    assert entity_counts(ifc_path) == entity_counts(full_path)
+    # Rebuilt elements, property sets and relationships get the GlobalIds of a full conversion
+    global_ids = lambda path: {entity.GlobalId for entity in ifcopenshell.open(path).by_type('IfcRoot')}
+    assert global_ids(ifc_path) == global_ids(full_path)
+    tags = {element.Tag for element in ifcopenshell.open(ifc_path).by_type('IfcPipeSegment')}
+    assert removed['id'] not in tags
+    assert len(tags) == len(data['haltungen'])
+
+def test_update_converts_fully_when_settings_change(config, tmp_path):
+    ifc_path = str(tmp_path / 'netz.ifc')
+    data, index = parse(config)
+    update_ifc(ifc_path, data, index)
+
+    config['default_rohrdicke'] = 0.05
+    data, index = parse(config)
+    assert update_ifc(ifc_path, data, index)['mode'] == 'full'
+
+    # Random and stable GlobalIds are not mixed in one file
+    config['stable_guids'] = not config['stable_guids']
+    data, index = parse(config)
+    assert update_ifc(ifc_path, data, index)['mode'] == 'full'
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import uuid
+import pytest
+import numpy as np
+import ifcopenshell
+import ifcopenshell.util.element
+import ifcopenshell.guid
+from models.xtf_model import XTFParser
+from models.ifc_model import create_ifc, local_polylines
+from utils.common import read_config, GeometryPool, GuidProvider, GUID_NAMESPACE, compress_guid
+
+def test_local_polylines_interpolate_by_chainage():
+    verlaeufe = [
+        # L-shaped course: 3 m east, then 1 m north
+        np.array([[10.0, 20.0], [13.0, 20.0], [13.0, 21.0]]),
+        np.empty((0, 2)),
+        # Measured kote in the third column wins over the interpolation
+        np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 105.0], [2.0, 0.0, 0.0]])
+    ]
+    starts = np.array([[10.0, 20.0, 100.0], [0.0, 0.0, 0.0], [0.0, 0.0, 100.0]])
+    end_z = np.array([96.0, 0.0, 102.0])
+
+    first, empty, measured = local_polylines(verlaeufe, starts, end_z)
+    np.testing.assert_allclose(first, [[0, 0, 0], [3, 0, -3], [3, 1, -4]])
+    assert empty.shape == (0, 3)
+    np.testing.assert_allclose(measured, [[0, 0, 0], [1, 0, 5], [2, 0, 2]])
+
+def convert(tmp_path, einfaerben=False):
+    config = read_config()
+    config['einfaerben'] = einfaerben
+    parser = XTFParser()
+    data = parser.parse('tests/testfile_complete.xtf', config)
+    ifc_path = str(tmp_path / 'netz.ifc')
+    create_ifc(ifc_path, data, parser.index)
+    return data, ifcopenshell.open(ifc_path)
+
+def test_surface_styles_are_shared(tmp_path):
+    _, ifc_file = convert(tmp_path, einfaerben=True)
+    styles = ifc_file.by_type('IfcSurfaceStyle')
+    assert len(styles) == len({style.Name for style in styles}) <= 4
+    # One styled item per pipe and per shared shaft geometry
+    styled = ifc_file.by_type('IfcPipeSegment') + ifc_file.by_type('IfcRepresentationMap')
+    assert len(ifc_file.by_type('IfcStyledItem')) == len(styled)
+
+def test_relationships_are_aggregated(tmp_path):
+    data, ifc_file = convert(tmp_path)
+    site = ifc_file.by_type('IfcSite')[0]
+    containment, = ifc_file.by_type('IfcRelContainedInSpatialStructure')
+    assert containment.RelatingStructure == site
+    assert len(containment.RelatedElements) == len(data['haltungen']) + len(data['normschachte'])
+
+    groups = {rel.RelatingGroup.Name: rel for rel in ifc_file.by_type('IfcRelAssignsToGroup')}
+    assert len(groups) == len(ifc_file.by_type('IfcRelAssignsToGroup')) == 2
+    assert len(groups['Haltungen'].RelatedObjects) == len(data['haltungen'])
+
+def test_shaft_geometry_is_instanced(tmp_path):
+    data, ifc_file = convert(tmp_path)
+    maps = ifc_file.by_type('IfcRepresentationMap')
+    shafts = ifc_file.by_type('IfcDistributionChamberElement')
+    assert len(shafts) == len(data['normschachte'])
+    assert 0 < len(maps) < len(shafts)
+    for shaft in shafts:
+        item, = shaft.Representation.Representations[0].Items
+        assert item.is_a('IfcMappedItem') and item.MappingSource in maps
+
+def test_geometry_pool_interns_primitives():
+    ifc_file = ifcopenshell.file(schema='IFC4X3')
+    pool = GeometryPool(ifc_file)
+    point = pool.point((1.0, 2.0, 3.0))
+    assert pool.point((1.0, 2.0, 3.0 + 1e-8)) is point
+    assert pool.point((1.0, 2.0, 3.1)) is not point
+    assert pool.placement((1.0, 2.0, 3.0), (0.0, 0.0, 1.0)) == pool.placement((1.0, 2.0, 3.0), (0, 0, 1))
+    assert pool.circle_profile(0.5) == pool.circle_profile(0.5)
+    assert len(ifc_file.by_type('IfcDirection')) == 1
+
+    # A pool of a file with existing primitives reuses them
+    other = GeometryPool(ifc_file)
+    assert other.point((1.0, 2.0, 3.0)) == point
+    assert other.circle_profile(0.5) == pool.circle_profile(0.5)
+
+def test_element_types_hold_recurring_properties(tmp_path):
+    data, ifc_file = convert(tmp_path)
+    pipe_types = ifc_file.by_type('IfcPipeSegmentType')
+    assert 0 < len(pipe_types) < len(data['haltungen'])
+
+    # Occurrences inherit the type properties into their property set of the same name
+    haltung = data['haltungen'][0]
+    segment = next(segment for segment in ifc_file.by_type('IfcPipeSegment') if segment.Tag == haltung['id'])
+    properties = ifcopenshell.util.element.get_psets(segment)['TBAKTZH STRE Haltung']
+    assert properties['Bezeichnung'] == haltung['bezeichnung']
+    assert properties['Lichte Höhe'] == str(haltung['durchmesser'])
+
+    values = [(prop.Name, prop.NominalValue.wrappedValue) for prop in ifc_file.by_type('IfcPropertySingleValue')]
+    assert len(values) == len(set(values))
+
+def canonical(entity, memo):
+    # Attribute values of the entity and everything it references, without ids and GlobalIds
+    if entity.id() not in memo:
+        info = entity.get_info(recursive=False, include_identifier=False)
+        info.pop('GlobalId', None)
+
+        def value(attribute):
+            if isinstance(attribute, ifcopenshell.entity_instance):
+                return canonical(attribute, memo) if attribute.id() else (attribute.is_a(), attribute.wrappedValue)
+            if isinstance(attribute, tuple):
+                return tuple(value(element) for element in attribute)
+            return attribute
+
+        memo[entity.id()] = (info.pop('type'),) + tuple(sorted((key, value(attribute)) for key, attribute in info.items()))
+    return memo[entity.id()]
+
+def test_streaming_writer_matches_model(tmp_path):
+    config = read_config()
+    config['einfaerben'] = True
+    parser = XTFParser()
+    data = parser.parse('tests/testfile_complete.xtf', config)
+    model_path, stream_path = str(tmp_path / 'model.ifc'), str(tmp_path / 'stream.ifc')
+    create_ifc(model_path, dict(data, streaming_writer=False), parser.index)
+    create_ifc(stream_path, dict(data, streaming_writer=True), parser.index)
+
+    model, stream = ifcopenshell.open(model_path), ifcopenshell.open(stream_path)
+    assert stream.schema_identifier == model.schema_identifier
+    model_memo, stream_memo = {}, {}
+    assert sorted(map(repr, (canonical(entity, model_memo) for entity in model))) == \
+        sorted(map(repr, (canonical(entity, stream_memo) for entity in stream)))
+
+    # Same builder calls in the same order: the DATA sections must match line by line
+    def data_lines(path):
+        with open(path) as file:
+            lines = file.read().splitlines()
+        return lines[lines.index('DATA;'):]
+
+    assert data_lines(stream_path) == data_lines(model_path)
+
+def test_stable_guids_match_ifcopenshell():
+    uuids = [uuid.uuid4() for _ in range(50)] + [uuid.UUID(int=0), uuid.UUID(int=2 ** 128 - 1)]
+    assert [compress_guid(value.int) for value in uuids] == [ifcopenshell.guid.compress(value.hex) for value in uuids]
+
+    guids = GuidProvider(ifcopenshell.file(schema="IFC4X3"), 'DSS_2020_LV95')
+    namespace = uuid.uuid5(GUID_NAMESPACE, 'DSS_2020_LV95')
+    assert guids.guid('ch1000HA0054FFBA', 'element') == ifcopenshell.guid.compress(uuid.uuid5(namespace, 'ch1000HA0054FFBA/element').hex)
+
+def test_conversion_is_reproducible(tmp_path):
+    config = read_config()
+    paths = []
+    for name in ('erste.ifc', 'zweite.ifc'):
+        parser = XTFParser()
+        data = parser.parse('tests/testfile_complete.xtf', config)
+        paths.append(tmp_path / name)
+        create_ifc(str(paths[-1]), data, parser.index)
+    assert paths[0].read_bytes() == paths[1].read_bytes()
+
+    global_ids = [entity.GlobalId for entity in ifcopenshell.open(str(paths[0])).by_type('IfcRoot')]
+    assert len(global_ids) == len(set(global_ids))
+
+def test_lod_modes(tmp_path):
+    config = read_config()
+    parser = XTFParser()
+    data = parser.parse('tests/testfile_complete.xtf', config)
+    files = {}
+    for lod in ('lod0', 'lod1', 'full'):
+        ifc_path = str(tmp_path / f'{lod}.ifc')
+        create_ifc(ifc_path, dict(data, lod=lod), parser.index)
+        files[lod] = ifcopenshell.open(ifc_path)
+
+    # lod1: no booleans, shaft walls from hollow circle profiles, solid pipes
+    assert files['full'].by_type('IfcBooleanResult') and not files['lod1'].by_type('IfcBooleanResult')
+    assert len(files['lod1'].by_type('IfcCircleHollowProfileDef')) == len(files['full'].by_type('IfcBooleanResult'))
+    assert all(solid.InnerRadius is None for solid in files['lod1'].by_type('IfcSweptDiskSolid'))
+
+    # lod0: pipe axes and shaft points only
+    assert not files['lod0'].by_type('IfcSolidModel') and not files['lod0'].by_type('IfcStyledItem')
+    for segment in files['lod0'].by_type('IfcPipeSegment'):
+        representation, = segment.Representation.Representations
+        assert (representation.RepresentationIdentifier, representation.RepresentationType) == ('Axis', 'Curve3D')
+    for shaft in files['lod0'].by_type('IfcDistributionChamberElement'):
+        representation, = shaft.Representation.Representations
+        assert representation.RepresentationType == 'Point'
+
+    # Elements and their property sets do not depend on the level of detail
+    for lod in ('lod0', 'lod1'):
+        assert len(files[lod].by_type('IfcPropertySet')) == len(files['full'].by_type('IfcPropertySet'))
+        assert len(files[lod].by_type('IfcElement')) == len(files['full'].by_type('IfcElement'))
+
+    with pytest.raises(ValueError):
+        create_ifc(str(tmp_path / 'lod2.ifc'), dict(data, lod='lod2'), parser.index)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import logging
+from collections import Counter
+import ifcopenshell
+from models.xtf_model import XTFParser
+from models import ifc_tiles
+from models.ifc_tiles import create_ifc_tiles, tile_index_name
+from utils.common import read_config
+
+# Set up logging
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+XTF_FILE = 'tests/testfile_complete.xtf'
+
+def parse():
+    parser = XTFParser()
+    return parser.parse(XTF_FILE, read_config()), parser.index
+
+def test_tiles_cover_network(tmp_path):
+    data, index = parse()
+    tile_index = create_ifc_tiles(str(tmp_path), 'netz', data, index, 50.0)
+
+    assert len(tile_index['tiles']) > 1
+    assert sum(tile['haltungen'] for tile in tile_index['tiles']) == len(data['haltungen'])
+    assert sum(tile['normschachte'] for tile in tile_index['tiles']) == len(data['normschachte'])
+    with open(tmp_path / tile_index_name('netz'), encoding='utf-8') as f:
+        assert json.load(f) == tile_index
+
+    haltungen = {haltung['id']: haltung for haltung in data['haltungen']}
+    tags = []
+    for tile in tile_index['tiles']:
+        ifc_file = ifcopenshell.open(str(tmp_path / tile['file']))
+        segments = ifc_file.by_type('IfcPipeSegment')
+        assert len(segments) == tile['haltungen']
+        tags.extend(segment.Tag for segment in segments)
+        # The extent covers the whole course of the tile's Haltungen, also outside the grid cell
+        extent = tile['extent']
+        for segment in segments:
+            for x, y in haltungen[segment.Tag]['verlauf']:
+                assert extent['min']['x'] <= x <= extent['max']['x']
+                assert extent['min']['y'] <= y <= extent['max']['y']
+        # Every tile is georeferenced with the origin of the whole network
+        assert ifc_file.by_type('IfcMapConversion')[0].Eastings == data['min_coordinates']['x']
+    assert sorted(tags) == sorted(haltung['id'] for haltung in data['haltungen'])
+
+def test_parallel_tiles_match_serial(tmp_path):
+    data, index = parse()
+    os.makedirs(tmp_path / 'serial')
+    os.makedirs(tmp_path / 'parallel')
+    serial = create_ifc_tiles(str(tmp_path / 'serial'), 'netz', data, index, 50.0)
+    parallel = create_ifc_tiles(str(tmp_path / 'parallel'), 'netz', data, index, 50.0, workers=2)
+    assert parallel == serial
+    for tile in serial['tiles']:
+        counts = [Counter(entity.is_a() for entity in ifcopenshell.open(str(tmp_path / kind / tile['file'])))
+                  for kind in ('serial', 'parallel')]
+        assert counts[0] == counts[1]
+
+def test_tile_global_ids_are_unique(tmp_path):
+    data, index = parse()
+    tile_index = create_ifc_tiles(str(tmp_path), 'netz', data, index, 50.0)
+
+    global_ids = Counter()
+    for tile in tile_index['tiles']:
+        ifc_file = ifcopenshell.open(str(tmp_path / tile['file']))
+        global_ids.update(entity.GlobalId for entity in ifc_file.by_type('IfcRoot'))
+        # Every tile has its own containment and group relationships
+        assert ifc_file.by_type('IfcRelContainedInSpatialStructure') and ifc_file.by_type('IfcRelAssignsToGroup')
+    assert max(global_ids.values()) == 1
+
+def test_tile_jobs_carry_only_tile_data(tmp_path, monkeypatch):
+    data, index = parse()
+    jobs = []
+    monkeypatch.setattr(ifc_tiles, 'write_tile', jobs.append)
+    create_ifc_tiles(str(tmp_path), 'netz', data, index, 50.0)
+
+    for _, subset, abwasserknoten, _ in jobs:
+        assert set(subset) <= set(ifc_tiles.TILE_DATA_KEYS) | {'haltungen', 'normschachte', 'tile'}
+        assert len(abwasserknoten) <= len(subset['normschachte'])
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+import pytest
+import logging
+import bz2
+import mmap
+import gzip
+import io
+import zipfile
+import models.xtf_model
+import models.xtf_preflight
+from models.xtf_model import XTFParser
+from models.tid_index import TIDIndex
+from models.xml_backend import available_backends
+from utils.common import read_config
+from utils.parse_cache import ParseCache, estimate_size
+
+# Set up logging
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+TEST_FILES = ['tests/testfile_complete.xtf', 'tests/testfile_light.xtf']
+
+@pytest.fixture
+def config():
+    return read_config()
+
+# Every parser test runs once per installed XML backend
+@pytest.fixture(params=available_backends())
+def parser(request):
+    return XTFParser(backend=request.param)
+
+@pytest.mark.parametrize('xtf_file', TEST_FILES)
+def test_parse_extracts_entities(parser, config, xtf_file):
+    data = parser.parse(xtf_file, config)
+    assert data['model'] == 'DSS_2020_LV95'
+    assert data['haltungen']
+    assert data['normschachte']
+    assert 'error' not in data['min_coordinates']
+
+@pytest.mark.parametrize('xtf_file', TEST_FILES)
+def test_streaming_matches_tree(parser, config, xtf_file):
+    tree_data = parser.parse(xtf_file, config)
+    streaming_data = parser.parse(xtf_file, config, streaming=True)
+    assert streaming_data == tree_data
+
+@pytest.mark.parametrize('xtf_file', TEST_FILES)
+def test_backends_return_identical_data(config, xtf_file):
+    reference = XTFParser(backend='etree').parse(xtf_file, config)
+    for backend in available_backends():
+        assert XTFParser(backend=backend).parse(xtf_file, config) == reference
+
+def test_tid_index_returns_first_match_by_tid_or_ref():
+    abwasserknoten = [
+        {'id': 'ak1', 'ref': 'ns2'},
+        {'id': 'ns2 ', 'ref': None},
+        {'id': 'ak3', 'ref': 'ns3'},
+    ]
+    index = TIDIndex(abwasserknoten, [{'id': 'hp1'}])
+    assert index.abwasserknoten_for('ns2') is abwasserknoten[0]
+    assert index.abwasserknoten_for('ns3') is abwasserknoten[2]
+    assert index.abwasserknoten_for('unbekannt') is None
+    assert index.abwasserknoten('ak3') is abwasserknoten[2]
+    assert index.haltungspunkt('hp1') == {'id': 'hp1'}
+
+SIA405_XTF = '''<?xml version="1.0" encoding="utf-8"?>
+<TRANSFER xmlns="http://www.interlis.ch/INTERLIS2.3">
+    <HEADERSECTION SENDER="Test" VERSION="2.3">
+        <MODELS>
+            <MODEL NAME="SIA405_ABWASSER_2015_LV95" VERSION="12.12.2016" URI="http://www.sia.ch/405"/>
+        </MODELS>
+    </HEADERSECTION>
+    <DATASECTION>
+        <SIA405_ABWASSER_2015_LV95.SIA405_Abwasser BID="b1">
+            <SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Normschacht TID="ns1">
+                <Bezeichnung>S1</Bezeichnung>
+                <Dimension1>1000</Dimension1>
+            </SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Normschacht>
+            <SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Abwasserknoten TID="ak1">
+                <AbwasserbauwerkRef REF="ns1"/>
+                <Lage><COORD><C1>2600012.5</C1><C2>1200007.5</C2></COORD></Lage>
+                <Sohlenkote>410.25</Sohlenkote>
+            </SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Abwasserknoten>
+            <SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Haltungspunkt TID="hp1">
+                <Lage><COORD><C1>2600012.5</C1><C2>1200007.5</C2></COORD></Lage>
+                <Kote>410.25</Kote>
+            </SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Haltungspunkt>
+            <SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Haltungspunkt TID="hp2">
+                <Lage><COORD><C1>2600032.5</C1><C2>1200017.5</C2></COORD></Lage>
+                <Kote>409.75</Kote>
+            </SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Haltungspunkt>
+            <SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Haltung TID="h1">
+                <Bezeichnung>H1</Bezeichnung>
+                <Lichte_Hoehe>300</Lichte_Hoehe>
+                <vonHaltungspunktRef REF="hp1"/>
+                <nachHaltungspunktRef REF="hp2"/>
+            </SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Haltung>
+            <SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Haltung TID="h2">
+                <vonHaltungspunktRef REF="hp1"/>
+                <nachHaltungspunktRef REF="hp9"/>
+            </SIA405_ABWASSER_2015_LV95.SIA405_Abwasser.Haltung>
+        </SIA405_ABWASSER_2015_LV95.SIA405_Abwasser>
+    </DATASECTION>
+</TRANSFER>
+'''
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_parse_sia405_basket(parser, config, tmp_path, streaming):
+    xtf_file = tmp_path / 'sia405.xtf'
+    xtf_file.write_text(SIA405_XTF, encoding='utf-8')
+
+    data = parser.parse(str(xtf_file), config, streaming=streaming)
+
+    assert data['model'] == 'SIA405_ABWASSER_2015_LV95'
+    assert [ns['abwasserknoten_id'] for ns in data['normschachte']] == ['ak1']
+    assert data['normschachte'][0]['dimension1'] == 1000.0
+    assert [h['id'] for h in data['haltungen']] == ['h1']
+    assert data['haltungen'][0]['durchmesser'] == 0.3
+    assert data['nicht_verarbeitete_haltungen'] == ['h2']
+    assert data['min_coordinates'] == {'x': 2600010, 'y': 1200000, 'z': 400}
+
+def test_field_extractor_reads_direct_children_once():
+    import xml.etree.ElementTree as ET
+    from models.xtf_schema import compile_extractors, schema_model
+    element = ET.fromstring(
+        '<Haltung xmlns="http://www.interlis.ch/INTERLIS2.3" TID="h1">'
+        '<Bezeichnung>erste</Bezeichnung><Bezeichnung>zweite</Bezeichnung>'
+        '<Verlauf><POLYLINE><COORD><C1>1</C1><C2>2</C2></COORD></POLYLINE></Verlauf>'
+        '<vonHaltungspunktRef REF="hp1"/>'
+        '</Haltung>'
+    )
+    extractors = compile_extractors({'ili': 'http://www.interlis.ch/INTERLIS2.3'})
+    fields = extractors[(schema_model('Haltung'), 'Haltung')](element)
+    assert fields['bezeichnung'] == 'erste'
+    assert fields['von_ref'] == 'hp1'
+    assert 'nach_ref' not in fields
+    assert fields['verlauf'].tag.endswith('POLYLINE')
+
+def test_records_offer_dict_view():
+    from models.records import Coord3D, Haltungspunkt
+    hp = Haltungspunkt(id='hp1', lage=Coord3D(1.0, 2.0, 3.0), model='GENERIC')
+    assert hp['lage']['z'] == 3.0
+    assert 'z' in hp['lage'] and 'kote' not in hp
+    assert hp.get('kote', 405.0) == 405.0
+    assert hp.to_dict() == {'id': 'hp1', 'lage': {'c1': 1.0, 'c2': 2.0, 'z': 3.0}, 'model': 'GENERIC'}
+    assert not hasattr(hp, '__dict__')
+
+def test_coordinate_set_reduces_columns():
+    from models.coordinates import CoordinateSet
+    coordinates = CoordinateSet()
+    knoten = coordinates.add('abwasserknoten')
+    knoten.append(2600012.5, 1200007.5, None)
+    knoten.append(2600032.5, 1200017.5, 409.75)
+    coordinates.add('normschachte')
+
+    assert coordinates.origin(10) == (2600010, 1200000, 400)
+    statistics = coordinates.statistics()
+    assert statistics['normschachte'] == {'count': 0}
+    assert statistics['abwasserknoten']['min'] == {'x': 2600012.5, 'y': 1200007.5, 'z': 409.75}
+    assert statistics['abwasserknoten']['mean']['x'] == 2600022.5
+
+def test_parse_cache_reuses_result_for_same_content(config, tmp_path, monkeypatch):
+    cache = ParseCache()
+    copy = tmp_path / 'copy.xtf'
+    copy.write_bytes(open(TEST_FILES[1], 'rb').read())
+    data, index = cache.parse(TEST_FILES[1], config)
+
+    # Same content under another name must not parse again
+    monkeypatch.setattr(XTFParser, 'parse', lambda *args, **kwargs: pytest.fail('Datei wurde erneut geparst'))
+    cached_data, cached_index = cache.parse(str(copy), config)
+    assert cached_index is index
+    assert cached_data['haltungen'] is data['haltungen']
+
+def test_parse_cache_evicts_least_recently_used(config):
+    cache = ParseCache()
+    data, _ = cache.parse(TEST_FILES[1], config)
+    size = estimate_size(data)
+
+    cache.max_bytes = size
+    other = dict(config, default_sohlenkote=config['default_sohlenkote'] + 1)
+    cache.parse(TEST_FILES[1], other)
+    assert len(cache.entries) == 1
+    assert cache.size <= cache.max_bytes
+
+@pytest.mark.parametrize('xtf_file', TEST_FILES)
+def test_preflight_counts_match_parse(config, xtf_file):
+    parser = XTFParser()
+    estimate = parser.preflight(xtf_file)
+    data = parser.parse(xtf_file, config)
+    assert estimate['model'] == data['model']
+    assert estimate['counts']['Haltung'] == len(data['haltungen']) + len(data['nicht_verarbeitete_haltungen'])
+    assert estimate['counts']['Kanal'] == len(data['kanale']) + len(data['nicht_verarbeitete_kanale'])
+
+def test_preflight_counts_only_objects(monkeypatch):
+    # Structure elements (no TID) are not counted, also when tags are spread over many small chunks
+    content = (b'<DATASECTION><DSS_2020_LV95.Siedlungsentwaesserung BID="b1">'
+               b'<DSS_2020_LV95.Siedlungsentwaesserung.Haltung TID="h1">'
+               b'<Metaattribute><DSS_2020_LV95.Base.Metaattribute><Datenherr>A</Datenherr></DSS_2020_LV95.Base.Metaattribute></Metaattribute>'
+               b'<Verlauf><POLYLINE><COORD><C1>1</C1></COORD><COORD><C1>2</C1></COORD></POLYLINE></Verlauf>'
+               b'</DSS_2020_LV95.Siedlungsentwaesserung.Haltung>'
+               b'<DSS_2020_LV95.Siedlungsentwaesserung.Kanal\n  TID="k1" />'
+               b'</DSS_2020_LV95.Siedlungsentwaesserung></DATASECTION>')
+    for chunk_size in (len(content), 7):
+        monkeypatch.setattr(models.xtf_preflight, 'SCAN_CHUNK_SIZE', chunk_size)
+        counts, coords, size = models.xtf_preflight.count_tags(io.BytesIO(content))
+        assert counts == {'Haltung': 1, 'Kanal': 1}
+        assert coords == 2
+        assert size == len(content)
+
+def test_preflight_reads_header_of_file_object():
+    with open(TEST_FILES[1], 'rb') as f:
+        f.seek(0)
+        estimate = XTFParser().preflight(f, count=False)
+        assert f.tell() == 0
+    assert estimate['model'] == 'DSS_2020_LV95'
+    assert estimate['models'] == ['DSS_2020_LV95']
+    assert estimate['objects'] is None
+    assert estimate['size'] > 0
+
+@pytest.mark.parametrize('xtf_file', TEST_FILES)
+def test_parallel_matches_streaming(parser, config, xtf_file, monkeypatch):
+    # Small segments so even the test files are split into several worker jobs
+    monkeypatch.setattr(models.xtf_model, 'PARALLEL_SEGMENT_BYTES', 4096)
+    streaming_data = parser.parse(xtf_file, config, streaming=True)
+    parallel_data = parser.parse(xtf_file, config, workers=2)
+    assert parallel_data == streaming_data
+
+def compress(path, target, kind):
+    content = open(path, 'rb').read()
+    if kind == 'gzip':
+        target.write_bytes(gzip.compress(content))
+    elif kind == 'bz2':
+        target.write_bytes(bz2.compress(content))
+    else:
+        with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('readme.txt', 'Lieferung')
+            archive.writestr('netz.xtf', content)
+    return str(target)
+
+@pytest.mark.parametrize('kind, suffix', [('gzip', '.xtf.gz'), ('bz2', '.xtf.bz2'), ('zip', '.zip')])
+def test_parse_compressed_file(parser, config, tmp_path, kind, suffix):
+    compressed = compress(TEST_FILES[1], tmp_path / ('netz' + suffix), kind)
+    plain_data = parser.parse(TEST_FILES[1], config, streaming=True)
+    assert parser.parse(compressed, config, streaming=True) == plain_data
+    assert parser.parse(compressed, config) == plain_data
+    assert parser.preflight(compressed)['counts'] == parser.preflight(TEST_FILES[1])['counts']
+
+def test_parse_file_objects(parser, config):
+    reference = parser.parse(TEST_FILES[1], config)
+    with open(TEST_FILES[1], 'rb') as f:
+        assert parser.parse(f, config, streaming=True) == reference
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            assert parser.parse(buffer, config) == reference
+
+def test_tid_index_substring_lookup_matches_scan():
+    ids = ['ns1_a', 'xns1_b', 'ns1ns1', 'ns2', 'NS1', 'n', None]
+    haltungspunkte = [{'id': tid} for tid in ids]
+    index = TIDIndex(haltungspunkte=haltungspunkte)
+    for text in ['ns1', 'ns', 'n', 'ns1ns1', 'ns3', 'toolongtid', '']:
+        expected = [hp for hp in haltungspunkte if hp['id'] is not None and text in hp['id']]
+        assert index.haltungspunkte_containing(text) == expected
+
+def test_parse_selected_entities(parser, config):
+    full = parser.parse(TEST_FILES[0], config, streaming=True)
+    data = parser.parse(TEST_FILES[0], config, streaming=True, include='Haltung')
+    assert data['entities'] == ['Haltung']
+    # Haltungspunkte are read to resolve the Haltungen, but not returned
+    assert data['haltungen'] == full['haltungen']
+    assert data['haltungspunkte'] == [] and data['normschachte'] == [] and data['kanale'] == []
+
+    data = parser.parse(TEST_FILES[0], config, exclude=['kanale', 'Abwasserknoten'])
+    assert data['normschachte'] == full['normschachte']
+    assert data['haltungspunkte'] == full['haltungspunkte']
+    assert data['abwasserknoten'] == [] and data['kanale'] == []
+
+    with pytest.raises(ValueError):
+        parser.parse(TEST_FILES[0], config, include='Schacht')
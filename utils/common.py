@@ -3,33 +3,254 @@ import math
 import ifcopenshell
 import ifcopenshell.util.element
 import uuid
+import hashlib
+import time
 import configparser
 import os
 
+# Distance in metres below which cartesian points are merged by the geometry pool
+POINT_TOLERANCE = 1e-6
+
+# Levels of detail of the geometry: axes and points, solids without booleans, full geometry
+LOD_AXIS = 'lod0'
+LOD_SOLID = 'lod1'
+LOD_FULL = 'full'
+LOD_MODES = (LOD_AXIS, LOD_SOLID, LOD_FULL)
+
+def check_lod(lod):
+    # Normalised level of detail, or ValueError for an unknown one
+    value = str(lod).strip().lower()
+    if value not in LOD_MODES:
+        raise ValueError(f"Unbekannte Detailstufe: {lod} (erlaubt: {', '.join(LOD_MODES)})")
+    return value
+
+def check_tile_size(tile_size):
+    # Tile edge length in metres as float (0 = no tiles), or ValueError for a negative or non-finite one
+    try:
+        value = float(tile_size)
+    except (TypeError, ValueError):
+        value = math.nan
+    if not math.isfinite(value) or value < 0:
+        raise ValueError(f"Ungültige Kachelgrösse: {tile_size} (erlaubt: 0 oder eine positive Zahl in Metern)")
+    return value
+
 def generate_guid():
     """Generates a unique GUID."""
     return ifcopenshell.guid.compress(uuid.uuid1().hex)
 
+# Namespace of the name-based GlobalIds (uuid5 of the model name, then of the key)
+GUID_NAMESPACE = uuid.UUID('5b0e6f1a-3c47-5d2e-9a8b-7f4c2e1d0a93')
+
+# Alphabet of the 22 character IFC GlobalId encoding and all pairs of its digits (12 bits)
+GUID_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_$"
+GUID_PAIRS = [first + second for first in GUID_CHARS for second in GUID_CHARS]
+
+def compress_guid(value):
+    # IFC GlobalId of a 128 bit UUID value, equal to ifcopenshell.guid.compress: the bits are
+    # padded to 132 and read as 11 pairs of 6 bit digits
+    return ''.join([GUID_PAIRS[(value >> shift) & 0xFFF] for shift in range(120, -1, -12)])
+
+class GuidProvider:
+    # GlobalIds of an IFC file. With deterministic, a GlobalId is the uuid5 of the model name
+    # and a key naming the object (TID and role, or the GlobalIds it relates), so repeated
+    # conversions produce the same ids. prefetch computes the ids of many keys up front.
+    # Ids already issued or present in the file are not reused: a repeated key (duplicate
+    # TID) gets the id of the key with an occurrence number. Otherwise ids are random.
+    # Entities every file has once (project, site, groups, types) are keyed by file_guid with
+    # the scope, e.g. the tile, so they differ between the files of one model; relationships
+    # and property sets are keyed by these GlobalIds and follow.
+    def __init__(self, ifc_file, model=None, deterministic=True, scope=None):
+        self.deterministic = deterministic
+        self.scope = scope
+        self.namespace = uuid.uuid5(GUID_NAMESPACE, model or '').bytes
+        self.issued = {entity.GlobalId for entity in ifc_file.by_type("IfcRoot")}
+        self.cache = {}
+
+    def compute(self, key):
+        # uuid.uuid5(namespace, name) without building UUID objects
+        name = '/'.join(str(part) for part in key)
+        value = int.from_bytes(hashlib.sha1(self.namespace + name.encode('utf-8')).digest()[:16], 'big')
+        value = (value & ~(0xF << 76)) | (5 << 76)
+        value = (value & ~(0x3 << 62)) | (0x2 << 62)
+        return compress_guid(value)
+
+    def prefetch(self, keys):
+        if not self.deterministic:
+            return
+        self.cache.update((key, self.compute(key)) for key in dict.fromkeys(keys) if key not in self.cache)
+
+    def prefetch_elements(self, tids, pset_name):
+        # Ids of the elements with these TIDs, their property sets named pset_name and the relationships
+        if not self.deterministic:
+            return
+        self.prefetch([(tid, 'element') for tid in tids])
+        owners = [self.cache[(tid, 'element')] for tid in tids]
+        self.prefetch([(owner, 'pset', pset_name) for owner in owners] + [(owner, 'relation', pset_name) for owner in owners])
+
+    def file_guid(self, *key):
+        return self.guid(*key, self.scope) if self.scope is not None else self.guid(*key)
+
+    def guid(self, *key):
+        if not self.deterministic:
+            return generate_guid()
+        guid = self.cache.pop(key, None) or self.compute(key)
+        occurrence = 1
+        while guid in self.issued:
+            occurrence += 1
+            guid = self.compute(key + (occurrence,))
+        self.issued.add(guid)
+        return guid
+
+def file_timestamp():
+    # Header time stamp of reproducible files: SOURCE_DATE_EPOCH if set, else the epoch
+    epoch = int(os.environ.get('SOURCE_DATE_EPOCH', 0))
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(epoch))
+
 def create_cartesian_point(ifc_file, coordinates):
     if any(coord is None or math.isinf(coord) for coord in coordinates):
         logging.warning(f"Ungültige Koordinaten: {coordinates}")
         return None
     return ifc_file.create_entity('IfcCartesianPoint', Coordinates=coordinates)
-def add_color(ifc_file, ifc_element, farbe, context):
-    color_map = {
-        "Grün": (0.0, 1.0, 0.0),
-        "Orange": (1.0, 0.65, 0.0),
-        "Rot": (1.0, 0.0, 0.0),
-        "Blau": (0.0, 0.0, 1.0)
-    }
-    rgb = color_map.get(farbe, (1.0, 1.0, 1.0))
-
-    surface_colour = ifc_file.create_entity("IfcColourRgb", Red=rgb[0], Green=rgb[1], Blue=rgb[2])
-    surface_style_rendering = ifc_file.create_entity("IfcSurfaceStyleRendering", SurfaceColour=surface_colour)
-    surface_style = ifc_file.create_entity("IfcSurfaceStyle", Side="BOTH", Styles=[surface_style_rendering])
-    styled_item = ifc_file.create_entity("IfcStyledItem", Item=ifc_element.Representation.Representations[0].Items[0], Styles=[surface_style])
-
-def create_local_placement(ifc_file, point, direction=None, relative_to=None):
+# Colours used to mark elements by the completeness of their data
+COLOR_MAP = {
+    "Grün": (0.0, 1.0, 0.0),
+    "Orange": (1.0, 0.65, 0.0),
+    "Rot": (1.0, 0.0, 0.0),
+    "Blau": (0.0, 0.0, 1.0)
+}
+
+class SurfaceStyles:
+    # Surface styles of an IFC file, created once per colour and shared by all elements.
+    # Styles already present in the file (named by colour) are reused. The styled items are
+    # collected by add and created together by flush once all elements exist.
+    def __init__(self, ifc_file):
+        self.ifc_file = ifc_file
+        self.styles = {style.Name: style for style in ifc_file.by_type("IfcSurfaceStyle") if style.Name}
+        self.pending = []
+
+    def style(self, farbe):
+        style = self.styles.get(farbe)
+        if style is None:
+            rgb = COLOR_MAP.get(farbe, (1.0, 1.0, 1.0))
+            surface_colour = self.ifc_file.create_entity("IfcColourRgb", Red=rgb[0], Green=rgb[1], Blue=rgb[2])
+            surface_style_rendering = self.ifc_file.create_entity("IfcSurfaceStyleRendering", SurfaceColour=surface_colour)
+            style = self.styles[farbe] = self.ifc_file.create_entity("IfcSurfaceStyle", Name=farbe, Side="BOTH", Styles=[surface_style_rendering])
+        return style
+
+    def add(self, item, farbe):
+        self.pending.append((item, farbe))
+
+    def flush(self):
+        for item, farbe in self.pending:
+            self.ifc_file.create_entity("IfcStyledItem", Item=item, Styles=[self.style(farbe)])
+        self.pending = []
+
+class Relationships:
+    # Spatial containment and group assignments of an IFC file, collected while the elements
+    # are created. flush writes one IfcRelContainedInSpatialStructure per spatial structure and
+    # one IfcRelAssignsToGroup per group, extending the relationships already in the file.
+    def __init__(self, ifc_file, guids):
+        self.ifc_file = ifc_file
+        self.guids = guids
+        # Structure or group id -> (structure or group, elements)
+        self.contained = {}
+        self.assigned = {}
+
+    def contain(self, element, structure):
+        self.contained.setdefault(structure.id(), (structure, []))[1].append(element)
+
+    def assign(self, element, group):
+        self.assigned.setdefault(group.id(), (group, []))[1].append(element)
+
+    def flush(self):
+        for structure, elements in self.contained.values():
+            relationship = next(iter(structure.ContainsElements), None)
+            if relationship is None:
+                self.ifc_file.create_entity("IfcRelContainedInSpatialStructure",
+                    GlobalId=self.guids.guid(structure.GlobalId, 'contains'), RelatedElements=elements, RelatingStructure=structure)
+            else:
+                relationship.RelatedElements = list(relationship.RelatedElements) + elements
+
+        for group, elements in self.assigned.values():
+            relationship = next(iter(group.IsGroupedBy), None)
+            if relationship is None:
+                self.ifc_file.create_entity("IfcRelAssignsToGroup",
+                    GlobalId=self.guids.guid(group.GlobalId, 'assigns'), RelatedObjects=elements, RelatingGroup=group)
+            else:
+                relationship.RelatedObjects = list(relationship.RelatedObjects) + elements
+
+        self.contained = {}
+        self.assigned = {}
+
+class GeometryPool:
+    # Interning of geometric primitives of an IFC file. Directions, cartesian points (merged
+    # on a grid of POINT_TOLERANCE), axis placements and circle profiles are created once and
+    # referenced by every entity that uses them. Primitives already in the file are registered
+    # first, so incremental updates share them as well.
+    def __init__(self, ifc_file, tolerance=POINT_TOLERANCE):
+        self.ifc_file = ifc_file
+        self.tolerance = tolerance
+        self.points = {}
+        self.directions = {}
+        self.placements = {}
+        self.profiles = {}
+        for point in ifc_file.by_type("IfcCartesianPoint"):
+            self.points.setdefault(self.point_key(point.Coordinates), point)
+        for direction in ifc_file.by_type("IfcDirection"):
+            self.directions.setdefault(tuple(direction.DirectionRatios), direction)
+        for placement in ifc_file.by_type("IfcAxis2Placement3D"):
+            self.placements.setdefault(self.placement_key(placement.Location, placement.Axis, placement.RefDirection), placement)
+        for profile in ifc_file.by_type("IfcCircleProfileDef", include_subtypes=False):
+            if profile.ProfileType == "AREA" and profile.ProfileName is None and profile.Position is None:
+                self.profiles.setdefault(profile.Radius, profile)
+
+    def point_key(self, coordinates):
+        return tuple(round(coord / self.tolerance) for coord in coordinates)
+
+    @staticmethod
+    def placement_key(location, axis, ref_direction):
+        return tuple(entity.id() if entity is not None else None for entity in (location, axis, ref_direction))
+
+    def point(self, coordinates):
+        # Point within the tolerance of the coordinates, or None for invalid coordinates
+        if any(coord is None or math.isinf(coord) for coord in coordinates):
+            return create_cartesian_point(self.ifc_file, coordinates)
+        key = self.point_key(coordinates)
+        point = self.points.get(key)
+        if point is None:
+            point = self.points[key] = create_cartesian_point(self.ifc_file, tuple(coordinates))
+        return point
+
+    def direction(self, ratios):
+        ratios = tuple(float(ratio) for ratio in ratios)
+        direction = self.directions.get(ratios)
+        if direction is None:
+            direction = self.directions[ratios] = self.ifc_file.create_entity("IfcDirection", DirectionRatios=ratios)
+        return direction
+
+    def placement(self, location, axis=None, ref_direction=None):
+        # IfcAxis2Placement3D at the location (coordinates) with optional axis and reference direction ratios
+        location = self.point(location)
+        axis = self.direction(axis) if axis is not None else None
+        ref_direction = self.direction(ref_direction) if ref_direction is not None else None
+        key = self.placement_key(location, axis, ref_direction)
+        placement = self.placements.get(key)
+        if placement is None:
+            placement = self.placements[key] = self.ifc_file.create_entity("IfcAxis2Placement3D",
+                Location=location, Axis=axis, RefDirection=ref_direction)
+        return placement
+
+    def circle_profile(self, radius):
+        profile = self.profiles.get(radius)
+        if profile is None:
+            profile = self.profiles[radius] = self.ifc_file.create_entity("IfcCircleProfileDef", ProfileType="AREA", Radius=radius)
+        return profile
+
+def create_local_placement(ifc_file, point, direction=None, relative_to=None, pool=None):
+    if pool is not None:
+        axis2placement = pool.placement(point, direction, (1.0, 0.0, 0.0) if direction else None)
+        return ifc_file.create_entity('IfcLocalPlacement', PlacementRelTo=relative_to, RelativePlacement=axis2placement)
+
     location = create_cartesian_point(ifc_file, point)
     if direction:
         axis = ifc_file.create_entity("IfcDirection", DirectionRatios=direction)
@@ -84,6 +305,78 @@ def add_property_set(ifc_file, ifc_object, name, properties=None):
         RelatedObjects=[ifc_object]
     )
 
+class ElementTypes:
+    # Type objects of an IFC file, one per class and combination of recurring property values.
+    # The recurring values form a type-level property set that the occurrences inherit; only
+    # per-instance values stay in the occurrence's property set of the same name. Property
+    # values are interned by name and value and shared by all property sets. flush writes one
+    # IfcRelDefinesByType per type. Types and properties already in the file are reused.
+    def __init__(self, ifc_file, guids, classes=("IfcPipeSegmentType", "IfcDistributionChamberElementType")):
+        self.ifc_file = ifc_file
+        self.guids = guids
+        self.properties = {}
+        self.types = {}
+        # Type id -> (type, occurrences)
+        self.pending = {}
+        for prop in ifc_file.by_type("IfcPropertySingleValue"):
+            if prop.NominalValue is not None and prop.NominalValue.is_a("IfcText"):
+                self.properties.setdefault((prop.Name, prop.NominalValue.wrappedValue), prop)
+        for ifc_class in classes:
+            for element_type in ifc_file.by_type(ifc_class):
+                for pset in element_type.HasPropertySets or ():
+                    values = tuple((prop.Name, prop.NominalValue.wrappedValue if prop.NominalValue else None) for prop in pset.HasProperties)
+                    self.types.setdefault((ifc_class, pset.Name, values), element_type)
+
+    def property(self, name, value):
+        prop = self.properties.get((name, value))
+        if prop is None:
+            prop = self.properties[(name, value)] = create_property_single_value(self.ifc_file, name, value)
+        return prop
+
+    def property_set(self, owner, name, properties):
+        # Property set of the type or element with the GlobalId owner
+        return self.ifc_file.create_entity("IfcPropertySet",
+            GlobalId=self.guids.guid(owner, 'pset', name),
+            Name=name,
+            HasProperties=[self.property(key, value) for key, value in properties.items()]
+        )
+
+    def element_type(self, ifc_class, pset_name, properties):
+        # Type of the class carrying the recurring properties in a property set named pset_name
+        key = (ifc_class, pset_name, tuple(properties.items()))
+        element_type = self.types.get(key)
+        if element_type is None:
+            name = " / ".join(str(value) for value in properties.values() if value) or pset_name
+            global_id = self.guids.file_guid('type', ifc_class, pset_name, *(value for item in properties.items() for value in item))
+            element_type = self.types[key] = self.ifc_file.create_entity(ifc_class,
+                GlobalId=global_id,
+                Name=name,
+                HasPropertySets=[self.property_set(global_id, pset_name, properties)],
+                PredefinedType="NOTDEFINED"
+            )
+        return element_type
+
+    def assign(self, element, element_type):
+        self.pending.setdefault(element_type.id(), (element_type, []))[1].append(element)
+
+    def add_property_set(self, element, name, properties):
+        # Occurrence property set of the per-instance values
+        self.ifc_file.create_entity("IfcRelDefinesByProperties",
+            GlobalId=self.guids.guid(element.GlobalId, 'relation', name),
+            RelatingPropertyDefinition=self.property_set(element.GlobalId, name, properties),
+            RelatedObjects=[element]
+        )
+
+    def flush(self):
+        for element_type, elements in self.pending.values():
+            relationship = next(iter(element_type.Types), None)
+            if relationship is None:
+                self.ifc_file.create_entity("IfcRelDefinesByType",
+                    GlobalId=self.guids.guid(element_type.GlobalId, 'types'), RelatedObjects=elements, RelatingType=element_type)
+            else:
+                relationship.RelatedObjects = list(relationship.RelatedObjects) + elements
+        self.pending = {}
+
 def read_config():
     config = configparser.ConfigParser()
     config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config', 'config.txt')
@@ -98,5 +391,14 @@ def read_config():
         'default_wanddicke': config.getfloat('Defaults', 'default_wanddicke'),
         'default_bodendicke': config.getfloat('Defaults', 'default_bodendicke'),
         'default_rohrdicke': config.getfloat('Defaults', 'default_rohrdicke'),
-        'einfaerben': config.getboolean('Defaults', 'einfaerben')
+        'einfaerben': config.getboolean('Defaults', 'einfaerben'),
+        'xml_backend': config.get('Parser', 'xml_backend', fallback='auto'),
+        'max_objects': config.getint('Parser', 'max_objects', fallback=0),
+        'parse_workers': config.getint('Parser', 'parse_workers', fallback=0),
+        'incremental': config.getboolean('IFC', 'incremental', fallback=False),
+        'tile_size': config.getfloat('IFC', 'tile_size', fallback=0.0),
+        'tile_workers': config.getint('IFC', 'tile_workers', fallback=0),
+        'streaming_writer': config.getboolean('IFC', 'streaming_writer', fallback=False),
+        'stable_guids': config.getboolean('IFC', 'stable_guids', fallback=True),
+        'lod': config.get('IFC', 'lod', fallback=LOD_FULL)
     }
\ No newline at end of file
@@ -1,13 +1,162 @@
+import logging
 import ifcopenshell
-from utils.common import add_color, generate_guid, create_local_placement, create_cartesian_point, create_property_single_value
+from utils.common import LOD_AXIS, LOD_SOLID, LOD_FULL
+
+# Properties of the shaft property set held by the shaft type; the others vary per shaft
+SHAFT_TYPE_PROPERTIES = ("Höhe", "Durchmesser", "Funktion", "Material")
+
+class ShaftShapes:
+    # Library of shaft geometries. Every distinct combination of radius, height, inner radius,
+    # floor thickness and colour is built once as an IfcRepresentationMap in the local frame of
+    # the shaft and placed by an IfcMappedItem. Maps already in the file are recognised by their
+    # items, so incremental updates reuse them. The level of detail selects the geometry: LOD_FULL
+    # cuts the inner cylinder from the outer one, LOD_SOLID extrudes a hollow circle profile
+    # without a boolean operation and LOD_AXIS represents the shaft by the point at its floor.
+    def __init__(self, ifc_file, context, styles, pool, lod=LOD_FULL):
+        self.ifc_file = ifc_file
+        self.context = context
+        self.styles = styles
+        self.pool = pool
+        self.lod = lod
+        self.maps = {}
+        # Identity transformation shared by all mapped items
+        self.identity = next((item.MappingTarget for item in ifc_file.by_type("IfcMappedItem")), None)
+        for representation_map in ifc_file.by_type("IfcRepresentationMap"):
+            key = self.key_of(representation_map)
+            if key is not None:
+                self.maps.setdefault(key, representation_map)
+
+    @staticmethod
+    def key(radius, hoehe, inner_radius, bodendicke, farbe):
+        # Dimensions rounded to micrometres, so maps read back from a file match again
+        dimensions = tuple(round(value, 6) if value is not None else None for value in (radius, hoehe, inner_radius, bodendicke))
+        return dimensions + (farbe,)
+
+    def key_of(self, representation_map):
+        # Key of a map written by shape, or None for other maps
+        items = representation_map.MappedRepresentation.Items
+        first = items[0]
+        if len(items) == 1 and first.is_a("IfcExtrudedAreaSolid"):
+            dimensions = (first.SweptArea.Radius, first.Depth, None, None)
+        elif len(items) == 2 and first.is_a("IfcBooleanResult"):
+            dimensions = (first.FirstOperand.SweptArea.Radius, first.FirstOperand.Depth, first.SecondOperand.SweptArea.Radius, items[1].Depth)
+        elif len(items) == 2 and first.is_a("IfcExtrudedAreaSolid") and first.SweptArea.is_a("IfcCircleHollowProfileDef"):
+            dimensions = (first.SweptArea.Radius, first.Depth, first.SweptArea.Radius - first.SweptArea.WallThickness, items[1].Depth)
+        else:
+            return None
+        styled_items = [inverse for inverse in self.ifc_file.get_inverse(first) if inverse.is_a("IfcStyledItem")]
+        farbe = styled_items[0].Styles[0].Name if styled_items else None
+        return self.key(*dimensions, farbe)
+
+    def extrusion(self, radius, depth):
+        return self.ifc_file.create_entity("IfcExtrudedAreaSolid",
+            SweptArea=self.pool.circle_profile(radius), ExtrudedDirection=self.pool.direction((0.0, 0.0, 1.0)), Depth=depth)
+
+    def representation_map(self, radius, hoehe, inner_radius, bodendicke, farbe):
+        key = self.key(radius, hoehe, inner_radius, bodendicke, farbe)
+        representation_map = self.maps.get(key)
+        if representation_map is not None:
+            return representation_map
+
+        if inner_radius is None:
+            items = [self.extrusion(radius, hoehe)]
+        elif self.lod == LOD_SOLID:
+            wall = self.ifc_file.create_entity("IfcExtrudedAreaSolid",
+                SweptArea=self.ifc_file.create_entity("IfcCircleHollowProfileDef", ProfileType="AREA", Radius=radius, WallThickness=radius - inner_radius),
+                ExtrudedDirection=self.pool.direction((0.0, 0.0, 1.0)), Depth=hoehe)
+            items = [wall, self.extrusion(inner_radius, bodendicke)]
+        else:
+            boolean_result = self.ifc_file.create_entity("IfcBooleanResult", Operator="DIFFERENCE",
+                FirstOperand=self.extrusion(radius, hoehe), SecondOperand=self.extrusion(inner_radius, hoehe))
+            items = [boolean_result, self.extrusion(inner_radius, bodendicke)]
+        self.styles.add(items[0], farbe)
+
+        representation_map = self.maps[key] = self.ifc_file.create_entity("IfcRepresentationMap",
+            MappingOrigin=self.pool.placement((0.0, 0.0, 0.0)),
+            MappedRepresentation=self.ifc_file.create_entity("IfcShapeRepresentation",
+                ContextOfItems=self.context,
+                RepresentationIdentifier="Body",
+                RepresentationType="SweptSolid",
+                Items=items
+            )
+        )
+        return representation_map
+
+    def shape(self, radius, hoehe, inner_radius, bodendicke, farbe):
+        # Product shape placing the shared geometry at the origin of the shaft's placement.
+        # Without inner_radius the shaft is a solid cylinder, otherwise a hollow one with a floor.
+        if self.lod == LOD_AXIS:
+            return self.ifc_file.create_entity("IfcProductDefinitionShape",
+                Representations=[self.ifc_file.create_entity("IfcShapeRepresentation",
+                    ContextOfItems=self.context,
+                    RepresentationIdentifier="Reference",
+                    RepresentationType="Point",
+                    Items=[self.pool.point((0.0, 0.0, 0.0))]
+                )]
+            )
+        if self.identity is None:
+            self.identity = self.ifc_file.create_entity("IfcCartesianTransformationOperator3D",
+                LocalOrigin=self.pool.point((0.0, 0.0, 0.0)))
+        mapped_item = self.ifc_file.create_entity("IfcMappedItem",
+            MappingSource=self.representation_map(radius, hoehe, inner_radius, bodendicke, farbe),
+            MappingTarget=self.identity
+        )
+        return self.ifc_file.create_entity("IfcProductDefinitionShape",
+            Representations=[self.ifc_file.create_entity("IfcShapeRepresentation",
+                ContextOfItems=self.context,
+                RepresentationIdentifier="Body",
+                RepresentationType="MappedRepresentation",
+                Items=[mapped_item]
+            )]
+        )
+
+def shaft_color(ns, abwasserknoten, data):
+    # Colour of a shaft: with 'einfaerben' by the number of missing values, otherwise blue
+    einfaerben = data['einfaerben']
+    fehlende_werte = 0
+    farbe = "Blau"
+    if einfaerben:
+        # Prüfe Dimension1 (Höhe)
+        if ns.get('dimorg1') == '0' or not ns.get('dimorg1'):
+            fehlende_werte += 1
+        
+        # Prüfe Dimension2 (Durchmesser)
+        if ns.get('dimorg2') == '0' or not ns.get('dimorg2'):
+            fehlende_werte += 1
+        
+        # Prüfe Sohlenkote
+        if abwasserknoten:
+            kote = abwasserknoten.get('kote')
+            if kote is None or kote == '' or kote == '0':
+                fehlende_werte += 1
+            else:
+                try:
+                    float_kote = float(kote)
+                    if float_kote == 0 or float_kote == data.get('default_sohlenkote', 0):
+                        fehlende_werte += 1
+                except ValueError:
+                    fehlende_werte += 1
+        else:
+            # Wenn kein Abwasserknoten vorhanden ist
+            fehlende_werte += 1
 
-def create_ifc_normschacht(ifc_file, ns, abwasserknoten, facility, context, abwasserknoten_group, data):
+        # Bestimme die Farbe basierend auf fehlenden Werten
+        if fehlende_werte == 0:
+            farbe = "Grün"
+        elif fehlende_werte == 1:
+            farbe = "Orange"
+        else:  # fehlende_werte >= 2
+            farbe = "Rot"
+
+    logging.debug(f"Fehlende Werte: {fehlende_werte}, Farbe: {farbe}")
+    return farbe
+
+def create_ifc_normschacht(ifc_file, ns, abwasserknoten, facility, context, abwasserknoten_group, data, shapes, relationships, types, guids):
     default_sohlenkote = data['default_sohlenkote']
     default_durchmesser = data['default_durchmesser']
     default_hoehe = data['default_hoehe']
     default_wanddicke = data['default_wanddicke']
     default_bodendicke = data['default_bodendicke']
-    einfaerben = data['einfaerben']
 
     if abwasserknoten:
         lage = abwasserknoten.get('lage', {})
@@ -36,44 +185,21 @@ def create_ifc_normschacht(ifc_file, ns, abwasserknoten, facility, context, abwa
     wanddicke = default_wanddicke
     bodendicke = default_bodendicke
 
-    base_center = create_cartesian_point(ifc_file, (x_mitte, y_mitte, z_mitte))
-    axis = ifc_file.create_entity("IfcDirection", DirectionRatios=(0.0, 0.0, 1.0))
-    axis_placement = ifc_file.create_entity("IfcAxis2Placement3D", Location=base_center, Axis=axis)
+    axis_placement = shapes.pool.placement((x_mitte, y_mitte, z_mitte), (0.0, 0.0, 1.0))
     ifc_local_placement = ifc_file.create_entity("IfcLocalPlacement", RelativePlacement=axis_placement)
 
+    farbe = shaft_color(ns, abwasserknoten, data)
     if breite <= 2 * wanddicke:
-        profile = ifc_file.create_entity("IfcCircleProfileDef", ProfileType="AREA", Radius=radius)
-        body = ifc_file.create_entity("IfcExtrudedAreaSolid", SweptArea=profile, ExtrudedDirection=axis, Depth=hoehe)
-        items = [body]
+        representation = shapes.shape(radius, hoehe, None, None, farbe)
     else:
-        outer_profile = ifc_file.create_entity("IfcCircleProfileDef", ProfileType="AREA", Radius=radius)
-        outer_body = ifc_file.create_entity("IfcExtrudedAreaSolid", SweptArea=outer_profile, ExtrudedDirection=axis, Depth=hoehe)
-
-        inner_radius = radius - wanddicke
-        inner_profile = ifc_file.create_entity("IfcCircleProfileDef", ProfileType="AREA", Radius=inner_radius)
-        inner_body = ifc_file.create_entity("IfcExtrudedAreaSolid", SweptArea=inner_profile, ExtrudedDirection=axis, Depth=hoehe)
-
-        boolean_result = ifc_file.create_entity("IfcBooleanResult", Operator="DIFFERENCE", FirstOperand=outer_body, SecondOperand=inner_body)
-
-        bottom_profile = ifc_file.create_entity("IfcCircleProfileDef", ProfileType="AREA", Radius=inner_radius)
-        bottom_body = ifc_file.create_entity("IfcExtrudedAreaSolid", SweptArea=bottom_profile, ExtrudedDirection=axis, Depth=bodendicke)
-
-        bottom_placement = create_local_placement(ifc_file, [x_mitte, y_mitte, z_mitte - bodendicke])
-        
-        items = [boolean_result, bottom_body]
+        representation = shapes.shape(radius, hoehe, radius - wanddicke, bodendicke, farbe)
 
     schacht = ifc_file.create_entity("IfcDistributionChamberElement",
-        GlobalId=generate_guid(),
+        GlobalId=guids.guid(ns.get('id'), 'element'),
         Name=ns.get('bezeichnung', 'Normschacht'),
         ObjectPlacement=ifc_local_placement,
-        Representation=ifc_file.create_entity("IfcProductDefinitionShape",
-            Representations=[ifc_file.create_entity("IfcShapeRepresentation",
-                ContextOfItems=context,
-                RepresentationIdentifier="Body",
-                RepresentationType="SweptSolid",
-                Items=items
-            )]
-        )
+        Tag=ns.get('id'),
+        Representation=representation
     )
     
     properties = {
@@ -104,68 +230,14 @@ def create_ifc_normschacht(ifc_file, ns, abwasserknoten, facility, context, abwa
                 pass  # Ungültiger Wert, ignorieren
 
 
-    # Property Set
-    property_set = ifc_file.create_entity("IfcPropertySet",
-        GlobalId=generate_guid(),
-        Name="TBAKTZH STRE Schacht",
-        HasProperties=[create_property_single_value(ifc_file, key, value) for key, value in properties.items()]
-    )
-
-    # Verknüpfung Property Set mit Schacht
-    ifc_file.create_entity("IfcRelDefinesByProperties",
-        GlobalId=generate_guid(),
-        RelatingPropertyDefinition=property_set,
-        RelatedObjects=[schacht]
-    )
+    # Property Set: wiederkehrende Werte am Schachttyp, die übrigen am Schacht
+    schacht_typ = types.element_type("IfcDistributionChamberElementType", "TBAKTZH STRE Schacht",
+        {key: properties[key] for key in SHAFT_TYPE_PROPERTIES})
+    types.assign(schacht, schacht_typ)
+    types.add_property_set(schacht, "TBAKTZH STRE Schacht",
+        {key: value for key, value in properties.items() if key not in SHAFT_TYPE_PROPERTIES})
 
-    ifc_file.create_entity("IfcRelContainedInSpatialStructure",
-        GlobalId=generate_guid(),
-        RelatedElements=[schacht],
-        RelatingStructure=facility
-    )
+    relationships.contain(schacht, facility)
 
     if abwasserknoten:
-        ifc_file.create_entity("IfcRelAssignsToGroup",
-            GlobalId=generate_guid(),
-            RelatedObjects=[schacht],
-            RelatingGroup=abwasserknoten_group
-        )
-
-    fehlende_werte = 0
-    farbe = "Blau"
-    if einfaerben:
-        # Prüfe Dimension1 (Höhe)
-        if ns.get('dimorg1') == '0' or not ns.get('dimorg1'):
-            fehlende_werte += 1
-        
-        # Prüfe Dimension2 (Durchmesser)
-        if ns.get('dimorg2') == '0' or not ns.get('dimorg2'):
-            fehlende_werte += 1
-        
-        # Prüfe Sohlenkote
-        if abwasserknoten:
-            kote = abwasserknoten.get('kote')
-            if kote is None or kote == '' or kote == '0':
-                fehlende_werte += 1
-            else:
-                try:
-                    float_kote = float(kote)
-                    if float_kote == 0 or float_kote == data.get('default_sohlenkote', 0):
-                        fehlende_werte += 1
-                except ValueError:
-                    fehlende_werte += 1
-        else:
-            # Wenn kein Abwasserknoten vorhanden ist
-            fehlende_werte += 1
-
-        # Bestimme die Farbe basierend auf fehlenden Werten
-        if fehlende_werte == 0:
-            farbe = "Grün"
-        elif fehlende_werte == 1:
-            farbe = "Orange"
-        else:  # fehlende_werte >= 2
-            farbe = "Rot"
-
-    print(f"Fehlende Werte: {fehlende_werte}, Farbe: {farbe}")  # Debugging-Ausgabe
-
-    add_color(ifc_file, schacht, farbe, context)
\ No newline at end of file
+        relationships.assign(schacht, abwasserknoten_group)
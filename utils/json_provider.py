@@ -0,0 +1,16 @@
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+from models.records import Record
+
+class RecordJSONProvider(DefaultJSONProvider):
+    # JSON provider for parse results: records through to_dict(), NumPy arrays and
+    # scalars as plain lists and numbers; everything else as in Flask's default provider
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o.to_dict()
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        if isinstance(o, np.generic):
+            return o.item()
+        return DefaultJSONProvider.default(o)
@@ -0,0 +1,141 @@
+import os
+import mmap
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from models.xtf_model import XTFParser, PARSER_VERSION, ENTITY_CLASSES, select_entities
+from models.records import RECORD_SIZE, VERTEX_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Memory budget of the parse cache
+PARSE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Number of file names remembered for lookups of earlier uploads
+PARSE_CACHE_MAX_NAMES = 1024
+
+# Config values that change the parse result; all other values are merged into the data per call
+PARSE_CONFIG_KEYS = ('default_sohlenkote', 'default_durchmesser', 'default_hoehe')
+
+def file_hash(source):
+    # SHA-256 of the file content; source is a path or a binary file object, which is rewound
+    digest = hashlib.sha256()
+    if isinstance(source, mmap.mmap):
+        digest.update(source)
+        return digest.hexdigest()
+    if hasattr(source, 'read'):
+        position = source.tell()
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(chunk)
+        source.seek(position)
+        return digest.hexdigest()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def estimate_size(data):
+    # Estimate the memory held by a parse result from its record and vertex counts
+    records = sum(len(data[key]) for key in ('abwasserknoten', 'haltungspunkte', 'normschachte', 'kanale', 'haltungen'))
+    vertices = sum(len(haltung['verlauf']) for haltung in data['haltungen'])
+    return records * RECORD_SIZE + vertices * VERTEX_SIZE
+
+class ParseCache:
+    # In-process LRU cache of parse results keyed by file content hash, parser version,
+    # the parse-relevant config values and the selected object classes. Entries are evicted least recently used
+    # first once the estimated size of all entries exceeds max_bytes.
+    def __init__(self, max_bytes=PARSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        # File name -> (content hash, selected object classes) of the last parse under that name
+        self.names = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, content_hash, config, entities=ENTITY_CLASSES):
+        return (content_hash, PARSER_VERSION, entities) + tuple(config[key] for key in PARSE_CONFIG_KEYS)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, data, index):
+        size = estimate_size(data)
+        entry = (data, index, size)
+        if size > self.max_bytes:
+            logger.info(f"Parse-Ergebnis ({size} Bytes) ist grösser als der Cache und wird nicht gespeichert.")
+            return entry
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[2]
+            self.entries[key] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted[2]
+        return entry
+
+    def parse(self, source, config, streaming=False, name=None, include=None, exclude=None):
+        # Return (data, index) for the file, parsing it only if no cached result exists.
+        # source is a path or a binary file object; with a name the result can be looked up again.
+        # include/exclude select the object classes as in XTFParser.parse.
+        entities = select_entities(include, exclude)
+        content_hash = file_hash(source)
+        key = self.key(content_hash, config, entities)
+        entry = self.get(key)
+        if entry is None:
+            parser = XTFParser()
+            data = parser.parse(source, config, streaming=streaming, include=entities)
+            entry = self.put(key, data, parser.index)
+        else:
+            logger.info(f"Verwende zwischengespeichertes Parse-Ergebnis für {name or source}")
+
+        if name is not None:
+            with self.lock:
+                self.names.pop(name, None)
+                self.names[name] = (content_hash, entities)
+                while len(self.names) > PARSE_CACHE_MAX_NAMES:
+                    self.names.popitem(last=False)
+        return self.result(entry, config)
+
+    def cached(self, name, config):
+        # Whether the result last parsed under name is still in the cache
+        last = self.names.get(name)
+        return last is not None and self.get(self.key(last[0], config, last[1])) is not None
+
+    def lookup(self, name, config, path=None):
+        # (data, index) of the file last parsed under name. If it is not cached (too large, evicted,
+        # parsed by another process), the file at path is parsed again; without one, None.
+        last = self.names.get(name)
+        if last is not None:
+            content_hash, entities = last
+            entry = self.get(self.key(content_hash, config, entities))
+            if entry is not None:
+                return self.result(entry, config)
+        if path is None or not os.path.exists(path):
+            return None
+        logger.info(f"Parse-Ergebnis für {name} nicht im Cache, parse {path} erneut")
+        return self.parse(path, config, name=name, include=last[1] if last is not None else None)
+
+    def result(self, entry, config):
+        cached_data, index, _ = entry
+        # The records are shared between callers; only the top level reflects this call's config
+        data = dict(cached_data)
+        data.update(config)
+        data['model'] = cached_data['model']
+        return data, index
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.names.clear()
+            self.size = 0
+
+# Cache shared by the web routes, the API and the conversion controller
+parse_cache = ParseCache()